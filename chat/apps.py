@@ -1,6 +1,20 @@
+import logging
+
 from django.apps import AppConfig
 
+logger = logging.getLogger(__name__)
+
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        from core.config import memory_config
+
+        if memory_config.ENSURE_INDEXES_ON_STARTUP:
+            from core.conversation_indexes import ensure_conversation_indexes
+            try:
+                ensure_conversation_indexes()
+            except Exception as e:
+                logger.error("Could not ensure conversation indexes on startup: %s", e)
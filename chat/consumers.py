@@ -0,0 +1,49 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from core.generation_queue import user_group
+
+
+@database_sync_to_async
+def _user_for_token(raw_token: str):
+    authentication = JWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except Exception:
+        return AnonymousUser()
+
+
+class JWTQueryAuthMiddleware:
+    """Authenticates websockets with the same JWT as the REST API, passed as ``?token=``."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        token = parse_qs(scope.get("query_string", b"").decode()).get("token")
+        scope = dict(scope, user=await _user_for_token(token[0]) if token else AnonymousUser())
+        return await self.inner(scope, receive, send)
+
+
+class GenerationResultConsumer(AsyncJsonWebsocketConsumer):
+    """Pushes each finished queued generation of the connected user as ``{task_id, workload, status, body}``."""
+
+    async def connect(self):
+        user = self.scope["user"]
+        if not user.is_authenticated:
+            await self.close()
+            return
+        self.group = user_group(user.id)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, "group"):
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def generation_result(self, event):
+        await self.send_json({key: event[key] for key in ("task_id", "workload", "status", "body")})
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import Coalesce, Length
+
+from chat.models import Conversation
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized message/turn/size counters on every Conversation."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        conversations = Conversation.objects.annotate(
+            counted_messages=Count("messages"),
+            counted_turns=Count("messages", filter=Q(messages__is_user=True)),
+            counted_characters=Coalesce(Sum(Length("messages__content")), 0),
+            last_message_at=Max("messages__timestamp"),
+        ).order_by("pk")
+
+        updated, batch = 0, []
+        for conversation in conversations.iterator(chunk_size=batch_size):
+            conversation.message_count = conversation.counted_messages
+            conversation.turn_count = conversation.counted_turns
+            conversation.total_characters = conversation.counted_characters
+            conversation.total_tokens = (conversation.counted_characters + 3) // 4
+            conversation.last_activity_at = conversation.last_message_at
+            batch.append(conversation)
+            if len(batch) >= batch_size:
+                updated += self._flush(batch)
+        updated += self._flush(batch)
+        self.stdout.write(self.style.SUCCESS(f"Backfilled counters for {updated} conversations"))
+
+    def _flush(self, batch) -> int:
+        if not batch:
+            return 0
+        Conversation.objects.bulk_update(
+            batch, ["message_count", "turn_count", "total_characters", "total_tokens", "last_activity_at"]
+        )
+        count = len(batch)
+        batch.clear()
+        return count
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.conversation_indexes import ensure_conversation_indexes, explain_session_lookup
+
+
+class Command(BaseCommand):
+    help = "Create the conversation store's unique and TTL indexes in MongoDB."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--collection", default="conversations", help="Conversation collection name.")
+        parser.add_argument(
+            "--check", action="store_true",
+            help="Explain a session lookup afterwards and fail if it still scans the collection."
+        )
+
+    def handle(self, *args, **options):
+        created = ensure_conversation_indexes(options["collection"])
+        for name, indexes in created.items():
+            self.stdout.write(f"{name}: {', '.join(indexes)}")
+        if options["check"]:
+            plans = explain_session_lookup(options["collection"])
+            for name, stages in plans.items():
+                self.stdout.write(f"{name} plan: {' <- '.join(stages)}")
+                if "COLLSCAN" in stages:
+                    raise CommandError(f"Session lookup on {name} is a collection scan")
+        self.stdout.write(self.style.SUCCESS("Conversation indexes are in place"))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from core.conversation_store import MongoConversationStore
+
+
+class Command(BaseCommand):
+    help = "Move legacy single-document conversation histories into fixed-size message buckets."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--collection", action="append", dest="collections",
+            help="Conversation collection to migrate (repeatable). Defaults to 'conversations'."
+        )
+
+    def handle(self, *args, **options):
+        for collection_name in options["collections"] or ["conversations"]:
+            store = MongoConversationStore(collection_name, write_behind=False)
+            sessions = messages = 0
+            legacy = store.headers.find({"messages": {"$exists": True}}, {"session_id": 1, "user_id": 1})
+            for header in legacy:
+                messages += store.migrate_document(header["session_id"], header["user_id"])
+                sessions += 1
+            self.stdout.write(self.style.SUCCESS(
+                f"{collection_name}: migrated {sessions} sessions "
+                f"({messages} messages) into buckets"
+            ))
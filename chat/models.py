@@ -1,15 +1,51 @@
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 import uuid
 from django.contrib.auth import get_user_model
 
 
 User = get_user_model()
+
+def estimate_tokens(text: str) -> int:
+    # Rough 4-characters-per-token estimate; good enough for usage stats.
+    return (len(text) + 3) // 4
+
 class Conversation(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
     session_id = models.CharField(max_length=255, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized counters, maintained with F() updates alongside every message write.
+    message_count = models.PositiveIntegerField(default=0)
+    turn_count = models.PositiveIntegerField(default=0)
+    total_characters = models.PositiveBigIntegerField(default=0)
+    total_tokens = models.PositiveBigIntegerField(default=0)
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-updated_at'], name='chat_conv_user_updated_idx'),
+        ]
+
+    @classmethod
+    def record_turn(cls, pk, user_content: str, ai_content: str) -> int:
+        now = timezone.now()
+        return cls.objects.filter(pk=pk).update(
+            message_count=F('message_count') + 2,
+            turn_count=F('turn_count') + 1,
+            total_characters=F('total_characters') + len(user_content) + len(ai_content),
+            total_tokens=F('total_tokens') + estimate_tokens(user_content) + estimate_tokens(ai_content),
+            last_activity_at=now,
+            updated_at=now,
+        )
+
+    @classmethod
+    def reset_counters(cls, session_id: str) -> int:
+        return cls.objects.filter(session_id=session_id).update(
+            message_count=0, turn_count=0, total_characters=0, total_tokens=0, updated_at=timezone.now()
+        )
 
 class Message(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
@@ -20,4 +56,7 @@ class Message(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     
     class Meta:
-        ordering = ['timestamp']
\ No newline at end of file
+        ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['conversation', 'timestamp'], name='chat_msg_conv_ts_idx'),
+        ]
\ No newline at end of file
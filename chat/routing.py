@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .consumers import GenerationResultConsumer
+
+websocket_urlpatterns = [
+    path('ws/generations/', GenerationResultConsumer.as_asgi()),
+]
@@ -11,4 +11,9 @@ class ConversationSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Conversation
-        fields = ['id', 'session_id', 'created_at', 'updated_at', 'messages']
\ No newline at end of file
+        fields = ['id', 'session_id', 'created_at', 'updated_at', 'messages']
+
+class ConversationListSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Conversation
+        fields = ['id', 'session_id', 'created_at', 'updated_at']
\ No newline at end of file
@@ -0,0 +1,59 @@
+from celery import shared_task
+from django.db import transaction
+from rest_framework import status
+
+from core.generation_queue import run_generation
+from core.service import OllamaChatServiceSingleton
+from core.usage import use_user
+
+from .models import Conversation, Message
+from .serializers import MessageSerializer
+
+
+def generate_reply(user_id, conversation_id, session_id: str, user_message: str):
+    """Generate and store one chat turn; returns the ``SendMessageView`` body and status code."""
+    chat_service = OllamaChatServiceSingleton.get_service(user_id)
+    with use_user(user_id):
+        ai_response_data = chat_service.generate_response(session_id, user_message)
+    saved_turn = ai_response_data.get('saved_turn')
+    if saved_turn and isinstance(saved_turn[0], Message):
+        # The ORM transcript store already wrote both rows in one transaction.
+        user_msg, ai_msg = saved_turn
+    else:
+        with transaction.atomic():
+            user_msg, ai_msg = Message.objects.bulk_create([
+                Message(conversation_id=conversation_id, content=user_message, is_user=True, user_id=user_id),
+                Message(conversation_id=conversation_id, content=ai_response_data.get('response', ''), is_user=False, user_id=user_id),
+            ])
+            Conversation.record_turn(conversation_id, user_message, ai_msg.content)
+
+    response_data = {
+        "user_message": MessageSerializer(user_msg).data,
+        "ai_message": MessageSerializer(ai_msg).data,
+        "conversation_id": str(conversation_id),
+        "session_id": session_id,
+        "service_info": {
+            "method": ai_response_data.get('method', 'unknown'),
+            "success": ai_response_data.get('success', False),
+            "model_used": ai_response_data.get('model_used', 'llama2')
+        }
+    }
+
+    if status.HTTP_200_OK:
+        response_data["debug"] = {
+            "history_preview": ai_response_data.get('history', '')[:200] + "..." if ai_response_data.get('history') else 'No history',
+            "context_used": ai_response_data.get('context_used', '')[:200] + "..." if ai_response_data.get('context_used') else 'No context'
+        }
+
+    status_code = status.HTTP_200_OK if ai_response_data.get('success', False) else status.HTTP_207_MULTI_STATUS
+    return response_data, status_code
+
+
+@shared_task(bind=True, name="chat.generate_reply")
+def generate_reply_task(self, user_id, conversation_id, session_id: str, user_message: str,
+                        budget: float, enqueued_at: float, cache_bypass: bool = False):
+    return run_generation(
+        self.request.id, "chat", user_id, session_id, budget, enqueued_at,
+        lambda deadline: generate_reply(user_id, conversation_id, session_id, user_message),
+        cache_bypass=cache_bypass,
+    )
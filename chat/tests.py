@@ -1,3 +1,544 @@
-from django.test import TestCase
+import threading
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import fakeredis
+import mongomock
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+from mongoengine import get_db
+from rest_framework.test import APIClient
+
+from core.config import config, memory_config
+from core.conversation_store import MongoConversationStore, WriteBehindBuffer
+from core.deadline import Deadline, DeadlineExceeded, use_deadline
+from core.fair_scheduler import FairScheduler
+from core.generation_cache import GenerationCache, cache_route
+from core.hot_tier import RedisHotTier
+from core.idempotency import IdempotencyConflict, RequestCoordinator, SessionBusy
+from core.mongo_conversational_memory import MongoConversationMemory
+from core.session_registry import SessionRegistry
+from core.transcript_store import OrmTranscriptStore
+from core.usage import UsageLedger
+
+from .models import Conversation, Message
+
+
+def _mongo_available():
+    try:
+        get_db(alias='default').client.admin.command("ping")
+        return True
+    except Exception:
+        return False
+
+
+_add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+
+def _add_update_without_sort(builder, *args, sort=None, **kwargs):
+    # pymongo 4.9+ hands UpdateOne's ``sort`` to the bulk builder; mongomock has no such argument.
+    return _add_update(builder, *args, **kwargs)
+
+
+def _mongomock_store(test, collection_name):
+    """A bucket-size-4 store over an in-memory mongomock database."""
+    for patcher in (
+        mock.patch("core.conversation_store.get_db", return_value=mongomock.MongoClient().db),
+        mock.patch.object(mongomock.collection.BulkOperationBuilder, "add_update", _add_update_without_sort),
+    ):
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    return MongoConversationStore(collection_name, write_behind=False, bucket_size=4)
+
+
+def _messages(start, stop):
+    return [{"role": "user" if i % 2 == 0 else "ai", "content": f"m{i}"} for i in range(start, stop)]
+
+
+@skipUnless(_mongo_available(), "MongoDB is not reachable")
+class ConversationIndexTests(SimpleTestCase):
+    collection = "conversations_index_test"
+
+    def tearDown(self):
+        db = get_db(alias='default')
+        for name in (self.collection, f"{self.collection}_buckets"):
+            db.drop_collection(name)
+
+    def test_session_lookups_use_indexes(self):
+        from core.conversation_indexes import ensure_conversation_indexes, explain_session_lookup
+
+        ensure_conversation_indexes(self.collection)
+        plans = explain_session_lookup(self.collection)
+
+        for name, stages in plans.items():
+            self.assertIn("IXSCAN", stages, name)
+            self.assertNotIn("COLLSCAN", stages, name)
+
+
+class BucketStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.store = _mongomock_store(self, "bucket_test")
+        self.store.buckets.create_index([("session_id", 1), ("user_id", 1), ("seq", 1)], unique=True)
+
+    def _append(self, messages):
+        self.store.write_messages("s1", "u1", messages, timezone.now())
+
+    def _buckets(self):
+        return [
+            (bucket["seq"], bucket["count"])
+            for bucket in self.store.buckets.find({"session_id": "s1"}).sort("seq", 1)
+        ]
+
+    def test_appends_fill_the_newest_bucket_then_open_the_next(self):
+        for start in range(0, 10, 2):
+            self._append(_messages(start, start + 2))
+
+        self.assertEqual(self._buckets(), [(0, 4), (1, 4), (2, 2)])
+        self.assertEqual(self.store.load("s1", "u1")["messages"], _messages(0, 10))
+
+    def test_partial_older_bucket_is_not_refilled(self):
+        # An older bucket left partial must not take newer messages ahead of later buckets.
+        self.store.buckets.insert_many([
+            {"session_id": "s1", "user_id": "u1", "seq": 0, "count": 2, "messages": _messages(0, 2)},
+            {"session_id": "s1", "user_id": "u1", "seq": 1, "count": 4, "messages": _messages(2, 6)},
+        ])
+        self._append(_messages(6, 8))
+
+        self.assertEqual(self._buckets(), [(0, 2), (1, 4), (2, 2)])
+        doc = self.store.load("s1", "u1", limit=4)
+        self.assertEqual(doc["messages"], _messages(4, 8))
+        self.assertEqual(doc["message_count"], 8)
+
+    def test_lost_race_for_a_bucket_is_replanned(self):
+        self._append(_messages(0, 4))
+        # A stale view of the newest bucket: another writer has filled it since.
+        with mock.patch.object(self.store, "_newest_bucket", side_effect=[(0, 2), (0, 4)]):
+            self._append(_messages(4, 6))
+
+        self.assertEqual(self._buckets(), [(0, 4), (1, 2)])
+        self.assertEqual(self.store.load("s1", "u1")["messages"], _messages(0, 6))
+
+    def test_unmigrated_history_is_served_read_only(self):
+        self.store.headers.insert_one({"session_id": "s1", "user_id": "u1", "messages": _messages(0, 3)})
+        self._append(_messages(3, 5))
+
+        self.assertEqual(self.store.load("s1", "u1")["messages"], _messages(0, 5))
+        self.assertIn("messages", self.store.headers.find_one({"session_id": "s1"}))
+
+    def test_migration_writes_buckets_before_removing_the_legacy_array(self):
+        self.store.headers.insert_one({"session_id": "s1", "user_id": "u1", "messages": _messages(0, 6)})
+        self._append(_messages(6, 8))
+
+        # The first attempt dies after writing one bucket; the array must survive it.
+        update_one = self.store.buckets.update_one
+        calls = []
+
+        def failing_update(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise RuntimeError("connection lost")
+            return update_one(*args, **kwargs)
+
+        with mock.patch.object(self.store.buckets, "update_one", side_effect=failing_update):
+            with self.assertRaises(RuntimeError):
+                self.store.migrate_document("s1", "u1")
+        self.assertIn("messages", self.store.headers.find_one({"session_id": "s1"}))
+
+        self.assertEqual(self.store.migrate_document("s1", "u1"), 6)
+        self.assertEqual(self.store.migrate_document("s1", "u1"), 0)
+
+        header = self.store.headers.find_one({"session_id": "s1"})
+        self.assertNotIn("messages", header)
+        self.assertNotIn("legacy_seq_base", header)
+        self.assertEqual([seq for seq, _ in self._buckets()], [-2, -1, 0])
+        self.assertEqual(self.store.load("s1", "u1")["messages"], _messages(0, 8))
+
+
+class SummaryMemoryTests(SimpleTestCase):
+    def setUp(self):
+        self.store = _mongomock_store(self, "summary_test")
+        self.store.write_messages("s1", "u1", _messages(0, 100), timezone.now())
+        self.llm = mock.Mock(**{"invoke.return_value": "summary"})
+        for patcher in (
+            mock.patch("core.mongo_conversational_memory.get_db"),
+            mock.patch("core.mongo_conversational_memory._get_summary_llm", return_value=self.llm),
+            # Run the background fold inline.
+            mock.patch("core.mongo_conversational_memory._background_executor",
+                       mock.Mock(submit=lambda fn, *args: fn(*args))),
+            mock.patch.object(memory_config, "SUMMARY_LOAD_WINDOWS", 4),
+            mock.patch.object(memory_config, "SUMMARY_BATCH_MESSAGES", 5),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_long_unsummarized_backlog_is_bounded(self):
+        memory = MongoConversationMemory("s1", "u1", mode="summary", window_turns=2, store=self.store)
+        memory.load_memory_variables({})
+
+        # Four windows of two turns are loaded: two turns stay verbatim, twelve messages are folded.
+        self.assertEqual(len(memory._buffer.chat_memory.messages), 4)
+        self.assertEqual(self.llm.invoke.call_count, 3)
+        self.assertEqual(self.store.headers.find_one({"session_id": "s1"})["summarized_count"], 96)
+
+
+class WriteBehindTests(SimpleTestCase):
+    def setUp(self):
+        self.store = _mongomock_store(self, "write_behind_test")
+        self.buffer = WriteBehindBuffer(flush_interval=3600, max_batch=1000)
+        self.addCleanup(self.buffer.close)
+
+    def test_flush_coalesces_turns_per_session(self):
+        now = timezone.now()
+        self.buffer.append(self.store, "s1", "u1", _messages(0, 2), now)
+        self.buffer.append(self.store, "s2", "u1", _messages(0, 2), now)
+        self.buffer.append(self.store, "s1", "u1", _messages(2, 4), now)
+        self.assertEqual(self.buffer.pending_for(self.store, "s1", "u1"), _messages(0, 4))
+
+        self.buffer.flush()
+
+        self.assertEqual(self.buffer.pending_for(self.store, "s1", "u1"), [])
+        self.assertEqual(self.store.load("s1", "u1")["messages"], _messages(0, 4))
+        self.assertEqual(self.store.load("s2", "u1")["messages"], _messages(0, 2))
+        self.assertEqual(self.store.buckets.count_documents({"session_id": "s1"}), 1)
+
+    def test_failed_flush_requeues_only_the_failing_session(self):
+        now = timezone.now()
+        self.buffer.append(self.store, "s1", "u1", _messages(0, 2), now)
+        self.buffer.append(self.store, "s2", "u1", _messages(0, 2), now)
+        write_messages = self.store.write_messages
+
+        def failing_write(session_id, *args):
+            if session_id == "s1":
+                raise RuntimeError("primary stepped down")
+            return write_messages(session_id, *args)
+
+        with mock.patch.object(self.store, "write_messages", side_effect=failing_write):
+            self.buffer.flush()
+
+        self.assertEqual(self.buffer.pending_for(self.store, "s1", "u1"), _messages(0, 2))
+        self.assertEqual(self.buffer.pending_for(self.store, "s2", "u1"), [])
+        self.buffer.flush()
+        self.assertEqual(self.store.load("s1", "u1")["messages"], _messages(0, 2))
+
+
+class HotTierTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("core.hot_tier.get_redis_connection", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tier = RedisHotTier(max_messages=3, ttl=60)
+
+    def _put(self, version, messages=None, count=2):
+        self.tier.put("c", "s1", "u1", {"summary": "old"}, messages or _messages(0, 2), count, version)
+
+    def test_put_then_append_extends_and_trims(self):
+        self._put(self.tier.version("c", "s1", "u1"))
+        self.tier.append("c", "s1", "u1", _messages(2, 4))
+
+        fields, messages, count = self.tier.get("c", "s1", "u1")
+        self.assertEqual(fields, {"summary": "old"})
+        self.assertEqual(messages, _messages(1, 4))
+        self.assertEqual(count, 4)
+
+    def test_append_to_an_uncached_session_caches_nothing(self):
+        self.tier.append("c", "s1", "u1", _messages(0, 2))
+        self.assertIsNone(self.tier.get("c", "s1", "u1"))
+
+    def test_populate_racing_with_an_append_is_dropped(self):
+        version = self.tier.version("c", "s1", "u1")
+        # Lands after the reader loaded from Mongo, before it populated the cache.
+        self.tier.append("c", "s1", "u1", _messages(2, 4))
+        self._put(version)
+        self.assertIsNone(self.tier.get("c", "s1", "u1"))
+
+    def test_populate_racing_with_an_invalidation_is_dropped(self):
+        self._put(self.tier.version("c", "s1", "u1"))
+        version = self.tier.version("c", "s1", "u1")
+        self.tier.invalidate("c", "s1", "u1")
+        self._put(version)
+        self.assertIsNone(self.tier.get("c", "s1", "u1"))
+
+
+class _SizedMemory:
+    def __init__(self, size=0):
+        self.size = size
+        self.listener = None
+
+    def approx_size(self):
+        return self.size
+
+    def watch_size(self, listener):
+        self.listener = listener
+
+    def grow(self, size):
+        self.size = size
+        self.listener()
+
+
+class SessionRegistryTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch("core.session_registry.get_invalidation_bus", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _factory(self, session_id, user_id):
+        return _SizedMemory()
+
+    def test_least_recently_used_session_is_evicted_over_max_sessions(self):
+        registry = SessionRegistry(max_sessions=2, max_bytes=10 ** 9, idle_ttl=3600)
+        registry.get("u1", "a", self._factory)
+        registry.get("u1", "b", self._factory)
+        registry.get("u1", "a", self._factory)
+        registry.get("u1", "c", self._factory)
+
+        self.assertEqual(set(registry.sessions_for("u1")), {"a", "c"})
+
+    def test_byte_cap_applies_once_history_has_loaded(self):
+        registry = SessionRegistry(max_sessions=10, max_bytes=100, idle_ttl=3600)
+        first = registry.get("u1", "a", self._factory)
+        second = registry.get("u1", "b", self._factory)
+        self.assertEqual(registry.stats()["approx_bytes"], 0)
+
+        first.grow(60)
+        second.grow(60)
+
+        self.assertEqual(set(registry.sessions_for("u1")), {"b"})
+        self.assertEqual(registry.stats()["approx_bytes"], 60)
+
+    def test_idle_sessions_expire(self):
+        registry = SessionRegistry(max_sessions=10, max_bytes=10 ** 9, idle_ttl=0)
+        registry.get("u1", "a", self._factory)
+        time.sleep(0.01)
+        registry.get("u1", "b", self._factory)
+
+        self.assertEqual(set(registry.sessions_for("u1")), {"b"})
+
+
+class TranscriptStoreTests(TestCase):
+    def setUp(self):
+        users = get_user_model().objects
+        self.owner = users.create_user(username="owner", password="secret")
+        self.other = users.create_user(username="other", password="secret")
+        self.store = OrmTranscriptStore.__new__(OrmTranscriptStore)
+        self.store.name = "orm:conversations"
+        self.store._derived = mock.Mock(**{"headers.find_one.return_value": None})
+        self.store._bus = None
+        self.store._conversation_ids = {}
+        start = timezone.now()
+        for turn in range(4):
+            rows = self.store.append_turn("s1", self.owner.id, f"q{turn}", f"a{turn}")
+            # Both rows of a turn share one timestamp, so only the tie-break orders them.
+            Message.objects.filter(pk__in=[row.pk for row in rows]).update(timestamp=start + timedelta(seconds=turn))
+
+    def test_history_pages_keep_each_turn_in_order(self):
+        with mock.patch.object(memory_config, "BUCKET_SIZE", 3):
+            pages = list(self.store.iter_history("s1", self.owner.id))
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        contents = [message["content"] for page in reversed(pages) for message in page]
+        self.assertEqual(contents, ["q0", "a0", "q1", "a1", "q2", "a2", "q3", "a3"])
+        self.assertEqual(
+            [message["content"] for message in self.store.load("s1", self.owner.id, limit=3)["messages"]],
+            ["a2", "q3", "a3"],
+        )
+
+    def test_other_users_neither_read_nor_clear_the_transcript(self):
+        self.assertEqual(self.store.load("s1", self.other.id)["messages"], [])
+        self.assertEqual(list(self.store.iter_history("s1", self.other.id)), [])
+        self.assertEqual(self.store.delete("s1", self.other.id), 0)
+
+        self.assertEqual(self.store.load("s1", self.owner.id)["message_count"], 8)
+
+    def test_views_turn_away_other_users(self):
+        client = APIClient()
+        client.force_authenticate(self.other)
+
+        send = client.post(reverse("send-message", args=["s1"]), {"message": "what is the secret?"}, format="json")
+        clear = client.post(reverse("conversation-clear", args=["s1"]))
+
+        self.assertEqual(send.status_code, 404)
+        self.assertEqual(clear.status_code, 404)
+        self.assertEqual(Message.objects.count(), 8)
+
+
+class MessageListTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="reader", password="secret")
+        conversation = Conversation.objects.create(user=self.user, session_id="keyset")
+        Message.objects.bulk_create([
+            Message(conversation=conversation, user=self.user, content=f"m{i}", is_user=i % 2 == 0)
+            for i in range(7)
+        ])
+        # Every row shares one timestamp, so pages can only be told apart by the cursor.
+        Message.objects.update(timestamp=timezone.now())
+
+    def test_cursor_walks_every_message_once(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse("conversation-messages", args=["keyset"]) + "?page_size=2"
+        seen = []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [message["id"] for message in response.data["results"]]
+            url = response.data["next"]
+
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+
+
+class IdempotencyTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("core.idempotency.get_redis_connection", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.coordinator = RequestCoordinator(idempotency_ttl=60, lock_margin=1, poll_interval=0.01)
+        self.calls = 0
+
+    def _compute(self):
+        self.calls += 1
+        return {"reply": self.calls}, 200
+
+    def _run(self, session_id="s1", key="k1", payload=None):
+        return self.coordinator.run(
+            "u1", "chat", session_id, key, payload or {"message": "hi"}, self._compute, Deadline(1)
+        )
+
+    def test_retry_with_the_same_key_is_replayed(self):
+        self.assertEqual(self._run(), ({"reply": 1}, 200, False))
+        self.assertEqual(self._run(), ({"reply": 1}, 200, True))
+        self.assertEqual(self.calls, 1)
+
+    def test_same_key_with_another_body_conflicts(self):
+        self._run()
+        with self.assertRaises(IdempotencyConflict):
+            self._run(payload={"message": "something else"})
+
+    def test_keys_are_scoped_to_the_session(self):
+        self._run(session_id="s1")
+        self.assertEqual(self._run(session_id="s2"), ({"reply": 2}, 200, False))
+
+    def test_keyless_sends_are_not_replayed_after_finishing(self):
+        self._run(key=None)
+        self.assertEqual(self._run(key=None), ({"reply": 2}, 200, False))
+
+    def test_keyless_follower_ignores_a_result_from_an_earlier_leader(self):
+        base = "idempotency:u1:chat:s1:auto:fp"
+        self.coordinator._store(base, "fp", "earlier", {"reply": "stale"}, 200, 60)
+        self.redis.set(f"{base}:pending", "fp:current")
+
+        with self.assertRaises(SessionBusy):
+            self.coordinator._follow(base, f"{base}:pending", "fp", "current", Deadline(0.05))
+
+        self.coordinator._store(base, "fp", "current", {"reply": "fresh"}, 200, 60)
+        stored = self.coordinator._follow(base, f"{base}:pending", "fp", "current", Deadline(0.05))
+        self.assertEqual(stored["body"], {"reply": "fresh"})
+
+    def test_session_lock_is_exclusive_until_released(self):
+        with self.coordinator.session_lock("u1", "s1", Deadline(1)):
+            with self.assertRaises(SessionBusy):
+                with self.coordinator.session_lock("u1", "s1", Deadline(0.05)):
+                    pass
+        with self.coordinator.session_lock("u1", "s1", Deadline(0.05)):
+            pass
+
+
+class FairSchedulerTests(SimpleTestCase):
+    def _queue(self, scheduler, user, order):
+        def run():
+            with scheduler.slot(user) as ticket:
+                order.append(user)
+                ticket.cost = 500
+
+        waiting = len(scheduler._waiting)
+        thread = threading.Thread(target=run)
+        thread.start()
+        # Arrival order decides the start tags, so wait until this call is queued.
+        while len(scheduler._waiting) == waiting:
+            time.sleep(0.001)
+        return thread
+
+    def test_light_user_is_served_before_a_heavy_users_backlog(self):
+        scheduler = FairScheduler(slots=1)
+        order = []
+        running = scheduler.slot("heavy")
+        ticket = running.__enter__()
+        threads = [self._queue(scheduler, user, order) for user in ("heavy", "heavy", "light")]
+        ticket.cost = 500
+        running.__exit__(None, None, None)
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(order, ["light", "heavy", "heavy"])
+
+    def test_queue_timeout_hands_back_the_reserved_finish_tag(self):
+        scheduler = FairScheduler(slots=1)
+        with scheduler.slot("heavy") as ticket:
+            ticket.cost = 500
+            with use_deadline(Deadline(0.01)), self.assertRaises(DeadlineExceeded):
+                with scheduler.slot("light"):
+                    pass
+            self.assertEqual(scheduler._finish["light"], 0.0)
+
+
+class UsageLedgerTests(SimpleTestCase):
+    # One-hour window of 60 one-minute buckets; "now" is 30s into bucket 6000.
+    now = 6000 * 60 + 30
+
+    def _ledger(self, tokens):
+        return UsageLedger(windows={"hour": 3600}, token_quotas={"hour": tokens}, second_quotas={})
+
+    def test_under_quota_needs_no_wait(self):
+        buckets = [(5990, {"tokens": 400})]
+        self.assertIsNone(self._ledger(1000)._retry_after("hour", buckets, self.now))
+
+    def test_wait_lasts_until_the_oldest_bucket_leaves_the_window(self):
+        buckets = [(5941, {"tokens": 600}), (5990, {"tokens": 600})]
+        # Bucket 5941 leaves at (5941 + 60) * 60 = 360060, 30s from now.
+        self.assertEqual(self._ledger(1000)._retry_after("hour", buckets, self.now), 30)
+
+    def test_wait_covers_every_bucket_needed_to_get_under(self):
+        buckets = [(5941, {"tokens": 600}), (5950, {"tokens": 600}), (5999, {"tokens": 10})]
+        # Dropping 5941 still leaves 610 > 100, so wait for 5950 too: (5950 + 60) * 60 - now.
+        self.assertEqual(self._ledger(100)._retry_after("hour", buckets, self.now), 570)
+
+
+class GenerationCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("core.generation_cache.get_redis_connection", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = GenerationCache(ttl=60, max_entries=2, max_bytes=1024, routes=["chat"])
+
+    def test_key_covers_model_options_and_prompt(self):
+        key = GenerationCache.key("m", {"temperature": 0, "top_p": 1}, "p")
+        self.assertEqual(key, GenerationCache.key("m", {"top_p": 1, "temperature": 0}, "p"))
+        self.assertNotEqual(key, GenerationCache.key("m", {"temperature": 0, "top_p": 0.9}, "p"))
+        self.assertNotEqual(key, GenerationCache.key("m", {"temperature": 0, "top_p": 1}, "q"))
+        self.assertNotEqual(key, GenerationCache.key("other", {"temperature": 0, "top_p": 1}, "p"))
+
+    def test_only_deterministic_or_listed_routes_apply_once_enabled(self):
+        self.assertFalse(self.cache.applies(0))
+        with mock.patch.object(config, "GENERATION_CACHE", True):
+            self.assertTrue(self.cache.applies(0))
+            self.assertFalse(self.cache.applies(0.7))
+            with cache_route("chat"):
+                self.assertTrue(self.cache.applies(0.7))
+            with cache_route("weather_analysis"):
+                self.assertFalse(self.cache.applies(0.7))
+
+    def test_trim_evicts_the_oldest_entries_over_the_limit(self):
+        for name in ("a", "b", "c"):
+            self.cache.put(name, f"text {name}")
+            time.sleep(0.01)
+
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("b"), "text b")
+        self.assertEqual(self.cache.get("c"), "text c")
+        self.assertEqual(self.redis.zcard(GenerationCache.INDEX), 2)
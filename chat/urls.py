@@ -2,17 +2,25 @@ from django.urls import path
 from .views import (
     ConversationCreateView,
     ConversationDetailView,
+    ConversationListView,
+    MessageListView,
     SendMessageView,
     ClearConversationView,
     ConversationStatsView,
-    SystemStatusView
+    SystemStatusView,
+    GenerationResultView,
+    UsageView
 )
 
 urlpatterns = [
     path('api/v1/status/', SystemStatusView.as_view(), name='system-status'),
+    path('api/v1/usage/', UsageView.as_view(), name='llm-usage'),
+    path('api/v1/conversations/', ConversationListView.as_view(), name='conversation-list'),
     path('api/v1/conversations/create/', ConversationCreateView.as_view(), name='conversation-create'),
     path('api/v1/conversations/<str:session_id>/', ConversationDetailView.as_view(), name='conversation-detail'),
+    path('api/v1/conversations/<str:session_id>/messages/', MessageListView.as_view(), name='conversation-messages'),
     path('api/v1/conversations/<str:session_id>/stats/', ConversationStatsView.as_view(), name='conversation-stats'),
     path('api/v1/conversations/<str:session_id>/clear/', ClearConversationView.as_view(), name='conversation-clear'),    
     path('api/v1/conversations/<str:session_id>/send-message/', SendMessageView.as_view(), name='send-message'),
+    path('api/v1/generations/<str:task_id>/', GenerationResultView.as_view(), name='generation-result'),
 ]
\ No newline at end of file
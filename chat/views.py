@@ -1,13 +1,30 @@
 from rest_framework.views import APIView
+from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from .models import Conversation, Message
-from .serializers import ConversationSerializer, MessageSerializer
+from .pagination import ConversationCursorPagination, MessageCursorPagination
+from .serializers import ConversationListSerializer, ConversationSerializer, MessageSerializer
+from .tasks import generate_reply, generate_reply_task
 import uuid
 
+from celery.result import AsyncResult
+
+from GenAIwithDjangoRestApi.celery import app as celery_app
+
+from core.answer_cache import answer_cache
+from core.deadline import Deadline
+from core.generation_cache import bypass_requested, generation_cache, use_bypass
+from core.generation_queue import enqueue, is_async, queue_depths, task_owner
+from core.idempotency import idempotent_response
+from core.metrics import metrics
 from core.service import OllamaChatServiceSingleton
+from core.session_registry import session_registry
+from core.fair_scheduler import fair_scheduler
+from core.usage import LLMQuotaThrottle, usage_ledger
 
 class ConversationCreateView(APIView):
     permission_classes = [IsAuthenticated]
@@ -24,26 +41,51 @@ class ConversationDetailView(APIView):
     def get(self, request, session_id):
         conversation = get_object_or_404(Conversation, session_id=session_id)
         chat_service = OllamaChatServiceSingleton.get_service(request.user.id)
-        stats = chat_service.get_conversation_stats(session_id)
+        stats = chat_service.get_conversation_stats(conversation.session_id, conversation)
         
-        serializer = ConversationSerializer(conversation)
+        # Only the newest page is inlined; older history is paged through MessageListView.
+        page_size = MessageCursorPagination.page_size
+        recent = list(conversation.messages.order_by('-timestamp')[:page_size])
+        serializer = ConversationListSerializer(conversation)
         response_data = {
-            "conversation": serializer.data,
+            "conversation": {
+                **serializer.data,
+                "messages": MessageSerializer(reversed(recent), many=True).data,
+                "has_older_messages": len(recent) == page_size
+            },
             "stats": stats
         }
         
         return Response(response_data)
 
+class ConversationListView(ListAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = ConversationListSerializer
+    pagination_class = ConversationCursorPagination
+
+    def get_queryset(self):
+        return Conversation.objects.filter(user=self.request.user)
+
+class MessageListView(ListAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = MessageSerializer
+    pagination_class = MessageCursorPagination
+
+    def get_queryset(self):
+        conversation = get_object_or_404(Conversation, session_id=self.kwargs['session_id'], user=self.request.user)
+        return Message.objects.filter(conversation=conversation)
+
 class SendMessageView(APIView):    
     permission_classes = [IsAuthenticated]
+    throttle_classes = [LLMQuotaThrottle]
     def post(self, request, session_id):
         conversation, created = Conversation.objects.get_or_create(
-            session_id=session_id
+            session_id=session_id,
+            defaults={"user": request.user}
         )
-        
-        if created:
-            chat_service = OllamaChatServiceSingleton.get_service(request.user.id)
-            chat_service.get_memory(session_id)
+        if conversation.user_id != request.user.id:
+            # Session ids are not secrets; only the owner may extend a conversation.
+            return Response({'error': 'Conversation not found'}, status=status.HTTP_404_NOT_FOUND)
         user_message = request.data.get('message', '').strip()
         
         if not user_message:
@@ -51,51 +93,38 @@ class SendMessageView(APIView):
                 {'error': 'Message is required and cannot be empty'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        user_msg = Message.objects.create(
-            conversation=conversation,
-            content=user_message,
-            is_user=True,
-            user=request.user
-        )
-        chat_service = OllamaChatServiceSingleton.get_service(request.user.id)
-        ai_response_data = chat_service.generate_response(session_id, user_message)
-        ai_msg = Message.objects.create(
-            conversation=conversation,
-            content=ai_response_data,
-            is_user=False,
-            user=request.user
+
+        deadline = Deadline.from_request(request)
+        if is_async():
+            def generate():
+                return enqueue(
+                    request, generate_reply_task, "chat", deadline,
+                    user_id=request.user.id, conversation_id=str(conversation.pk),
+                    session_id=session_id, user_message=user_message,
+                )
+        else:
+            def generate():
+                with use_bypass(bypass_requested(request)):
+                    return Response(*generate_reply(request.user.id, conversation.pk, session_id, user_message))
+
+        # Retries and concurrent duplicates get the first response; one generation per session at a time.
+        return idempotent_response(
+            request, "chat", session_id, {"message": user_message}, generate, deadline,
+            lock_session=not is_async()
         )
-        
-        response_data = {
-            "user_message": MessageSerializer(user_msg).data,
-            "ai_message": MessageSerializer(ai_msg).data,
-            "conversation_id": conversation.id,
-            "session_id": session_id,
-            "service_info": {
-                "method": ai_response_data.get('method', 'unknown'),
-                "success": ai_response_data.get('success', False),
-                "model_used": ai_response_data.get('model_used', 'llama2')
-            }
-        }
-        
-        if status.HTTP_200_OK:
-            response_data["debug"] = {
-                "history_preview": ai_response_data.get('history', '')[:200] + "..." if ai_response_data.get('history') else 'No history',
-                "context_used": ai_response_data.get('context_used', '')[:200] + "..." if ai_response_data.get('context_used') else 'No context'
-            }
-        
-        status_code = status.HTTP_200_OK if ai_response_data.get('success', False) else status.HTTP_207_MULTI_STATUS
-        
-        return Response(response_data, status=status_code)
 
 class ClearConversationView(APIView):
     permission_classes = [IsAuthenticated]
     def post(self, request, session_id):
-        conversation = get_object_or_404(Conversation, session_id=session_id)        
-        deleted_count, _ = Message.objects.filter(conversation=conversation, user=request.user).delete() 
+        conversation = get_object_or_404(Conversation, session_id=session_id, user=request.user)
         chat_service = OllamaChatServiceSingleton.get_service(request.user.id)      
-        memory_cleared = chat_service.clear_memory(session_id)        
-        chat_service.get_memory(session_id)
+        deleted_count = chat_service.clear_memory(session_id)
+        if deleted_count is None:
+            # The Mongo transcript backend does not own the ORM rows.
+            with transaction.atomic():
+                deleted_count, _ = Message.objects.filter(conversation=conversation, user=request.user).delete()
+                Conversation.reset_counters(session_id)
+        memory_cleared = True
         
         return Response({
             "status": "success",
@@ -110,12 +139,11 @@ class ConversationStatsView(APIView):
     def get(self, request, session_id):
         conversation = get_object_or_404(Conversation, session_id=session_id)    
         chat_service = OllamaChatServiceSingleton.get_service(request.user.id)    
-        stats = chat_service.get_conversation_stats(session_id)        
-        message_count = Message.objects.filter(conversation=conversation, user=request.user).count()
+        stats = chat_service.get_conversation_stats(conversation.session_id, conversation)
         
         response_data = {
             "session_id": session_id,
-            "database_messages": message_count,
+            "database_messages": conversation.message_count,
             "service_stats": stats,
             "conversation_created": conversation.created_at,
             "conversation_updated": conversation.updated_at
@@ -136,7 +164,10 @@ class SystemStatusView(APIView):
                 "active_sessions": len(chat_service.memory),
                 "available_models": model_list,
                 "default_model": "llama2",
-                "service": "Ollama + LangChain Chat API"
+                "service": "Ollama + LangChain Chat API",
+                "session_registry": session_registry.stats(),
+                "answer_cache": answer_cache.stats(),
+                "metrics": metrics.snapshot()
             }
             
         except Exception as e:
@@ -144,7 +175,43 @@ class SystemStatusView(APIView):
                 "status": "degraded",
                 "error": str(e),
                 "active_sessions": len(chat_service.memory),
-                "service": "Ollama + LangChain Chat API"
+                "service": "Ollama + LangChain Chat API",
+                "session_registry": session_registry.stats(),
+                "answer_cache": answer_cache.stats(),
+                "metrics": metrics.snapshot()
             }
+        status_data["llm_scheduler"] = fair_scheduler.stats()
+        status_data["generation_cache"] = generation_cache.stats()
+        if is_async():
+            status_data["execution_mode"] = "async"
+            status_data["generation_queues"] = queue_depths()
         
-        return Response(status_data)
\ No newline at end of file
+        return Response(status_data)
+
+class UsageView(APIView):
+    permission_classes = [IsAuthenticated]
+    def get(self, request):
+        # Staff may look at anyone's consumption; everyone else sees their own.
+        user_id = request.query_params.get('user_id') if request.user.is_staff else None
+        user_id = user_id or request.user.id
+        return Response({
+            "user_id": str(user_id),
+            "windows": usage_ledger.usage(user_id),
+            "retry_after": usage_ledger.retry_after(user_id)
+        })
+
+class GenerationResultView(APIView):
+    permission_classes = [IsAuthenticated]
+    def get(self, request, task_id):
+        if task_owner(task_id) != str(request.user.id):
+            return Response({'error': 'Unknown task'}, status=status.HTTP_404_NOT_FOUND)
+        result = AsyncResult(task_id, app=celery_app)
+        if result.successful():
+            # The generation's own response, exactly as the inline mode would have returned it.
+            return Response(result.result["body"], status=result.result["status"])
+        if result.failed():
+            return Response(
+                {'task_id': task_id, 'state': result.state, 'error': str(result.result)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        return Response({'task_id': task_id, 'state': result.state}, status=status.HTTP_202_ACCEPTED)
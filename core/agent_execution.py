@@ -0,0 +1,48 @@
+import logging
+import threading
+import time
+
+from langchain.agents import AgentExecutor, initialize_agent
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AgentScaffold:
+    """The static, shareable part of an agent, built once per process.
+
+    Holds the LLM client, the tool wrappers and the planner agent whose prompt
+    (tool descriptions, system message, format instructions) has already been
+    formatted. None of these change between requests, so they are shared as-is;
+    ``executor`` binds the per-request memory into a fresh, cheap executor.
+    """
+
+    def __init__(self, llm, tools, agent_type, agent_kwargs: dict = None, **settings):
+        started = time.monotonic()
+        self.llm = llm
+        self.tools = tuple(tools)
+        self.agent = initialize_agent(
+            tools=list(self.tools), llm=llm, agent=agent_type, agent_kwargs=agent_kwargs or {}
+        ).agent
+        self.settings = settings
+        metrics.observe("agent_scaffold.build", time.monotonic() - started)
+
+    def executor(self, memory) -> AgentExecutor:
+        return AgentExecutor(agent=self.agent, tools=list(self.tools), memory=memory, **self.settings)
+
+
+_scaffolds = {}
+_scaffolds_lock = threading.Lock()
+
+
+def cached_scaffold(key, build) -> AgentScaffold:
+    """Return the scaffold for ``key``, calling ``build()`` the first time only."""
+    scaffold = _scaffolds.get(key)
+    if scaffold is None:
+        with _scaffolds_lock:
+            scaffold = _scaffolds.get(key)
+            if scaffold is None:
+                scaffold = _scaffolds[key] = build()
+                logger.info("Built agent scaffold %s", key)
+    return scaffold
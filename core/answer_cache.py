@@ -0,0 +1,162 @@
+import logging
+import re
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from .config import document_config
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", question.lower())).strip()
+
+
+# Words that point back into the conversation ("tell me more", "why is that?").
+_ANAPHORS = {"it", "its", "this", "that", "these", "those", "they", "them", "he", "she", "more", "else",
+             "above", "previous", "again", "why", "same"}
+_MIN_CACHEABLE_WORDS = 4
+
+
+def is_self_contained(question: str) -> bool:
+    """Whether ``question`` can be answered without the conversation before it.
+
+    Short or anaphoric follow-ups normalize to the same text in every session, so
+    an answer cached for one conversation would be wrong in another.
+    """
+    words = normalize_question(question).split()
+    return len(words) >= _MIN_CACHEABLE_WORDS and not _ANAPHORS.intersection(words)
+
+
+class _Entry:
+    __slots__ = ("vector", "answer", "created")
+
+    def __init__(self, vector: Optional[np.ndarray], answer: str):
+        self.vector = vector
+        self.answer = answer
+        self.created = time.monotonic()
+
+
+class AnswerCache:
+    """Process-wide LRU of document answers keyed by (doc_id, index version, question).
+
+    A lookup first tries the normalized question verbatim, which costs no embedding
+    call, then falls back to the closest cached question for the same document and
+    index version by cosine similarity. Entries carry the index version they were
+    answered against, so re-indexing a document makes its old answers unreachable
+    in every process; ``invalidate`` also frees them here straight away.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, threshold: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[Tuple[str, str, str], _Entry]" = OrderedDict()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def lookup(self, doc_id, version: str, question: str,
+               embed: Callable[[str], List[float]]) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """Return ``(answer, vector)``; ``answer`` is None on a miss.
+
+        ``vector`` is the question embedding when one had to be computed, so the
+        caller can pass it back to ``store`` without embedding the question twice.
+        """
+        normalized = normalize_question(question)
+        doc = (str(doc_id), version)
+        with self._lock:
+            answer = self._get((*doc, normalized))
+        if answer is not None:
+            self._record(hit=True, kind="exact")
+            return answer, None
+
+        vector = self._unit(embed(normalized))
+        with self._lock:
+            best_key, best_score = None, self.threshold
+            for key, entry in self._entries.items():
+                if key[:2] != doc or entry.vector is None:
+                    continue
+                score = float(np.dot(entry.vector, vector))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            answer = self._get(best_key) if best_key else None
+        if answer is not None:
+            logger.info("Answer cache hit for doc %s (similarity %.3f)", doc_id, best_score)
+            self._record(hit=True, kind="semantic")
+        else:
+            self._record(hit=False)
+        return answer, vector
+
+    def store(self, doc_id, version: str, question: str, answer: str, vector: Optional[np.ndarray] = None):
+        key = (str(doc_id), version, normalize_question(question))
+        with self._lock:
+            self._entries[key] = _Entry(vector, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.incr("answer_cache.evictions")
+            metrics.set_gauge("answer_cache.entries", len(self._entries))
+
+    def invalidate(self, doc_id) -> int:
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == str(doc_id)]
+            for key in keys:
+                del self._entries[key]
+            metrics.set_gauge("answer_cache.entries", len(self._entries))
+        if keys:
+            logger.info("Dropped %d cached answers for doc %s", len(keys), doc_id)
+        return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "threshold": self.threshold,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _get(self, key) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created > self.ttl:
+            del self._entries[key]
+            metrics.incr("answer_cache.expired")
+            return None
+        self._entries.move_to_end(key)
+        return entry.answer
+
+    def _record(self, hit: bool, kind: str = None):
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+        metrics.incr(f"answer_cache.hits.{kind}" if hit else "answer_cache.misses")
+
+    @staticmethod
+    def _unit(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+
+answer_cache = AnswerCache(
+    max_entries=document_config.ANSWER_CACHE_MAX_ENTRIES,
+    ttl=document_config.ANSWER_CACHE_TTL,
+    threshold=document_config.ANSWER_CACHE_THRESHOLD,
+)
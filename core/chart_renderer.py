@@ -0,0 +1,154 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Iterable, List
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from .config import config
+from .deadline import get_deadline
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CHART_NAME = re.compile(r"chart_[0-9a-f]{32}\.png")
+LEGACY_NAME = re.compile(r"(?:analysis_)?graph_[0-9a-f]{32}\.png")
+
+
+class ChartRenderer:
+    """Renders charts on a dedicated thread pool into content-addressed PNG files.
+
+    Figures are built with the object-oriented ``Figure``/Agg API, so no pyplot
+    global state is shared between concurrent requests. The filename is a hash of
+    the chart type, data, title and style: an identical chart returns the existing
+    URL without rendering, and identical renders in flight share one future.
+    """
+
+    def __init__(self, workers: int, timeout: float):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="chart-render")
+        self._inflight = {}
+        self._lock = Lock()
+
+    @property
+    def directory(self) -> str:
+        return os.path.join(config.MEDIA_ROOT, config.CHART_DIR)
+
+    def render(self, chart_type: str, labels: List, values: List[float], title: str,
+               xlabel: str = "Category", ylabel: str = "Value") -> str:
+        """Return the media URL of the chart, rendering it first if needed."""
+        spec = {
+            "type": chart_type,
+            "labels": [str(label) for label in labels],
+            "values": [float(value) for value in values],
+            "title": title,
+            "xlabel": xlabel,
+            "ylabel": ylabel,
+            "style": [list(config.GRAPH_FIGSIZE), config.GRAPH_DPI, config.GRAPH_COLOR],
+        }
+        digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+        filename = f"chart_{digest}.png"
+        url = os.path.join(config.MEDIA_URL, config.CHART_DIR, filename)
+        path = os.path.join(self.directory, filename)
+
+        if os.path.exists(path):
+            metrics.incr("chart_renderer.cache_hits")
+            return url
+        with self._lock:
+            future = self._inflight.get(digest)
+            created = future is None
+            if created:
+                future = self._executor.submit(self._render, spec, path)
+                self._inflight[digest] = future
+        if created:
+            # Outside the lock: the callback runs inline if the render already finished.
+            future.add_done_callback(lambda _: self._forget(digest))
+        else:
+            metrics.incr("chart_renderer.coalesced")
+        deadline = get_deadline()
+        future.result(timeout=deadline.timeout(self.timeout) if deadline else self.timeout)
+        return url
+
+    def _forget(self, digest: str):
+        with self._lock:
+            self._inflight.pop(digest, None)
+
+    def _render(self, spec: dict, path: str):
+        started = time.monotonic()
+        fig = Figure(figsize=spec["style"][0])
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        labels, values, color = spec["labels"], spec["values"], spec["style"][2]
+
+        if spec["type"] == "line":
+            ax.plot(labels, values, marker="o", color=color)
+        elif spec["type"] == "pie":
+            ax.pie(values, labels=labels, autopct="%1.1f%%", startangle=90)
+        elif spec["type"] == "histogram":
+            ax.hist(values, bins=10, color=color, edgecolor="black")
+        else:
+            ax.bar(labels, values, color=color)
+
+        ax.set_title(spec["title"])
+        if spec["type"] != "pie":
+            ax.set_xlabel(spec["xlabel"])
+            ax.set_ylabel(spec["ylabel"])
+            for tick in ax.get_xticklabels():
+                tick.set_rotation(45)
+                tick.set_horizontalalignment("right")
+        fig.tight_layout()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        fig.savefig(tmp_path, format="png", dpi=spec["style"][1])
+        os.replace(tmp_path, path)
+        metrics.incr("chart_renderer.renders")
+        metrics.observe("chart_renderer.render", time.monotonic() - started)
+
+
+def collect_garbage(referenced: Iterable[str], min_age: float, include_legacy: bool = False,
+                    dry_run: bool = False) -> List[str]:
+    """Delete chart files older than ``min_age`` seconds whose names are not in ``referenced``.
+
+    ``include_legacy`` also sweeps the uuid-named PNGs the tools used to write
+    straight into MEDIA_ROOT.
+    """
+    referenced = set(referenced)
+    cutoff = time.time() - min_age
+    candidates = []
+    if os.path.isdir(chart_renderer.directory):
+        candidates += [
+            os.path.join(chart_renderer.directory, name)
+            for name in os.listdir(chart_renderer.directory) if CHART_NAME.fullmatch(name)
+        ]
+    if include_legacy and os.path.isdir(config.MEDIA_ROOT):
+        candidates += [
+            os.path.join(config.MEDIA_ROOT, name)
+            for name in os.listdir(config.MEDIA_ROOT) if LEGACY_NAME.fullmatch(name)
+        ]
+
+    removed = []
+    for path in candidates:
+        if os.path.basename(path) in referenced:
+            continue
+        try:
+            if os.path.getmtime(path) > cutoff:
+                continue
+            if not dry_run:
+                os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed.append(path)
+    if not dry_run:
+        metrics.incr("chart_renderer.collected", len(removed))
+    logger.info("Chart GC %s %d unreferenced images", "would remove" if dry_run else "removed", len(removed))
+    return removed
+
+
+chart_renderer = ChartRenderer(workers=config.CHART_WORKERS, timeout=config.CHART_RENDER_TIMEOUT)
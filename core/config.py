@@ -19,5 +19,148 @@ class AgentConfig:
     GRAPH_FIGSIZE = (8, 5)
     GRAPH_DPI = 100
     GRAPH_COLOR = "#36A2EB"
+    # Charts are rendered off the agent thread and stored under MEDIA_ROOT/CHART_DIR,
+    # named by a hash of their content so identical charts are rendered once.
+    CHART_DIR = "charts"
+    CHART_WORKERS = int(os.getenv("CHART_RENDER_WORKERS", 2))
+    CHART_RENDER_TIMEOUT = float(os.getenv("CHART_RENDER_TIMEOUT", 30))
+    # Overall time budget of one agent request. Clients may ask for less with the
+    # X-Request-Timeout header (seconds), never more than REQUEST_BUDGET_MAX.
+    REQUEST_BUDGET = float(os.getenv("AGENT_REQUEST_BUDGET", 120))
+    REQUEST_BUDGET_MAX = float(os.getenv("AGENT_REQUEST_BUDGET_MAX", 300))
+    # Start the vector search for the raw question while the agent plans; a tool whose
+    # query overlaps it by PREFETCH_MIN_OVERLAP (word Jaccard) reuses the prefetched chunks.
+    SPECULATIVE_RETRIEVAL = os.getenv("AGENT_SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+    PREFETCH_K = int(os.getenv("AGENT_PREFETCH_K", 5))
+    PREFETCH_MIN_OVERLAP = float(os.getenv("AGENT_PREFETCH_MIN_OVERLAP", 0.5))
+    # Responses to requests sent with an Idempotency-Key header are kept this long and
+    # replayed to retries. Identical sends without a key are only coalesced while in flight.
+    IDEMPOTENCY = os.getenv("AGENT_IDEMPOTENCY", "true").lower() == "true"
+    IDEMPOTENCY_TTL = int(os.getenv("AGENT_IDEMPOTENCY_TTL", 24 * 60 * 60))
+    # One generation per (user, session) at a time, across workers. The Redis lock
+    # outlives the longest request budget by this margin in case its holder dies.
+    SESSION_LOCK_MARGIN = float(os.getenv("AGENT_SESSION_LOCK_MARGIN", 30))
+    SESSION_LOCK_POLL = float(os.getenv("AGENT_SESSION_LOCK_POLL", 0.25))
+    # "inline" generates inside the web worker; "async" enqueues a Celery task per request
+    # on its workload's queue and returns 202 with a URL to poll (results are also pushed
+    # to the user's websocket). Queue time counts against the request budget.
+    EXECUTION_MODE = os.getenv("AGENT_EXECUTION_MODE", "inline")
+    GENERATION_QUEUES = {
+        "chat": os.getenv("AGENT_CHAT_QUEUE", "chat_generation"),
+        "documents": os.getenv("AGENT_DOCUMENTS_QUEUE", "document_generation"),
+        "weather": os.getenv("AGENT_WEATHER_QUEUE", "weather_generation"),
+    }
+    GENERATION_RESULT_TTL = int(os.getenv("AGENT_GENERATION_RESULT_TTL", 24 * 60 * 60))
+    # Every LLM call waits for one of LLM_SLOTS per process, handed out fairly across
+    # users in proportion to USER_WEIGHTS ("user_id:weight,..."; default 1), and is
+    # billed to the requesting user from Ollama's eval counts.
+    LLM_SLOTS = int(os.getenv("AGENT_LLM_SLOTS", 2))
+    USER_WEIGHTS = {
+        user_id: float(weight)
+        for user_id, weight in (item.split(":") for item in os.getenv("AGENT_USER_WEIGHTS", "").split(",") if item)
+    }
+    # Per-user quotas over rolling windows, in tokens (prompt + generated) and Ollama
+    # compute seconds. 0 disables a limit.
+    QUOTA_WINDOWS = {"hour": 60 * 60, "day": 24 * 60 * 60}
+    QUOTA_TOKENS = {
+        "hour": int(os.getenv("AGENT_QUOTA_TOKENS_PER_HOUR", 0)),
+        "day": int(os.getenv("AGENT_QUOTA_TOKENS_PER_DAY", 0)),
+    }
+    QUOTA_SECONDS = {
+        "hour": float(os.getenv("AGENT_QUOTA_SECONDS_PER_HOUR", 0)),
+        "day": float(os.getenv("AGENT_QUOTA_SECONDS_PER_DAY", 0)),
+    }
+    # Exact-match cache of completions in Redis, keyed by model, options and rendered
+    # prompt. Off unless enabled; then used for temperature-0 calls and for calls from
+    # the routes listed here (none by default, as sampled routes would stop varying).
+    GENERATION_CACHE = os.getenv("AGENT_GENERATION_CACHE", "false").lower() == "true"
+    GENERATION_CACHE_ROUTES = [
+        route for route in os.getenv("AGENT_GENERATION_CACHE_ROUTES", "").split(",") if route
+    ]
+    GENERATION_CACHE_TTL = int(os.getenv("AGENT_GENERATION_CACHE_TTL", 6 * 60 * 60))
+    GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("AGENT_GENERATION_CACHE_MAX_ENTRIES", 10000))
+    GENERATION_CACHE_MAX_BYTES = int(os.getenv("AGENT_GENERATION_CACHE_MAX_BYTES", 64 * 1024))
 
-config = AgentConfig()
\ No newline at end of file
+config = AgentConfig()
+
+class MemoryConfig:
+    REGISTRY_MAX_SESSIONS = int(os.getenv("CHAT_REGISTRY_MAX_SESSIONS", 500))
+    REGISTRY_MAX_BYTES = int(os.getenv("CHAT_REGISTRY_MAX_BYTES", 64 * 1024 * 1024))
+    REGISTRY_IDLE_TTL = int(os.getenv("CHAT_REGISTRY_IDLE_TTL", 30 * 60))
+    REGISTRY_MAX_USERS = int(os.getenv("CHAT_REGISTRY_MAX_USERS", 1000))
+    # "buffer" keeps the whole history in the prompt, "summary" keeps the last
+    # WINDOW_TURNS turns verbatim plus a rolling summary of everything older and
+    # "relevance" keeps the last WINDOW_TURNS turns plus the RELEVANT_TURNS older
+    # turns closest to the current input.
+    MEMORY_MODE = os.getenv("CHAT_MEMORY_MODE", "buffer")
+    WINDOW_TURNS = int(os.getenv("CHAT_MEMORY_WINDOW_TURNS", 6))
+    RELEVANT_TURNS = int(os.getenv("CHAT_MEMORY_RELEVANT_TURNS", 3))
+    EMBEDDING_MODEL = os.getenv("CHAT_MEMORY_EMBEDDING_MODEL", "codellama:latest")
+    VECTOR_COLLECTION = os.getenv("CHAT_MEMORY_VECTOR_COLLECTION", "conversation_vectors")
+    # Write-behind trades durability of the last WRITE_BEHIND_INTERVAL seconds of
+    # turns for taking Mongo writes off the request path; see WriteBehindBuffer.
+    WRITE_BEHIND = os.getenv("CHAT_MEMORY_WRITE_BEHIND", "false").lower() == "true"
+    WRITE_BEHIND_INTERVAL = float(os.getenv("CHAT_MEMORY_WRITE_BEHIND_INTERVAL", 0.5))
+    WRITE_BEHIND_MAX_BATCH = int(os.getenv("CHAT_MEMORY_WRITE_BEHIND_MAX_BATCH", 500))
+    # Messages are stored in fixed-size bucket documents; loads fetch at most
+    # LOAD_LIMIT of the newest messages unless a memory mode needs more.
+    BUCKET_SIZE = int(os.getenv("CHAT_MEMORY_BUCKET_SIZE", 50))
+    LOAD_LIMIT = int(os.getenv("CHAT_MEMORY_LOAD_LIMIT", 200))
+    # Redis hot tier (django_redis "default" cache) holding the newest messages per session.
+    HOT_TIER = os.getenv("CHAT_MEMORY_HOT_TIER", "false").lower() == "true"
+    HOT_TIER_MESSAGES = int(os.getenv("CHAT_MEMORY_HOT_TIER_MESSAGES", 200))
+    HOT_TIER_TTL = int(os.getenv("CHAT_MEMORY_HOT_TIER_TTL", 24 * 60 * 60))
+    # Sessions idle for SESSION_TTL_DAYS are removed by Mongo TTL indexes (0 disables).
+    # Expiry is pushed forward at most once per SESSION_TOUCH_INTERVAL seconds per session.
+    SESSION_TTL_DAYS = int(os.getenv("CHAT_SESSION_TTL_DAYS", 30))
+    SESSION_TOUCH_INTERVAL = int(os.getenv("CHAT_SESSION_TOUCH_INTERVAL", 60 * 60))
+    # Redis pub/sub channel telling other workers to drop sessions this worker mutated.
+    INVALIDATION_BUS = os.getenv("CHAT_MEMORY_INVALIDATION_BUS", "false").lower() == "true"
+    INVALIDATION_CHANNEL = os.getenv("CHAT_MEMORY_INVALIDATION_CHANNEL", "conversation-invalidations")
+    # "orm" makes the chat app's Postgres Message rows the only transcript store,
+    # "mongo" keeps chat transcripts in the Mongo conversation store as well.
+    CHAT_TRANSCRIPT_BACKEND = os.getenv("CHAT_TRANSCRIPT_BACKEND", "orm")
+    ENSURE_INDEXES_ON_STARTUP = os.getenv("CHAT_ENSURE_INDEXES_ON_STARTUP", "false").lower() == "true"
+    SUMMARY_WORKERS = int(os.getenv("CHAT_MEMORY_SUMMARY_WORKERS", 2))
+    # Summary mode loads at most SUMMARY_LOAD_WINDOWS windows of unsummarized messages
+    # (older ones are skipped rather than summarized) and folds at most
+    # SUMMARY_BATCH_MESSAGES messages into the summary per LLM call, so neither the
+    # load nor a summary prompt grows with the length of the session.
+    SUMMARY_LOAD_WINDOWS = int(os.getenv("CHAT_MEMORY_SUMMARY_LOAD_WINDOWS", 4))
+    SUMMARY_BATCH_MESSAGES = int(os.getenv("CHAT_MEMORY_SUMMARY_BATCH_MESSAGES", 24))
+
+memory_config = MemoryConfig()
+
+class DocumentConfig:
+    # Semantic answer cache for DocumentAgent.ask, keyed by (doc_id, index version,
+    # question embedding). A cached answer is reused when the cosine similarity of the
+    # normalized questions reaches ANSWER_CACHE_THRESHOLD. Off by default: answers are
+    # sampled and shared across sessions; short or anaphoric follow-ups are never cached.
+    ANSWER_CACHE = os.getenv("DOC_ANSWER_CACHE", "false").lower() == "true"
+    ANSWER_CACHE_THRESHOLD = float(os.getenv("DOC_ANSWER_CACHE_THRESHOLD", 0.92))
+    ANSWER_CACHE_TTL = int(os.getenv("DOC_ANSWER_CACHE_TTL", 24 * 60 * 60))
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("DOC_ANSWER_CACHE_MAX_ENTRIES", 2000))
+    # Full-document summaries are map-reduced over sections of at most
+    # SUMMARY_SECTION_CHARS characters, at most SUMMARY_CONCURRENCY Ollama calls at a
+    # time per process. Section summaries are cached in the default Django cache.
+    SUMMARY_SECTION_CHARS = int(os.getenv("DOC_SUMMARY_SECTION_CHARS", 6000))
+    SUMMARY_CONCURRENCY = int(os.getenv("DOC_SUMMARY_CONCURRENCY", 2))
+    SUMMARY_CACHE_TTL = int(os.getenv("DOC_SUMMARY_CACHE_TTL", 7 * 24 * 60 * 60))
+    # Post-ingestion enrichment (Celery) precomputing summary, outline, numeric tables
+    # and a question bank into artifacts.json next to the FAISS index.
+    ENRICH_ON_UPLOAD = os.getenv("DOC_ENRICH_ON_UPLOAD", "false").lower() == "true"
+    QUESTIONS_PER_SECTION = int(os.getenv("DOC_QUESTIONS_PER_SECTION", 3))
+    QUESTION_BANK_SECTIONS = int(os.getenv("DOC_QUESTION_BANK_SECTIONS", 10))
+    # Persistent per-document question bank (Mongo). Shortfalls are generated in
+    # batches of QUESTION_BATCH_CHUNKS chunks, QUESTIONS_PER_BATCH questions per call.
+    QUESTION_BANK_COLLECTION = os.getenv("DOC_QUESTION_BANK_COLLECTION", "document_question_bank")
+    QUESTION_BATCH_CHUNKS = int(os.getenv("DOC_QUESTION_BATCH_CHUNKS", 4))
+    QUESTIONS_PER_BATCH = int(os.getenv("DOC_QUESTIONS_PER_BATCH", 5))
+    QUESTION_BANK_WORKERS = int(os.getenv("DOC_QUESTION_BANK_WORKERS", 2))
+    # Upper bound on the questions one request can ask for (and so queue generation of).
+    MAX_QUESTIONS = int(os.getenv("DOC_MAX_QUESTIONS", 20))
+    # How long a request waits for its shortfall to be generated before answering with
+    # live generation instead; the fill still completes and stocks the bank.
+    QUESTION_BANK_WAIT = float(os.getenv("DOC_QUESTION_BANK_WAIT", 5))
+
+document_config = DocumentConfig()
@@ -0,0 +1,66 @@
+import logging
+
+from mongoengine import get_db
+from pymongo import ASCENDING
+
+from .config import memory_config
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_conversation_indexes(collection_name: str = "conversations") -> dict:
+    """Create the indexes the conversation store relies on. Safe to run repeatedly.
+
+    Headers get a unique (session_id, user_id) index, buckets a unique
+    (session_id, user_id, seq) index that serves the bucket scans in either direction
+    and makes concurrent appends collide instead of opening the same bucket twice,
+    and vectors a unique per-turn index.
+    All three get a TTL index on ``expires_at`` so abandoned sessions are removed by Mongo.
+    """
+    db = get_db(alias='default')
+    created = {
+        collection_name: [
+            db[collection_name].create_index(
+                [("session_id", ASCENDING), ("user_id", ASCENDING)], unique=True, name="session_user_unique"
+            ),
+        ],
+        f"{collection_name}_buckets": [
+            db[f"{collection_name}_buckets"].create_index(
+                [("session_id", ASCENDING), ("user_id", ASCENDING), ("seq", ASCENDING)],
+                unique=True, name="session_user_seq_unique"
+            ),
+        ],
+        memory_config.VECTOR_COLLECTION: [
+            db[memory_config.VECTOR_COLLECTION].create_index(
+                [("session_id", ASCENDING), ("user_id", ASCENDING), ("turn", ASCENDING)],
+                unique=True, name="session_user_turn_unique"
+            ),
+        ],
+    }
+    if memory_config.SESSION_TTL_DAYS > 0:
+        for name in created:
+            # expires_at holds the absolute expiry time, refreshed on activity.
+            created[name].append(
+                db[name].create_index("expires_at", expireAfterSeconds=0, name="expires_at_ttl")
+            )
+    logger.info("Ensured conversation indexes: %s", created)
+    return created
+
+
+def explain_session_lookup(collection_name: str = "conversations") -> dict:
+    """Return the winning plan stages for the header and bucket lookups of a session."""
+    db = get_db(alias='default')
+    query = {"session_id": "explain-probe", "user_id": "explain-probe"}
+    plans = {
+        collection_name: db[collection_name].find(query).explain(),
+        f"{collection_name}_buckets": db[f"{collection_name}_buckets"].find(query).sort("seq", -1).explain(),
+    }
+    return {name: _plan_stages(plan["queryPlanner"]["winningPlan"]) for name, plan in plans.items()}
+
+
+def _plan_stages(plan: dict) -> list:
+    stages = [plan.get("stage")]
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            stages.extend(_plan_stages(child))
+    return stages
@@ -0,0 +1,440 @@
+import atexit
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from threading import Event, Lock, Thread
+
+from django.utils import timezone
+from mongoengine import get_db
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from .config import memory_config
+from .hot_tier import get_hot_tier
+from .invalidation import get_invalidation_bus
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+DUPLICATE_KEY = 11000
+
+
+class BucketConflict(Exception):
+    """Concurrent writers kept claiming the bucket an append was planned for."""
+
+    def __init__(self, session_id: str, remaining: list):
+        super().__init__(f"Bucket writes for session {session_id} kept conflicting")
+        self.remaining = remaining
+
+
+class WriteBehindBuffer:
+    """Queues conversation turns in-process and flushes them to Mongo, one bulk_write per session.
+
+    Durability: ``append`` returns as soon as the turn is queued, before Mongo has it.
+    The queue is flushed every ``flush_interval`` seconds, as soon as ``max_batch``
+    turns are waiting, and from an ``atexit`` hook on clean shutdown. A process that
+    dies without running that hook (SIGKILL, OOM kill, host crash) loses whatever was
+    still queued, i.e. at most ``flush_interval`` seconds of turns. Turns a flush
+    could not write go back at the head of the queue and are retried on the next cycle.
+    Readers in the same process see queued turns through ``pending_for``; other
+    processes only see them after the flush.
+    """
+
+    def __init__(self, flush_interval: float, max_batch: int):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = []
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._wakeup = Event()
+        self._closed = False
+        self._thread = Thread(target=self._run, name="conversation-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, store, session_id: str, user_id: str, messages: list, now):
+        with self._lock:
+            self._queue.append((store, session_id, user_id, messages, now))
+            depth = len(self._queue)
+        metrics.set_gauge("conversation_store.write_behind.queued", depth)
+        if depth >= self.max_batch:
+            self._wakeup.set()
+
+    def pending_for(self, store, session_id: str, user_id: str) -> list:
+        with self._lock:
+            return [
+                message
+                for queued_store, queued_session, queued_user, messages, _ in self._queue
+                if queued_store.name == store.name
+                and queued_session == session_id and queued_user == user_id
+                for message in messages
+            ]
+
+    def discard(self, store, session_id: str, user_id: str):
+        with self._lock:
+            self._queue = [
+                item for item in self._queue
+                if not (item[0].name == store.name and item[1] == session_id and item[2] == user_id)
+            ]
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._queue = self._queue, []
+            if not batch:
+                return
+            started = time.monotonic()
+            # Coalesce each session's queued turns before building bucket writes.
+            grouped = {}
+            for store, session_id, user_id, messages, now in batch:
+                key = (store.name, session_id, user_id)
+                if key not in grouped:
+                    grouped[key] = {"store": store, "messages": [], "last": now}
+                grouped[key]["messages"].extend(messages)
+                grouped[key]["last"] = now
+            failed = []
+            for (_, session_id, user_id), group in grouped.items():
+                try:
+                    group["store"].write_messages(session_id, user_id, group["messages"], group["last"])
+                except BucketConflict as e:
+                    failed.append((group["store"], session_id, user_id, e.remaining, group["last"]))
+                except Exception as e:
+                    logger.error("Write-behind flush for session %s failed, requeueing: %s", session_id, e)
+                    failed.append((group["store"], session_id, user_id, group["messages"], group["last"]))
+            if failed:
+                metrics.incr("conversation_store.write_behind.flush_errors")
+                with self._lock:
+                    self._queue = failed + self._queue
+                    metrics.set_gauge("conversation_store.write_behind.queued", len(self._queue))
+                return
+            metrics.observe("conversation_store.write_behind.flush", time.monotonic() - started)
+            metrics.incr("conversation_store.write_behind.flushed_turns", len(batch))
+            with self._lock:
+                metrics.set_gauge("conversation_store.write_behind.queued", len(self._queue))
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Unexpected error in write-behind flusher: %s", e, exc_info=True)
+
+
+_write_behind = None
+_write_behind_lock = Lock()
+
+
+def get_write_behind() -> WriteBehindBuffer:
+    global _write_behind
+    with _write_behind_lock:
+        if _write_behind is None:
+            _write_behind = WriteBehindBuffer(
+                flush_interval=memory_config.WRITE_BEHIND_INTERVAL,
+                max_batch=memory_config.WRITE_BEHIND_MAX_BATCH,
+            )
+        return _write_behind
+
+
+NEWEST_FIRST = [("seq", -1)]
+OLDEST_FIRST = [("seq", 1)]
+BUCKET_WRITE_ATTEMPTS = 5
+
+_last_touch = OrderedDict()
+_last_touch_lock = Lock()
+_LAST_TOUCH_MAX_ENTRIES = 10000
+
+
+def session_expiry(now):
+    if memory_config.SESSION_TTL_DAYS <= 0:
+        return None
+    return now + timedelta(days=memory_config.SESSION_TTL_DAYS)
+
+
+class MongoConversationStore:
+    """Persistence for conversations using the bucket pattern.
+
+    ``<collection>`` holds one small header per (session_id, user_id) with session
+    level fields (summary, summarized_count, ...). Messages live in
+    ``<collection>_buckets``, at most ``bucket_size`` per document, so no document
+    grows without bound and the newest messages can be read with a ``$slice``
+    projection instead of pulling the whole history. Buckets carry a per-session
+    ``seq``; appends only ever go to the highest one, and a new one is opened when it
+    is full, so reading buckets in ``seq`` order returns messages in order. When the Redis hot tier is
+    enabled it sits in front of both collections for reads of recent messages.
+    """
+
+    def __init__(self, collection_name: str = "conversations", write_behind: bool = None, bucket_size: int = None):
+        db = get_db(alias='default')
+        self.name = collection_name
+        self.headers = db[collection_name]
+        self.buckets = db[f"{collection_name}_buckets"]
+        self.vectors = db[memory_config.VECTOR_COLLECTION]
+        self.bucket_size = bucket_size or memory_config.BUCKET_SIZE
+        if write_behind is None:
+            write_behind = memory_config.WRITE_BEHIND
+        self._write_behind = get_write_behind() if write_behind else None
+        self._hot_tier = get_hot_tier()
+        self._bus = get_invalidation_bus()
+
+    def _filter(self, session_id: str, user_id: str) -> dict:
+        return {"session_id": session_id, "user_id": user_id}
+
+    def load(self, session_id: str, user_id: str, limit: int = None, since_field: str = None) -> dict:
+        """Return the session header plus its newest ``limit`` messages and total message count.
+
+        ``since_field`` names a header field holding a count of oldest messages to
+        leave out (e.g. ``summarized_count``); it caps ``limit`` accordingly.
+        """
+        if self._hot_tier is not None:
+            cached = self._hot_tier.get(self.name, session_id, user_id)
+            doc = self._slice_cached(cached, limit, since_field) if cached else None
+            if doc is not None:
+                metrics.incr("hot_tier.hits")
+                return doc
+            metrics.incr("hot_tier.misses")
+            # Read before Mongo, so a write landing in between keeps this snapshot out of the cache.
+            version = self._hot_tier.version(self.name, session_id, user_id)
+        doc = self._load_from_mongo(session_id, user_id, limit, since_field)
+        if self._hot_tier is not None:
+            fields = {key: value for key, value in doc.items() if key not in ("messages", "message_count")}
+            self._hot_tier.put(self.name, session_id, user_id, fields, doc["messages"], doc["message_count"], version)
+        return doc
+
+    def _slice_cached(self, cached, limit: int, since_field: str):
+        fields, messages, message_count = cached
+        if since_field:
+            remaining = max(0, message_count - fields.get(since_field, 0))
+            limit = remaining if limit is None else min(limit, remaining)
+        needed = message_count if limit is None else min(limit, message_count)
+        if needed > len(messages):
+            # The cached tail does not reach back far enough for this read.
+            return None
+        doc = dict(fields)
+        doc["messages"] = messages[len(messages) - needed:]
+        doc["message_count"] = message_count
+        return doc
+
+    def _load_from_mongo(self, session_id: str, user_id: str, limit: int, since_field: str) -> dict:
+        # $slice: 0 tells us whether a legacy messages array exists without transferring it.
+        header = self.headers.find_one(self._filter(session_id, user_id), {"_id": 0, "messages": {"$slice": 0}}) or {}
+        legacy = []
+        if "messages" in header:
+            header.pop("messages")
+            legacy = self._legacy_messages(session_id, user_id)
+        counts = list(self.buckets.find(self._filter(session_id, user_id), {"count": 1}).sort(NEWEST_FIRST))
+        message_count = len(legacy) + sum(bucket["count"] for bucket in counts)
+        if since_field:
+            remaining = max(0, message_count - header.get(since_field, 0))
+            limit = remaining if limit is None else min(limit, remaining)
+        messages = []
+        if (counts or legacy) and (limit is None or limit > 0):
+            wanted, needed = [], limit if limit is not None else message_count
+            for bucket in counts:
+                if needed <= 0:
+                    break
+                wanted.append(bucket["_id"])
+                needed -= bucket["count"]
+            projection = {"messages": 1} if limit is None else {"messages": {"$slice": -limit}}
+            rows = self.buckets.find({"_id": {"$in": wanted}}, projection).sort(OLDEST_FIRST)
+            messages.extend(legacy)
+            for row in rows:
+                messages.extend(row.get("messages", []))
+            if limit is not None:
+                messages = messages[-limit:]
+        if self._write_behind is not None:
+            pending = self._write_behind.pending_for(self, session_id, user_id)
+            messages.extend(pending)
+            message_count += len(pending)
+        header["messages"] = messages
+        header["message_count"] = message_count
+        return header
+
+    def iter_history(self, session_id: str, user_id: str):
+        """Yield older history lazily, one bucket's messages at a time, newest bucket first."""
+        cursor = self.buckets.find(self._filter(session_id, user_id), {"messages": 1}).sort(NEWEST_FIRST).batch_size(1)
+        for bucket in cursor:
+            yield bucket.get("messages", [])
+        legacy = self._legacy_messages(session_id, user_id)
+        if legacy:
+            yield legacy
+
+    def _legacy_messages(self, session_id: str, user_id: str) -> list:
+        """Messages of a header not yet moved into buckets by ``migrate_document``, served read-only."""
+        metrics.incr("conversation_store.legacy_reads")
+        header = self.headers.find_one(
+            {**self._filter(session_id, user_id), "messages": {"$exists": True}}, {"messages": 1}
+        )
+        return header.get("messages", []) if header else []
+
+    def _bucket_update(self, session_id: str, user_id: str, seq: int, chunk: list, now):
+        # Only matches bucket ``seq`` while the chunk still fits. If another writer has
+        # filled it, the upsert collides with the unique (session, user, seq) index
+        # instead of creating a second bucket with the same seq.
+        on_insert = {"created_at": now}
+        if memory_config.SESSION_TTL_DAYS > 0:
+            on_insert["expires_at"] = session_expiry(now)
+        return (
+            {**self._filter(session_id, user_id), "seq": seq, "count": {"$lte": self.bucket_size - len(chunk)}},
+            {
+                "$push": {"messages": {"$each": chunk}},
+                "$inc": {"count": len(chunk)},
+                "$set": {"updated_at": now},
+                "$setOnInsert": on_insert
+            },
+        )
+
+    def _touch(self, session_id: str, user_id: str, now):
+        """Push the session's TTL expiry forward, at most once per SESSION_TOUCH_INTERVAL."""
+        if memory_config.SESSION_TTL_DAYS <= 0:
+            return
+        key = (self.name, session_id, user_id)
+        with _last_touch_lock:
+            last = _last_touch.get(key)
+            if last is not None and (now - last).total_seconds() < memory_config.SESSION_TOUCH_INTERVAL:
+                return
+            _last_touch[key] = now
+            _last_touch.move_to_end(key)
+            while len(_last_touch) > _LAST_TOUCH_MAX_ENTRIES:
+                _last_touch.popitem(last=False)
+        update = {"$set": {"expires_at": session_expiry(now)}}
+        self.headers.update_one(self._filter(session_id, user_id), update, upsert=True)
+        self.buckets.update_many(self._filter(session_id, user_id), update)
+        self.vectors.update_many(self._filter(session_id, user_id), update)
+
+    def _newest_bucket(self, session_id: str, user_id: str):
+        """``(seq, count)`` of the bucket appends go to, or ``None`` if a new one must be opened."""
+        newest = self.buckets.find_one(self._filter(session_id, user_id), {"seq": 1, "count": 1}, sort=NEWEST_FIRST)
+        if newest is None:
+            return None
+        return newest["seq"], newest["count"]
+
+    def bucket_operations(self, session_id: str, user_id: str, messages: list, now) -> list:
+        """Plan the writes appending ``messages``: ``[(UpdateOne, messages it writes)]``.
+
+        The newest bucket is filled up first, then full buckets are opened at the
+        following sequence numbers.
+        """
+        seq, count = self._newest_bucket(session_id, user_id) or (-1, self.bucket_size)
+        chunks = []
+        room = self.bucket_size - count
+        if room > 0:
+            chunks.append((seq, messages[:room]))
+        for start in range(max(0, room), len(messages), self.bucket_size):
+            seq += 1
+            chunks.append((seq, messages[start:start + self.bucket_size]))
+        return [
+            (UpdateOne(*self._bucket_update(session_id, user_id, chunk_seq, chunk, now), upsert=True), chunk)
+            for chunk_seq, chunk in chunks
+            if chunk
+        ]
+
+    def write_messages(self, session_id: str, user_id: str, messages: list, now):
+        """Append ``messages`` to the session's buckets, in order.
+
+        A write that loses a race for a bucket (duplicate key on its ``seq``) keeps
+        what was written before it and re-plans the rest against the new newest
+        bucket. Raises ``BucketConflict`` with the unwritten messages if that keeps
+        happening.
+        """
+        for _ in range(BUCKET_WRITE_ATTEMPTS):
+            planned = self.bucket_operations(session_id, user_id, messages, now)
+            if not planned:
+                return
+            try:
+                self.buckets.bulk_write([operation for operation, _ in planned], ordered=True)
+                return
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if not errors or errors[0].get("code") != DUPLICATE_KEY:
+                    raise
+                metrics.incr("conversation_store.bucket_conflicts")
+                # The bulk is ordered, so everything before the failed write went through.
+                messages = [message for _, chunk in planned[errors[0]["index"]:] for message in chunk]
+        raise BucketConflict(session_id, messages)
+
+    def append_turn(self, session_id: str, user_id: str, user_content: str, ai_content: str):
+        now = timezone.now()
+        messages = [
+            {"role": "user", "content": user_content},
+            {"role": "ai", "content": ai_content},
+        ]
+        if self._write_behind is not None:
+            self._write_behind.append(self, session_id, user_id, messages, now)
+        else:
+            started = time.monotonic()
+            self.write_messages(session_id, user_id, messages, now)
+            metrics.observe("conversation_store.append_turn", time.monotonic() - started)
+        if self._hot_tier is not None:
+            self._hot_tier.append(self.name, session_id, user_id, messages)
+        if self._bus is not None:
+            self._bus.publish(user_id, session_id, "append")
+        self._touch(session_id, user_id, now)
+
+    def set_fields(self, session_id: str, user_id: str, fields: dict):
+        self.headers.update_one(self._filter(session_id, user_id), {"$set": fields}, upsert=True)
+        if self._hot_tier is not None:
+            self._hot_tier.set_fields(self.name, session_id, user_id, fields)
+
+    def delete(self, session_id: str, user_id: str):
+        """Remove the session; returns None as bucket deletes do not report message counts."""
+        if self._write_behind is not None:
+            self._write_behind.discard(self, session_id, user_id)
+        self.headers.delete_one(self._filter(session_id, user_id))
+        self.buckets.delete_many(self._filter(session_id, user_id))
+        if self._hot_tier is not None:
+            self._hot_tier.invalidate(self.name, session_id, user_id)
+        if self._bus is not None:
+            self._bus.publish(user_id, session_id, "clear")
+
+    def _lowest_seq(self, session_id: str, user_id: str) -> int:
+        lowest = self.buckets.find_one(self._filter(session_id, user_id), {"seq": 1}, sort=OLDEST_FIRST)
+        return lowest["seq"] if lowest else 0
+
+    def migrate_document(self, session_id: str, user_id: str) -> int:
+        """Move a legacy single-document ``messages`` array into buckets.
+
+        The legacy messages predate every bucket, so they are written at sequence
+        numbers below the lowest one. The base is recorded on the header first and the
+        buckets are upserted by ``seq``, so an interrupted migration can be re-run
+        without duplicating anything; the array is only removed once its buckets exist.
+        """
+        legacy = {**self._filter(session_id, user_id), "messages": {"$exists": True}}
+        header = self.headers.find_one(
+            legacy, {"messages": 1, "created_at": 1, "updated_at": 1, "legacy_seq_base": 1}
+        )
+        if not header:
+            return 0
+        messages = header.get("messages", [])
+        chunks = [messages[start:start + self.bucket_size] for start in range(0, len(messages), self.bucket_size)]
+        base = header.get("legacy_seq_base")
+        if base is None:
+            base = self._lowest_seq(session_id, user_id) - len(chunks)
+            self.headers.update_one({**legacy, "legacy_seq_base": {"$exists": False}}, {"$set": {"legacy_seq_base": base}})
+            # Another migrator may have recorded its base first; use whichever won.
+            base = self.headers.find_one(legacy, {"legacy_seq_base": 1})["legacy_seq_base"]
+        created_at = header.get("created_at") or timezone.now()
+        updated_at = header.get("updated_at") or created_at
+        for offset, chunk in enumerate(chunks):
+            self.buckets.update_one(
+                {**self._filter(session_id, user_id), "seq": base + offset},
+                {"$setOnInsert": {
+                    "count": len(chunk),
+                    "messages": chunk,
+                    "created_at": created_at,
+                    "updated_at": updated_at,
+                }},
+                upsert=True,
+            )
+        self.headers.update_one(legacy, {"$unset": {"messages": "", "legacy_seq_base": ""}})
+        if self._hot_tier is not None:
+            self._hot_tier.invalidate(self.name, session_id, user_id)
+        return len(messages)
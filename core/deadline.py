@@ -0,0 +1,170 @@
+import contextvars
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .config import config
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar[Optional["Deadline"]] = ContextVar("agent_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage: str):
+        super().__init__(f"Request deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """Time budget of one agent request, created by the view and passed down.
+
+    Code below the agent (tools, retriever, LLM helpers) reads it with
+    ``get_deadline()`` and calls ``check`` before starting expensive work, so a
+    request over budget stops at the next boundary instead of finishing every
+    remaining LLM call. ``cancel`` ends the budget early. ``stage`` records
+    per-stage wall time for the response.
+    """
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.started = time.monotonic()
+        self.expires_at = self.started + budget
+        self.cancelled = False
+        self.timings = []
+
+    @classmethod
+    def from_request(cls, request) -> "Deadline":
+        budget = config.REQUEST_BUDGET
+        requested = request.headers.get("X-Request-Timeout")
+        if requested:
+            try:
+                budget = float(requested)
+            except ValueError:
+                pass
+        return cls(max(1.0, min(budget, config.REQUEST_BUDGET_MAX)))
+
+    def remaining(self) -> float:
+        return 0.0 if self.cancelled else max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def cancel(self):
+        self.cancelled = True
+
+    def timeout(self, default: float = None) -> float:
+        """Timeout for a blocking call: what's left of the budget, capped at ``default``."""
+        remaining = self.remaining()
+        return remaining if default is None else min(default, remaining)
+
+    def check(self, stage: str):
+        if self.expired:
+            metrics.incr("deadline.exceeded")
+            metrics.incr(f"deadline.exceeded.{stage}")
+            raise DeadlineExceeded(stage)
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.monotonic()
+        try:
+            yield self
+        finally:
+            elapsed = time.monotonic() - started
+            self.timings.append({"stage": name, "ms": round(elapsed * 1000, 1)})
+
+    def summary(self) -> dict:
+        return {
+            "budget_s": self.budget,
+            "elapsed_ms": round((time.monotonic() - self.started) * 1000, 1),
+            "stages": self.timings,
+        }
+
+
+def get_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+def check_deadline(stage: str):
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check(stage)
+
+
+def timed_stage(name: str):
+    """Check the current deadline and time ``name`` against it; a no-op without a deadline."""
+    deadline = _current.get()
+    if deadline is None:
+        return nullcontext()
+    deadline.check(name)
+    return deadline.stage(name)
+
+
+def detached_context() -> contextvars.Context:
+    """Copy of the current context for background work that may outlive the request.
+
+    The request's deadline is dropped; everything else (the user LLM calls are billed
+    to, the generation cache route) carries over.
+    """
+    context = contextvars.copy_context()
+    context.run(_current.set, None)
+    return context
+
+
+@contextmanager
+def use_deadline(deadline: Deadline):
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+class DeadlineCallbackHandler(BaseCallbackHandler):
+    """Stops an agent run at the next LLM or tool call once the deadline has passed.
+
+    It also times each agent LLM call and tool call, and keeps the latest tool output
+    so the caller can return it as a partial answer.
+    """
+
+    raise_error = True
+
+    def __init__(self, deadline: Deadline):
+        self.deadline = deadline
+        self.last_observation = None
+        self._started = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.deadline.check("agent_llm")
+        self._started[run_id] = ("agent_llm", time.monotonic())
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = (serialized or {}).get("name", "tool")
+        self.deadline.check(f"tool:{name}")
+        self._started[run_id] = (f"tool:{name}", time.monotonic())
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id)
+        if output:
+            self.last_observation = output
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def _finish(self, run_id):
+        stage = self._started.pop(run_id, None)
+        if stage is not None:
+            name, started = stage
+            self.deadline.timings.append({"stage": name, "ms": round((time.monotonic() - started) * 1000, 1)})
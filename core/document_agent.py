@@ -1,17 +1,68 @@
 import logging
-from langchain.agents import initialize_agent
+from contextlib import nullcontext
 from langchain.schema import SystemMessage
-from langchain_community.llms import Ollama
 
-from .config import config
+from .agent_execution import AgentScaffold, cached_scaffold
+from .answer_cache import answer_cache, is_self_contained
+from .config import config, document_config
+from .deadline import Deadline, DeadlineCallbackHandler, DeadlineExceeded, use_deadline
 from .mongo_conversational_memory import MongoConversationMemory
-from .tools import ToolFactory
+from .tools import ToolFactory, bind_retriever
+from .usage import MeteredOllama
 from .rag_service import LocalPDFVectorizer
 from langchain_core.exceptions import OutputParserException
 
 logger = logging.getLogger(__name__)
 
+SYSTEM_MESSAGE = SystemMessage(
+    content=(
+        "Please ensure that your response fully and accurately addresses the original query provided by the user. "
+        "Only provide the final answer; do NOT include your internal reasoning, thoughts, or intermediate Action/Thought/Observation steps. "
+        "Do NOT respond like: \n"
+        "    Question: What is TULIP\n"
+        "    Thought: ...\n"
+        "    Action: ...\n"
+        "    Action Input: ...\n"
+        "Instead, reply with a concise, informative, and complete answer relevant to the user’s question."
+    )
+)
+
+
+def build_llm():
+    return MeteredOllama(
+        model=config.LLM_MODEL,
+        system=config.LLM_SYSTEM_PROMPT,
+        temperature=0.7, 
+        verbose=True,
+        top_p=0.9,
+        # Shared by every request; MeteredOllama lowers the timeout to each request's Deadline.
+        timeout=int(config.REQUEST_BUDGET_MAX)
+    )
+
+
+def build_scaffold() -> AgentScaffold:
+    llm = build_llm()
+    return AgentScaffold(
+        llm,
+        ToolFactory.create_shared_tools(llm),
+        config.AGENT_TYPE,
+        agent_kwargs={
+            "system_message": SYSTEM_MESSAGE,
+            "return_intermediate_steps": False,
+        },
+        verbose=True,
+        handle_parsing_errors=True,
+        max_iterations=config.MAX_ITERATIONS,
+        early_stopping_method=config.EARLY_STOPPING_METHOD,
+    )
+
+
 class DocumentAgent:
+    """Answers questions about one uploaded document.
+
+    The LLM, tools and planner prompt come from a process-wide scaffold; only the
+    memory, retriever and executor are created per instance.
+    """
 
     def __init__(self, user_id: str, session_id: str = "default", doc_id: int = None):
         logger.info("Initializing DocumentAgent with user_id: %s, session_id: %s, doc_id: %s", 
@@ -21,22 +72,14 @@ class DocumentAgent:
         self.session_id = session_id
         self.doc_id = doc_id
         
-        self.llm = self._initialize_llm()
+        scaffold = cached_scaffold("document_agent", build_scaffold)
+        self.llm = scaffold.llm
         self.memory = self._initialize_memory()
         self.retriever = self._initialize_retriever()
-        self.agent = self._initialize_agent()
+        self.agent = scaffold.executor(self.memory)
         
         logger.info("DocumentAgent initialized successfully.")
 
-    def _initialize_llm(self):
-        return Ollama(
-            model=config.LLM_MODEL,
-            system=config.LLM_SYSTEM_PROMPT,
-            temperature=0.7, 
-            verbose=True,
-            top_p=0.9    
-        )
-
     def _initialize_memory(self):
         return MongoConversationMemory(
             session_id=self.session_id,
@@ -46,46 +89,77 @@ class DocumentAgent:
     def _initialize_retriever(self):
         return LocalPDFVectorizer(self.doc_id)
 
-    def _initialize_agent(self):
-        tools = ToolFactory.create_tools(self.retriever, self.llm)
-        
-        return initialize_agent(
-            tools=tools,
-            llm=self.llm,
-            agent=config.AGENT_TYPE,
-            memory=self.memory,
-            verbose=True,
-            handle_parsing_errors=True,
-            max_iterations=config.MAX_ITERATIONS,
-            early_stopping_method=config.EARLY_STOPPING_METHOD,
-            agent_kwargs={
-                "system_message": SystemMessage(
-                    content=(
-                        "Please ensure that your response fully and accurately addresses the original query provided by the user. "
-                        "Only provide the final answer; do NOT include your internal reasoning, thoughts, or intermediate Action/Thought/Observation steps. "
-                        "Do NOT respond like: \n"
-                        "    Question: What is TULIP\n"
-                        "    Thought: ...\n"
-                        "    Action: ...\n"
-                        "    Action Input: ...\n"
-                        "Instead, reply with a concise, informative, and complete answer relevant to the user’s question."
-                    )
-                ),
-                "return_intermediate_steps": False,
-            }
-        )
+    def _cached_answer(self, query: str):
+        """Return ``(answer, version, vector)`` from the answer cache; ``answer`` is None on a miss."""
+        if not document_config.ANSWER_CACHE or self.doc_id is None or not is_self_contained(query):
+            return None, None, None
+        version = self.retriever.index_version()
+        if version is None:
+            return None, None, None
+        try:
+            answer, vector = answer_cache.lookup(self.doc_id, version, query, self.retriever.embeddings.embed_query)
+        except Exception as e:
+            logger.warning("Answer cache lookup failed for doc %s: %s", self.doc_id, e)
+            return None, None, None
+        return answer, version, vector
 
-    def ask(self, query: str):
+    def ask(self, query: str, deadline: Deadline = None):
         logger.info("Received ask query: %s", query)
-        result = self.agent.invoke({"input": query})
-        # Save context using the memory object directly
-        self.memory.save_context({"input": query}, result)
-        logger.info("Agent response: %s", result)
-        
+        deadline = deadline or Deadline(config.REQUEST_BUDGET)
+        with use_deadline(deadline):
+            with deadline.stage("answer_cache"):
+                cached, version, vector = self._cached_answer(query)
+            if cached is not None:
+                result = {"input": query, "output": cached}
+                self.memory.save_context({"input": query}, result)
+                return {
+                    "answer": result,
+                    "session_id": self.session_id,
+                    "doc_id": self.doc_id,
+                    "cached": True,
+                    "partial": False,
+                    "timings": deadline.summary(),
+                }
+
+            handler = DeadlineCallbackHandler(deadline)
+            prefetch = (
+                self.retriever.prefetch(query)
+                if config.SPECULATIVE_RETRIEVAL and self.doc_id is not None else nullcontext()
+            )
+            # The executor stops between iterations and generates from what it has so far.
+            self.agent.max_execution_time = max(1.0, deadline.remaining())
+            partial = False
+            try:
+                # The vector search for the raw question overlaps the agent's planning call.
+                with bind_retriever(self.retriever), prefetch, deadline.stage("agent"):
+                    result = self.agent.invoke({"input": query}, config={"callbacks": [handler]})
+            except DeadlineExceeded as e:
+                logger.warning("DocumentAgent ran out of time during %s for query: %s", e.stage, query)
+                partial = True
+                result = {
+                    "input": query,
+                    "output": handler.last_observation or "The request ran out of time before an answer was ready.",
+                }
+            output = result.get("output") if isinstance(result, dict) else None
+            if deadline.expired or (isinstance(output, str) and output.startswith("Agent stopped")):
+                # Hit max_execution_time/max_iterations: the answer was generated from partial work.
+                partial = True
+
+            if not partial:
+                # Save context using the memory object directly
+                self.memory.save_context({"input": query}, result)
+                # Only complete answers are cached.
+                if version is not None and output:
+                    answer_cache.store(self.doc_id, version, query, output, vector)
+            logger.info("Agent response: %s", result)
+
         return {
             "answer": result,
             "session_id": self.session_id,
             "doc_id": self.doc_id,
+            "cached": False,
+            "partial": partial,
+            "timings": deadline.summary(),
         }
         # except  OutputParserException as e:
         #     fallback_response = self.llm(f"Please answer this question directly: {query}")
@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+from .config import document_config
+from .metrics import metrics
+from .structured_output import QuestionSet, generate_structured
+from .summarization import MapReduceSummarizer
+
+logger = logging.getLogger(__name__)
+
+ARTIFACTS_FILE = "artifacts.json"
+
+QUESTION_PROMPT = """Using ONLY the text below, write {count} questions a reader could answer from it.
+Mix the types MCQ, Short Answer and Open Ended.
+
+TEXT:
+{text}
+
+Return ONLY a JSON object in this structure (no explanation):
+{{"questions": [
+  {{"type": "MCQ", "question": "?", "options": ["A","B","C","D"], "answer": "A"}},
+  {{"type": "Short Answer", "question": "?", "answer": "..."}},
+  {{"type": "Open Ended", "question": "?"}}
+]}}"""
+
+# Loaded artifacts per index path, reused until the file changes on disk.
+_loaded = {}
+_loaded_lock = Lock()
+
+
+def artifacts_path(retriever) -> str:
+    return os.path.join(retriever.index_path, ARTIFACTS_FILE)
+
+
+def load_artifacts(retriever) -> dict:
+    """Return the precomputed artifacts for the retriever's document, or ``{}``.
+
+    Artifacts built against an older index version are ignored, so a re-upload
+    never serves the previous document's summary.
+    """
+    path = artifacts_path(retriever)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    with _loaded_lock:
+        cached = _loaded.get(path)
+        if cached is None or cached[0] != mtime:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    cached = (mtime, json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning("Could not read artifacts for doc %s: %s", retriever.doc_id, e)
+                return {}
+            _loaded[path] = cached
+    artifacts = cached[1]
+    if artifacts.get("index_version") != retriever.index_version():
+        return {}
+    return artifacts
+
+
+def save_artifacts(retriever, artifacts: dict):
+    path = artifacts_path(retriever)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(artifacts, f)
+    # Readers never see a half-written file.
+    os.replace(tmp_path, path)
+
+
+def build_artifacts(retriever, llm) -> dict:
+    """Compute summary, outline, numeric tables and question bank for one document."""
+    started = time.monotonic()
+    version = retriever.index_version()
+    chunks = retriever.get_ordered_chunks()
+    summarizer = MapReduceSummarizer(llm, retriever.doc_id)
+    sections = summarizer.sections(chunks)
+
+    section_summaries = summarizer.section_summaries(chunks)
+    outline = [{"pages": list(span), "summary": summary} for span, summary in section_summaries]
+    summary = summarizer.reduce([s for _, s in section_summaries]) if section_summaries else ""
+
+    tables = []
+    for span, text in sections:
+        df = retriever.extract_data(text)
+        if not df.empty:
+            tables.append({"pages": list(span), "labels": df["Label"].tolist(), "values": df["Value"].tolist()})
+
+    questions = []
+    for span, text in sections[:document_config.QUESTION_BANK_SECTIONS]:
+        for question in _generate_questions(llm, text):
+            question["pages"] = list(span)
+            questions.append(question)
+
+    artifacts = {
+        "doc_id": retriever.doc_id,
+        "index_version": version,
+        "created_at": time.time(),
+        "summary": summary,
+        "outline": outline,
+        "numeric_tables": tables,
+        "question_bank": questions,
+    }
+    metrics.observe("document_artifacts.build", time.monotonic() - started)
+    logger.info(
+        "Built artifacts for doc %s: %d sections, %d tables, %d questions",
+        retriever.doc_id, len(outline), len(tables), len(questions)
+    )
+    return artifacts
+
+
+def _generate_questions(llm, text: str) -> list:
+    prompt = QUESTION_PROMPT.format(count=document_config.QUESTIONS_PER_SECTION, text=text[:3000])
+    try:
+        parsed = generate_structured(llm, prompt, QuestionSet)
+    except Exception as e:
+        logger.warning("Question generation failed during enrichment: %s", e)
+        return []
+    if parsed is None:
+        return []
+    return [q.model_dump(exclude_none=True) for q in parsed.questions if q.question]
@@ -0,0 +1,129 @@
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from threading import Event, Lock
+
+from .config import config
+from .deadline import DeadlineExceeded, get_deadline
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_USER = "system"
+# Assumed tokens of a user's call until some of their calls have finished.
+DEFAULT_COST = 500.0
+
+
+class _Ticket:
+    __slots__ = ("user", "start_tag", "estimate", "cost", "granted", "cancelled", "event")
+
+    def __init__(self, user: str, start_tag: float, estimate: float):
+        self.user = user
+        self.start_tag = start_tag
+        self.estimate = estimate
+        self.cost = 0.0
+        self.granted = False
+        self.cancelled = False
+        self.event = Event()
+
+
+class FairScheduler:
+    """Weighted start-time fair queueing of LLM calls across users.
+
+    At most ``slots`` calls run at once. When they are all busy, waiting calls are
+    served in order of their start tag: the later of the current virtual time and the
+    finish tag of the user's previous call, where a call's finish tag advances by the
+    tokens it used divided by the user's weight. A user who has just burned many tokens
+    therefore waits behind users who have not, without a fixed per-user cap. A call's
+    cost is only known once it finishes, so queued calls reserve the user's recent
+    average and the difference is settled on release.
+    """
+
+    def __init__(self, slots: int, weights: dict = None):
+        self.slots = max(1, slots)
+        self.weights = weights or {}
+        self._busy = 0
+        self._waiting = []
+        self._finish = {}
+        self._estimates = {}
+        self._vtime = 0.0
+        self._sequence = itertools.count()
+        self._lock = Lock()
+
+    def weight(self, user: str) -> float:
+        return max(self.weights.get(user, 1.0), 0.01)
+
+    @contextmanager
+    def slot(self, user_id=None):
+        """Hold one LLM slot; set ``ticket.cost`` (tokens) before leaving."""
+        user = str(user_id) if user_id is not None else SYSTEM_USER
+        with self._lock:
+            estimate = self._estimates.get(user, DEFAULT_COST)
+            ticket = _Ticket(user, max(self._vtime, self._finish.get(user, 0.0)), estimate)
+            self._finish[user] = ticket.start_tag + estimate / self.weight(user)
+            if self._busy < self.slots and not self._waiting:
+                self._busy += 1
+                self._grant(ticket)
+            else:
+                heapq.heappush(self._waiting, (ticket.start_tag, next(self._sequence), ticket))
+                metrics.set_gauge("fair_scheduler.waiting", len(self._waiting))
+        if not ticket.granted:
+            self._wait(ticket)
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    def _wait(self, ticket: _Ticket):
+        started = time.monotonic()
+        deadline = get_deadline()
+        ticket.event.wait(deadline.remaining() if deadline is not None else None)
+        with self._lock:
+            if not ticket.granted:
+                # Out of time; _release skips cancelled tickets. The call never runs, so
+                # hand back the finish-tag advance it reserved on arrival.
+                ticket.cancelled = True
+                self._finish[ticket.user] = self._finish.get(ticket.user, 0.0) - ticket.estimate / self.weight(ticket.user)
+                metrics.incr("fair_scheduler.timeouts")
+                raise DeadlineExceeded("llm_queue")
+        metrics.observe("fair_scheduler.wait", time.monotonic() - started)
+
+    def _grant(self, ticket: _Ticket):
+        ticket.granted = True
+        self._vtime = max(self._vtime, ticket.start_tag)
+        ticket.event.set()
+
+    def _release(self, ticket: _Ticket):
+        with self._lock:
+            self._finish[ticket.user] = self._finish.get(ticket.user, 0.0) + (
+                (ticket.cost - ticket.estimate) / self.weight(ticket.user)
+            )
+            self._estimates[ticket.user] = 0.8 * ticket.estimate + 0.2 * ticket.cost
+            while self._waiting:
+                _, _, waiter = heapq.heappop(self._waiting)
+                if not waiter.cancelled:
+                    # Hand the slot straight over; _busy stays the same.
+                    self._grant(waiter)
+                    break
+            else:
+                self._busy -= 1
+            metrics.set_gauge("fair_scheduler.waiting", len(self._waiting))
+            if len(self._finish) > 1000:
+                # Users at or behind the virtual time would start there anyway.
+                self._finish = {user: tag for user, tag in self._finish.items() if tag > self._vtime}
+                self._estimates = {user: self._estimates[user] for user in self._finish if user in self._estimates}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "slots": self.slots,
+                "busy": self._busy,
+                "waiting": sum(1 for *_, ticket in self._waiting if not ticket.cancelled),
+                "virtual_time": round(self._vtime, 1),
+                "users_ahead_of_virtual_time": sum(1 for tag in self._finish.values() if tag > self._vtime),
+            }
+
+
+fair_scheduler = FairScheduler(slots=config.LLM_SLOTS, weights=config.USER_WEIGHTS)
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Optional
+
+from django_redis import get_redis_connection
+
+from .config import config
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BYPASS_HEADER = "X-Generation-Cache"
+
+_route: ContextVar[Optional[str]] = ContextVar("generation_cache_route", default=None)
+_bypass: ContextVar[bool] = ContextVar("generation_cache_bypass", default=False)
+
+
+@contextmanager
+def cache_route(name: str):
+    """Mark the LLM calls inside the block as coming from route ``name``.
+
+    Calls above temperature 0 are only cached when their route is listed in
+    ``GENERATION_CACHE_ROUTES``.
+    """
+    token = _route.set(name)
+    try:
+        yield
+    finally:
+        _route.reset(token)
+
+
+@contextmanager
+def use_bypass(bypass: bool):
+    token = _bypass.set(bool(bypass))
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+def bypass_requested(request) -> bool:
+    """``X-Generation-Cache: bypass`` skips cached generations for this request (they are still refreshed)."""
+    return request.headers.get(BYPASS_HEADER, "").lower() == "bypass"
+
+
+# KEYS: index. ARGV: now, oldest score to keep, max entries, key prefix.
+# Drops index entries whose cache keys have expired, then evicts the oldest
+# entries over the limit. Returns the number evicted.
+TRIM_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local excess = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[3])
+if excess <= 0 then
+    return 0
+end
+local oldest = redis.call('ZPOPMIN', KEYS[1], excess)
+for i = 1, #oldest, 2 do
+    redis.call('DEL', ARGV[4] .. oldest[i])
+end
+return excess
+"""
+
+
+class GenerationCache:
+    """Exact-match cache of LLM completions in Redis.
+
+    Keys are a hash of the model, every generation option and the fully rendered
+    prompt, so a hit is a completion the model could have returned for exactly this
+    call. Only deterministic calls (temperature 0) and calls from routes marked
+    cacheable are looked up. Entries expire after ``ttl`` and the newest
+    ``max_entries`` are kept; completions over ``max_bytes`` are not stored. Redis
+    failures count as misses.
+    """
+
+    PREFIX = "gencache:"
+    INDEX = "gencache:index"
+
+    def __init__(self, ttl: int, max_entries: int, max_bytes: int, routes, alias: str = "default"):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.routes = set(routes)
+        self.alias = alias
+        self._trim_script = None
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def _client(self):
+        return get_redis_connection(self.alias)
+
+    def applies(self, temperature) -> bool:
+        if not config.GENERATION_CACHE:
+            return False
+        return temperature == 0 or _route.get() in self.routes
+
+    @staticmethod
+    def key(model: str, options: dict, prompt: str) -> str:
+        material = json.dumps({"model": model, "options": options, "prompt": prompt}, sort_keys=True, default=str)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        if _bypass.get():
+            metrics.incr("generation_cache.bypasses")
+            return None
+        try:
+            raw = self._client.get(self.PREFIX + key)
+        except Exception as e:
+            logger.warning("Generation cache read failed: %s", e)
+            metrics.incr("generation_cache.errors")
+            raw = None
+        self._record(hit=raw is not None)
+        return raw.decode("utf-8") if raw is not None else None
+
+    def put(self, key: str, text: str):
+        data = text.encode("utf-8")
+        if len(data) > self.max_bytes:
+            metrics.incr("generation_cache.too_large")
+            return
+        now = time.time()
+        try:
+            client = self._client
+            pipe = client.pipeline()
+            pipe.set(self.PREFIX + key, data, ex=self.ttl)
+            pipe.zadd(self.INDEX, {key: now})
+            pipe.execute()
+            if self._trim_script is None:
+                self._trim_script = client.register_script(TRIM_SCRIPT)
+            evicted = self._trim_script(keys=[self.INDEX], args=[now, now - self.ttl, self.max_entries, self.PREFIX])
+            metrics.incr("generation_cache.stores")
+            if evicted:
+                metrics.incr("generation_cache.evictions", int(evicted))
+        except Exception as e:
+            logger.warning("Generation cache write failed: %s", e)
+            metrics.incr("generation_cache.errors")
+
+    def _record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+        metrics.incr("generation_cache.hits" if hit else "generation_cache.misses")
+        if _route.get():
+            metrics.incr(f"generation_cache.{'hits' if hit else 'misses'}.{_route.get()}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            stats = {
+                "enabled": config.GENERATION_CACHE,
+                "routes": sorted(self.routes),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else None,
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+            }
+        try:
+            stats["entries"] = self._client.zcard(self.INDEX)
+        except Exception:
+            stats["entries"] = None
+        return stats
+
+
+generation_cache = GenerationCache(
+    ttl=config.GENERATION_CACHE_TTL,
+    max_entries=config.GENERATION_CACHE_MAX_ENTRIES,
+    max_bytes=config.GENERATION_CACHE_MAX_BYTES,
+    routes=config.GENERATION_CACHE_ROUTES,
+)
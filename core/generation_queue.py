@@ -0,0 +1,128 @@
+import logging
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.response import Response
+
+from .config import config
+from .deadline import Deadline
+from .generation_cache import bypass_requested, use_bypass
+from .idempotency import SessionBusy, request_coordinator
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def is_async() -> bool:
+    return config.EXECUTION_MODE == "async"
+
+
+def user_group(user_id) -> str:
+    """Channels group that receives a user's finished generations."""
+    return f"generation.{user_id}"
+
+
+def _owner_key(task_id: str) -> str:
+    return f"generation_owner:{task_id}"
+
+
+def enqueue(request, task, workload: str, deadline: Deadline, **kwargs) -> Response:
+    """Queue ``task`` on the workload's queue and answer 202 with where to find the result."""
+    queue = config.GENERATION_QUEUES[workload]
+    result = task.apply_async(
+        kwargs={
+            **kwargs,
+            "budget": deadline.remaining(),
+            "enqueued_at": time.time(),
+            "cache_bypass": bypass_requested(request),
+        },
+        queue=queue,
+    )
+    cache.set(_owner_key(result.id), str(request.user.id), timeout=config.GENERATION_RESULT_TTL)
+    metrics.incr(f"generation.enqueued.{workload}")
+    return Response(
+        {
+            "task_id": result.id,
+            "state": "PENDING",
+            "queue": queue,
+            "poll_url": reverse("generation-result", args=[result.id]),
+        },
+        status=status.HTTP_202_ACCEPTED,
+    )
+
+
+def task_owner(task_id: str):
+    return cache.get(_owner_key(task_id))
+
+
+def run_generation(task_id: str, workload: str, user_id, session_id: str, budget: float, enqueued_at: float,
+                   generate, cache_bypass: bool = False) -> dict:
+    """Body of a generation task: ``generate(deadline)`` returns ``(body, status_code)``.
+
+    The deadline is what was left of the request budget when it was queued, minus the
+    time spent waiting in the queue. The session lock is taken here rather than around
+    the enqueue, so generations of one session are serialized on the workers.
+    """
+    waited = max(0.0, time.time() - enqueued_at)
+    metrics.observe(f"generation.queue_wait.{workload}", waited)
+    deadline = Deadline(max(0.0, budget - waited))
+    started = time.monotonic()
+    if deadline.expired:
+        metrics.incr(f"generation.expired_in_queue.{workload}")
+        body, status_code = {"error": "The request ran out of time while queued"}, status.HTTP_504_GATEWAY_TIMEOUT
+    else:
+        try:
+            with request_coordinator.session_lock(user_id, session_id, deadline), use_bypass(cache_bypass):
+                body, status_code = generate(deadline)
+        except SessionBusy:
+            body, status_code = {"error": "Another request for this session is still running"}, status.HTTP_409_CONFLICT
+    metrics.observe(f"generation.run.{workload}", time.monotonic() - started)
+    metrics.incr(f"generation.completed.{workload}")
+    result = {"status": status_code, "body": body}
+    publish_result(user_id, task_id, workload, result)
+    return result
+
+
+def publish_result(user_id, task_id: str, workload: str, result: dict):
+    """Push a finished generation to the user's open websockets; polling still works without it."""
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    try:
+        async_to_sync(layer.group_send)(user_group(user_id), {
+            "type": "generation.result",
+            "task_id": task_id,
+            "workload": workload,
+            "status": result["status"],
+            "body": result["body"],
+        })
+    except Exception as e:
+        logger.warning("Could not push result of task %s: %s", task_id, e)
+        metrics.incr("generation.push_errors")
+
+
+def queue_depths() -> dict:
+    """Messages waiting in each generation queue, also recorded as gauges."""
+    from GenAIwithDjangoRestApi.celery import app
+
+    depths = {}
+    try:
+        with app.connection_for_read() as connection:
+            channel = connection.default_channel
+            for workload, queue in config.GENERATION_QUEUES.items():
+                try:
+                    _, depth, _ = channel.queue_declare(queue=queue, passive=True)
+                except Exception:
+                    # Not declared yet: nothing has been queued or consumed there.
+                    depth = 0
+                    channel = connection.channel()
+                depths[queue] = depth
+                metrics.set_gauge(f"generation.queue_depth.{workload}", depth)
+    except Exception as e:
+        logger.warning("Could not read generation queue depths: %s", e)
+        metrics.incr("generation.queue_depth_errors")
+    return depths
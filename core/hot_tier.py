@@ -0,0 +1,192 @@
+import json
+import logging
+
+from django_redis import get_redis_connection
+
+from .config import memory_config
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# KEYS: messages list, meta hash, version. ARGV: ttl, max messages, message JSON...
+# Only extends sessions that are already cached; a partially cached session is
+# worse than a miss because readers would trust its message_count. The version is
+# bumped either way, so a populate racing with this append is dropped.
+APPEND_SCRIPT = """
+local ttl = tonumber(ARGV[1])
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ttl)
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return 0
+end
+local max_messages = tonumber(ARGV[2])
+for i = 3, #ARGV do
+    redis.call('RPUSH', KEYS[1], ARGV[i])
+end
+redis.call('LTRIM', KEYS[1], -max_messages, -1)
+redis.call('HINCRBY', KEYS[2], 'message_count', #ARGV - 2)
+redis.call('EXPIRE', KEYS[1], ttl)
+redis.call('EXPIRE', KEYS[2], ttl)
+return 1
+"""
+
+# KEYS: messages list, meta hash, version. ARGV: version read before loading from
+# Mongo, ttl, number of meta fields, meta field/value pairs..., message JSON...
+# Replaces the cached copy only if nothing changed the session since that read;
+# otherwise the loaded snapshot may be missing a write and is not cached.
+PUT_SCRIPT = """
+local current = redis.call('GET', KEYS[3]) or '0'
+if current ~= ARGV[1] then
+    return 0
+end
+local ttl = tonumber(ARGV[2])
+local meta_end = 3 + 2 * tonumber(ARGV[3])
+redis.call('DEL', KEYS[1], KEYS[2])
+for i = 4, meta_end, 2 do
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[2], ttl)
+if #ARGV > meta_end then
+    for i = meta_end + 1, #ARGV do
+        redis.call('RPUSH', KEYS[1], ARGV[i])
+    end
+    redis.call('EXPIRE', KEYS[1], ttl)
+end
+return 1
+"""
+
+
+class RedisHotTier:
+    """Shared cache of the newest messages per session in the django_redis cache.
+
+    Mongo stays the durable store. Reads are cache-aside, ``append`` writes through to
+    sessions that are already cached, and ``invalidate`` drops a session on clear.
+    Every write bumps a per-session version; a reader takes ``version`` before loading
+    from Mongo and ``put`` only caches its snapshot if the version is unchanged.
+    Every Redis failure is logged and treated as a miss so Mongo keeps serving.
+    """
+
+    def __init__(self, max_messages: int, ttl: int, alias: str = "default"):
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.alias = alias
+        self._append_script = None
+        self._put_script = None
+
+    @property
+    def _client(self):
+        return get_redis_connection(self.alias)
+
+    def _keys(self, name: str, session_id: str, user_id: str):
+        base = f"conversation:{name}:{user_id}:{session_id}"
+        return f"{base}:messages", f"{base}:meta", f"{base}:version"
+
+    def get(self, name: str, session_id: str, user_id: str):
+        """Return ``(fields, messages, message_count)`` or ``None`` on a miss."""
+        messages_key, meta_key, _ = self._keys(name, session_id, user_id)
+        try:
+            pipe = self._client.pipeline()
+            pipe.hgetall(meta_key)
+            pipe.lrange(messages_key, 0, -1)
+            meta, raw_messages = pipe.execute()
+        except Exception as e:
+            logger.warning("Hot tier read failed for session %s: %s", session_id, e)
+            metrics.incr("hot_tier.errors")
+            return None
+        if not meta:
+            return None
+        meta = {key.decode(): value.decode() for key, value in meta.items()}
+        message_count = int(meta.pop("message_count", 0))
+        fields = {key: json.loads(value) for key, value in meta.items()}
+        messages = [json.loads(message) for message in raw_messages]
+        return fields, messages, message_count
+
+    def version(self, name: str, session_id: str, user_id: str):
+        """The session's write version, to pass to ``put``; ``None`` if Redis is unavailable."""
+        try:
+            raw = self._client.get(self._keys(name, session_id, user_id)[2])
+        except Exception as e:
+            logger.warning("Hot tier version read failed for session %s: %s", session_id, e)
+            metrics.incr("hot_tier.errors")
+            return None
+        return raw.decode() if raw is not None else "0"
+
+    def put(self, name: str, session_id: str, user_id: str, fields: dict, messages: list, message_count: int,
+            version: str):
+        """Cache a snapshot loaded from Mongo, unless the session was written since ``version`` was read."""
+        if version is None:
+            return
+        meta = {key: json.dumps(value, default=str) for key, value in fields.items()}
+        meta["message_count"] = message_count
+        tail = messages[-self.max_messages:]
+        try:
+            if self._put_script is None:
+                self._put_script = self._client.register_script(PUT_SCRIPT)
+            stored = self._put_script(
+                keys=list(self._keys(name, session_id, user_id)),
+                args=[
+                    version, self.ttl, len(meta),
+                    *[item for pair in meta.items() for item in pair],
+                    *[json.dumps(message) for message in tail],
+                ],
+            )
+            if not stored:
+                metrics.incr("hot_tier.stale_populates")
+        except Exception as e:
+            logger.warning("Hot tier populate failed for session %s: %s", session_id, e)
+            metrics.incr("hot_tier.errors")
+
+    def append(self, name: str, session_id: str, user_id: str, messages: list):
+        try:
+            if self._append_script is None:
+                self._append_script = self._client.register_script(APPEND_SCRIPT)
+            self._append_script(
+                keys=list(self._keys(name, session_id, user_id)),
+                args=[self.ttl, self.max_messages, *[json.dumps(message) for message in messages]],
+            )
+        except Exception as e:
+            # A stale cached copy is worse than none, so drop it.
+            logger.warning("Hot tier write-through failed for session %s: %s", session_id, e)
+            metrics.incr("hot_tier.errors")
+            self.invalidate(name, session_id, user_id)
+
+    def set_fields(self, name: str, session_id: str, user_id: str, fields: dict):
+        _, meta_key, version_key = self._keys(name, session_id, user_id)
+        try:
+            client = self._client
+            pipe = client.pipeline()
+            pipe.incr(version_key)
+            pipe.expire(version_key, self.ttl)
+            pipe.execute()
+            if client.exists(meta_key):
+                client.hset(meta_key, mapping={key: json.dumps(value, default=str) for key, value in fields.items()})
+        except Exception as e:
+            logger.warning("Hot tier field update failed for session %s: %s", session_id, e)
+            metrics.incr("hot_tier.errors")
+            self.invalidate(name, session_id, user_id)
+
+    def invalidate(self, name: str, session_id: str, user_id: str):
+        messages_key, meta_key, version_key = self._keys(name, session_id, user_id)
+        try:
+            # Bumped rather than deleted, so a populate that read the old version is dropped.
+            pipe = self._client.pipeline()
+            pipe.delete(messages_key, meta_key)
+            pipe.incr(version_key)
+            pipe.expire(version_key, self.ttl)
+            pipe.execute()
+        except Exception as e:
+            logger.error("Hot tier invalidation failed for session %s: %s", session_id, e)
+            metrics.incr("hot_tier.errors")
+
+
+_hot_tier = None
+
+
+def get_hot_tier():
+    global _hot_tier
+    if _hot_tier is None and memory_config.HOT_TIER:
+        _hot_tier = RedisHotTier(
+            max_messages=memory_config.HOT_TIER_MESSAGES,
+            ttl=memory_config.HOT_TIER_TTL,
+        )
+    return _hot_tier
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import logging
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+from django_redis import get_redis_connection
+from rest_framework import status
+from rest_framework.response import Response
+
+from .config import config
+from .deadline import Deadline
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Results of keyless sends only need to outlive the followers polling for them.
+COALESCE_TTL = 60
+
+# KEYS: lock. ARGV: token. Only the holder may release, a lock that expired and
+# was taken by another request is left alone.
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class IdempotencyConflict(Exception):
+    """The idempotency key was already used for a different request body."""
+
+
+class SessionBusy(Exception):
+    """The session stayed locked by another generation for the whole request budget."""
+
+
+class RequestCoordinator:
+    """Exactly-once generation per idempotency key and one generation per session.
+
+    The first request for a key becomes the leader: it marks the key pending, takes
+    the session lock, runs and stores its response. Requests arriving with the same
+    key while it runs follow it and return its response; retries after it finished
+    get the stored response replayed. Sends without a key are keyed by their body,
+    so identical sends are coalesced while in flight but not replayed afterwards:
+    their followers only take a response stored by the leader whose pending marker
+    they saw. Keys are scoped to the user, the endpoint and the session.
+    All state lives in Redis so this holds across workers. If Redis is unreachable
+    the request runs unguarded, as it did before.
+    """
+
+    def __init__(self, idempotency_ttl: int, lock_margin: float, poll_interval: float, alias: str = "default"):
+        self.idempotency_ttl = idempotency_ttl
+        self.lock_ttl_ms = int((config.REQUEST_BUDGET_MAX + lock_margin) * 1000)
+        self.poll_interval = poll_interval
+        self.alias = alias
+        self._release_script = None
+
+    @property
+    def _client(self):
+        return get_redis_connection(self.alias)
+
+    @staticmethod
+    def fingerprint(payload) -> str:
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def run(self, user_id, scope: str, session_id: str, key: str, payload, compute, deadline: Deadline,
+            lock_session: bool = True):
+        """Return ``(body, status_code, replayed)`` for the request, calling ``compute()`` at most once per key."""
+        fingerprint = self.fingerprint(payload)
+        explicit = bool(key)
+        base = f"idempotency:{user_id}:{scope}:{session_id}:{key if explicit else 'auto:' + fingerprint}"
+        result_key, pending_key = base, f"{base}:pending"
+        leader = uuid.uuid4().hex
+        try:
+            while True:
+                if explicit:
+                    stored = self._stored(result_key, fingerprint)
+                    if stored is not None:
+                        metrics.incr("idempotency.replays")
+                        return stored["body"], stored["status"], True
+                if self._client.set(pending_key, f"{fingerprint}:{leader}", nx=True, px=self.lock_ttl_ms):
+                    break
+                pending = self._client.get(pending_key)
+                if pending is None:
+                    # The leader finished between our two calls; start over.
+                    continue
+                pending_fingerprint, _, pending_leader = pending.decode().rpartition(":")
+                if explicit and pending_fingerprint != fingerprint:
+                    raise IdempotencyConflict(key)
+                metrics.incr("idempotency.coalesced")
+                # Any stored response is a valid replay for an explicit key; a keyless
+                # follower must not pick up one left behind by an earlier, finished send.
+                stored = self._follow(result_key, pending_key, fingerprint, None if explicit else pending_leader, deadline)
+                if stored is not None:
+                    return stored["body"], stored["status"], True
+                # The leader gave up without a response; take over.
+        except (IdempotencyConflict, SessionBusy):
+            raise
+        except Exception as e:
+            logger.warning("Idempotency check failed for %s, running unguarded: %s", scope, e)
+            metrics.incr("idempotency.errors")
+            return (*compute(), False)
+
+        try:
+            with self.session_lock(user_id, session_id, deadline) if lock_session else nullcontext():
+                body, status_code = compute()
+            if status_code < 500:
+                self._store(result_key, fingerprint, leader, body, status_code,
+                            self.idempotency_ttl if explicit else COALESCE_TTL)
+            return body, status_code, False
+        finally:
+            self._discard(pending_key)
+
+    @contextmanager
+    def session_lock(self, user_id, session_id: str, deadline: Deadline):
+        """Hold the cross-worker lock of one session, waiting at most until ``deadline``."""
+        lock_key = f"session_lock:{user_id}:{session_id}"
+        token = uuid.uuid4().hex
+        started = time.monotonic()
+        try:
+            while not self._client.set(lock_key, token, nx=True, px=self.lock_ttl_ms):
+                if deadline.expired:
+                    metrics.incr("session_lock.timeouts")
+                    raise SessionBusy(session_id)
+                time.sleep(min(self.poll_interval, deadline.remaining()))
+        except SessionBusy:
+            raise
+        except Exception as e:
+            logger.warning("Session lock unavailable for %s, running unlocked: %s", session_id, e)
+            metrics.incr("session_lock.errors")
+            yield
+            return
+        waited = time.monotonic() - started
+        metrics.observe("session_lock.wait", waited)
+        if waited >= self.poll_interval:
+            metrics.incr("session_lock.contended")
+        try:
+            yield
+        finally:
+            try:
+                if self._release_script is None:
+                    self._release_script = self._client.register_script(RELEASE_SCRIPT)
+                self._release_script(keys=[lock_key], args=[token])
+            except Exception as e:
+                # The lock expires on its own after lock_ttl_ms.
+                logger.error("Could not release session lock for %s: %s", session_id, e)
+                metrics.incr("session_lock.errors")
+
+    def _stored(self, result_key: str, fingerprint: str):
+        raw = self._client.get(result_key)
+        if raw is None:
+            return None
+        stored = json.loads(raw)
+        if stored["fingerprint"] != fingerprint:
+            raise IdempotencyConflict(result_key)
+        return stored
+
+    def _follow(self, result_key: str, pending_key: str, fingerprint: str, leader, deadline: Deadline):
+        """Poll for the leader's response; ``None`` once it stopped without storing one.
+
+        With ``leader`` set, only a response stored by that leader counts.
+        """
+        def current():
+            stored = self._stored(result_key, fingerprint)
+            if stored is not None and leader is not None and stored.get("leader") != leader:
+                return None
+            return stored
+
+        while True:
+            stored = current()
+            if stored is not None:
+                return stored
+            if not self._client.exists(pending_key):
+                # Stored just before the marker was removed, so look once more.
+                return current()
+            if deadline.expired:
+                metrics.incr("idempotency.follow_timeouts")
+                raise SessionBusy(pending_key)
+            time.sleep(min(self.poll_interval, deadline.remaining()))
+
+    def _store(self, result_key: str, fingerprint: str, leader: str, body, status_code: int, ttl: int):
+        payload = json.dumps(
+            {"fingerprint": fingerprint, "leader": leader, "status": status_code, "body": body}, default=str
+        )
+        try:
+            self._client.set(result_key, payload, ex=ttl)
+        except Exception as e:
+            logger.warning("Could not store idempotent response %s: %s", result_key, e)
+            metrics.incr("idempotency.errors")
+
+    def _discard(self, pending_key: str):
+        try:
+            self._client.delete(pending_key)
+        except Exception as e:
+            # Followers stop waiting once the marker expires.
+            logger.warning("Could not clear pending marker %s: %s", pending_key, e)
+            metrics.incr("idempotency.errors")
+
+
+request_coordinator = RequestCoordinator(
+    idempotency_ttl=config.IDEMPOTENCY_TTL,
+    lock_margin=config.SESSION_LOCK_MARGIN,
+    poll_interval=config.SESSION_LOCK_POLL,
+)
+
+
+def idempotent_response(request, scope: str, session_id: str, payload, compute, deadline: Deadline,
+                        lock_session: bool = True) -> Response:
+    """Serve ``compute()`` (a ``Response``) once per Idempotency-Key, serialized per session.
+
+    Pass ``lock_session=False`` when ``compute`` only enqueues the work and the worker
+    takes the session lock itself.
+    """
+    if not config.IDEMPOTENCY:
+        return compute()
+
+    def run():
+        response = compute()
+        return response.data, response.status_code
+
+    key = request.headers.get("Idempotency-Key")
+    try:
+        body, status_code, replayed = request_coordinator.run(
+            request.user.id, scope, session_id, key, payload, run, deadline, lock_session
+        )
+    except IdempotencyConflict:
+        return Response(
+            {"error": "Idempotency-Key was already used with a different request"},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    except SessionBusy:
+        return Response(
+            {"error": "Another request for this session is still running, retry with the same Idempotency-Key"},
+            status=status.HTTP_409_CONFLICT,
+            headers={"Retry-After": str(max(1, int(config.SESSION_LOCK_MARGIN)))},
+        )
+    headers = {"Idempotent-Replayed": "true"} if replayed else {}
+    return Response(body, status=status_code, headers=headers)
@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from threading import Lock, Thread
+
+from django_redis import get_redis_connection
+
+from .config import memory_config
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidationBus:
+    """Redis pub/sub channel announcing which sessions another process has mutated.
+
+    Publishing is fire-and-forget: a lost message only means a worker serves its cached
+    copy until the registry's idle TTL evicts it, the same as before the bus existed.
+    Each process ignores its own messages because its cached memory is already current.
+    """
+
+    def __init__(self, channel: str, alias: str = "default"):
+        self.channel = channel
+        self.alias = alias
+        self.origin = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._handlers = []
+        self._listener = None
+        self._lock = Lock()
+
+    def publish(self, user_id: str, session_id: str, kind: str):
+        payload = json.dumps({"origin": self.origin, "user_id": str(user_id), "session_id": session_id, "kind": kind})
+        try:
+            get_redis_connection(self.alias).publish(self.channel, payload)
+            metrics.incr("invalidation_bus.published")
+        except Exception as e:
+            logger.warning("Could not publish invalidation for session %s: %s", session_id, e)
+            metrics.incr("invalidation_bus.errors")
+
+    def subscribe(self, handler):
+        """Register ``handler(user_id, session_id, kind)`` and start the listener thread once."""
+        with self._lock:
+            self._handlers.append(handler)
+            if self._listener is None:
+                self._listener = Thread(target=self._listen, name="conversation-invalidation", daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        backoff = 1
+        while True:
+            try:
+                pubsub = get_redis_connection(self.alias).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                backoff = 1
+                for message in pubsub.listen():
+                    self._dispatch(message)
+            except Exception as e:
+                logger.warning("Invalidation listener lost its Redis connection: %s", e)
+                metrics.incr("invalidation_bus.errors")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _dispatch(self, message):
+        try:
+            payload = json.loads(message["data"])
+        except (TypeError, ValueError):
+            return
+        if payload.get("origin") == self.origin:
+            return
+        metrics.incr("invalidation_bus.received")
+        for handler in list(self._handlers):
+            try:
+                handler(payload["user_id"], payload["session_id"], payload.get("kind"))
+            except Exception as e:
+                logger.error("Invalidation handler failed for session %s: %s", payload.get("session_id"), e)
+
+
+_bus = None
+
+
+def get_invalidation_bus():
+    global _bus
+    if _bus is None and memory_config.INVALIDATION_BUS:
+        _bus = InvalidationBus(channel=memory_config.INVALIDATION_CHANNEL)
+    return _bus
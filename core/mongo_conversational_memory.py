@@ -1,21 +1,95 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 from django.utils import timezone
 from langchain_core.memory import BaseMemory
+from langchain_core.messages import get_buffer_string
 from langchain.memory import ConversationBufferMemory
+from langchain_community.embeddings import OllamaEmbeddings
 from mongoengine import get_db
+from pymongo.errors import BulkWriteError
 import logging
+from typing import Any
+import numpy as np
+import sys
+
+from .config import config, memory_config
+from .conversation_store import DUPLICATE_KEY, MongoConversationStore, session_expiry
+from .deadline import detached_context
+from .metrics import metrics
+from .usage import MeteredOllama
 
 logger = logging.getLogger('__name__')
+
+SUMMARY_PROMPT = """Progressively summarize the lines of conversation provided, adding onto the previous summary and returning a new summary.
+Keep names, numbers, decisions and open questions. Return only the new summary.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{new_lines}
+
+New summary:"""
+
+_background_executor = ThreadPoolExecutor(max_workers=memory_config.SUMMARY_WORKERS, thread_name_prefix="memory-background")
+_summary_llm = None
+_embeddings = None
+
+
+def _get_summary_llm():
+    global _summary_llm
+    if _summary_llm is None:
+        _summary_llm = MeteredOllama(model=config.LLM_MODEL, temperature=0)
+    return _summary_llm
+
+
+def _get_embeddings():
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = OllamaEmbeddings(model=memory_config.EMBEDDING_MODEL)
+    return _embeddings
+
+
+def _format_turn(user_content: str, ai_content: str) -> str:
+    return f"Human: {user_content}\nAI: {ai_content}"
+
+
 class MongoConversationMemory(BaseMemory):
-    def __init__(self, session_id: str, user_id: str, collection_name: str = "conversations"):
+    # Whatever the store returned for the most recent turn (ORM rows for chat transcripts).
+    # A declared field, since BaseMemory is a pydantic model that rejects unknown attributes.
+    last_turn: Any = None
+
+    def __init__(self, session_id: str, user_id: str, collection_name: str = "conversations",
+                 mode: str = None, window_turns: int = None, store=None):
         logger.info(f"Initializing MongoConversationMemory with session_id: {session_id}, user_id: {user_id}")
         super().__init__()
         self._session_id = session_id
         self._user_id = user_id
+        self._mode = mode or memory_config.MEMORY_MODE
+        self._window_turns = window_turns or memory_config.WINDOW_TURNS
         self._buffer = ConversationBufferMemory()
+        self._summary = ""
+        # Number of persisted messages already folded into the summary.
+        self._summarized_count = 0
+        # Messages pushed out of the window that the background job has not summarized yet.
+        self._pending = []
+        self._summarizing = False
+        # Relevance mode: one embedded row per past turn, loaded from the vector collection.
+        self._turn_count = 0
+        self._turn_ids = []
+        self._turn_texts = []
+        self._turn_vectors = None
+        self._epoch = 0
+        self._state_lock = Lock()
+        # History is loaded on first use, so creating a memory never touches Mongo.
+        self._loaded = False
+        self._load_lock = Lock()
         self._db = get_db(alias='default')
-        self._collection = self._db[collection_name]
-        self.load_from_mongo()
-        logger.info(f"MongoConversationMemory initialized. Current memory: {self._buffer.chat_memory.messages}")
+        self._store = store or MongoConversationStore(collection_name)
+        self._vector_collection = self._db[memory_config.VECTOR_COLLECTION]
+        # Called after the in-process state grew, so a registry can re-measure it.
+        self._size_listener = None
+        logger.info(f"MongoConversationMemory initialized for session_id: {session_id}")
 
     @property
     def memory_variables(self):
@@ -27,38 +101,240 @@ class MongoConversationMemory(BaseMemory):
         output_content = outputs.get('output',None)
         if not output_content:
             output_content = outputs.get('response')
+        self._ensure_loaded()
         self._buffer.save_context(inputs, outputs)
-        self._collection.update_one(
-            {"session_id": self._session_id, "user_id": self._user_id},
-            {
-                "$push": {"messages": {"role": "user", "content": inputs["input"]}},
-                "$set": {"updated_at": timezone.now()},
-                "$setOnInsert": {"created_at": timezone.now()}
-            },
-            upsert=True
-        )
-        self._collection.update_one(
-            {"session_id": self._session_id, "user_id": self._user_id},
-            {"$push": {"messages": {"role": "ai", "content": output_content}}},
-            upsert=True
-        )
+        self.last_turn = self._store.append_turn(self._session_id, self._user_id, inputs["input"], output_content)
+        if self._mode == "relevance":
+            turn = self._turn_count
+            self._turn_count += 1
+            _background_executor.submit(detached_context().run, self._index_turns, [(turn, _format_turn(inputs["input"], output_content))], self._epoch)
+        self._trim_window()
+        self._size_changed()
         logger.info(f"Context saved. Current memory: {self._buffer.chat_memory.messages}")
 
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    def watch_size(self, listener):
+        """Call ``listener()`` whenever ``approx_size`` may have changed (history loaded, turn saved)."""
+        self._size_listener = listener
+
+    def _size_changed(self):
+        if self._size_listener is not None:
+            self._size_listener()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            self.load_from_mongo()
+            self._loaded = True
+        self._size_changed()
+
     def load_from_mongo(self):
         logger.info(f"Loading memory from MongoDB for session_id: {self._session_id}, user_id: {self._user_id}")
-        doc = self._collection.find_one({"session_id": self._session_id, "user_id": self._user_id})
-        if doc and "messages" in doc:
-            for msg in doc["messages"]:
-                if msg["role"] == "user":
-                    self._buffer.chat_memory.add_user_message(msg["content"])
-                else:
-                    self._buffer.chat_memory.add_ai_message(msg["content"])
+        if self._mode == "summary":
+            doc = self._store.load(
+                self._session_id, self._user_id,
+                limit=self._window_turns * 2 * memory_config.SUMMARY_LOAD_WINDOWS, since_field="summarized_count"
+            )
+            self._summary = doc.get("summary", "")
+            self._summarized_count = doc.get("summarized_count", 0)
+            skipped = doc["message_count"] - self._summarized_count - len(doc["messages"])
+            if skipped > 0:
+                # A long backlog (summary mode just enabled, or the summary expired) is not
+                # worth one huge summary prompt; start folding from the loaded messages.
+                logger.warning(f"Skipping {skipped} unsummarized messages of session_id: {self._session_id}")
+                metrics.incr("memory.summary_skipped_messages", skipped)
+                self._summarized_count += skipped
+        elif self._mode == "relevance":
+            doc = self._store.load(self._session_id, self._user_id, limit=self._window_turns * 2)
+            self._load_turn_index(doc["message_count"])
+        else:
+            doc = self._store.load(self._session_id, self._user_id, limit=memory_config.LOAD_LIMIT)
+        for msg in doc["messages"]:
+            if msg["role"] == "user":
+                self._buffer.chat_memory.add_user_message(msg["content"])
+            else:
+                self._buffer.chat_memory.add_ai_message(msg["content"])
+        self._trim_window()
+
+    def history_pages(self):
+        """Page through the full persisted history, newest bucket first, without loading it into memory."""
+        return self._store.iter_history(self._session_id, self._user_id)
+
+    def _load_turn_index(self, message_count: int):
+        self._turn_count = message_count // 2
+        rows = self._vector_collection.find(
+            {"session_id": self._session_id, "user_id": self._user_id},
+            {"turn": 1, "text": 1, "embedding": 1}
+        ).sort("turn", 1)
+        for row in rows:
+            self._turn_ids.append(row["turn"])
+            self._turn_texts.append(row["text"])
+            self._append_vector(row["embedding"])
+        # Only turns saved before relevance mode was enabled need embedding now.
+        if len(self._turn_ids) < self._turn_count:
+            _background_executor.submit(detached_context().run, self._backfill_turn_index, set(self._turn_ids), self._epoch)
+
+    def _backfill_turn_index(self, indexed: set, epoch: int):
+        pages = list(self.history_pages())
+        messages = [msg for page in reversed(pages) for msg in page]
+        missing = [
+            (turn, _format_turn(messages[2 * turn]["content"], messages[2 * turn + 1]["content"]))
+            for turn in range(len(messages) // 2) if turn not in indexed
+        ]
+        if missing:
+            self._index_turns(missing, epoch)
+
+    def _append_vector(self, embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector /= (np.linalg.norm(vector) or 1.0)
+        if self._turn_vectors is None:
+            self._turn_vectors = vector[np.newaxis, :]
+        else:
+            self._turn_vectors = np.vstack([self._turn_vectors, vector])
+
+    def _index_turns(self, turns: list, epoch: int):
+        try:
+            embeddings = _get_embeddings().embed_documents([text for _, text in turns])
+        except Exception as e:
+            logger.error(f"Failed to embed turns for session_id: {self._session_id}: {e}")
+            return
+        with self._state_lock:
+            if epoch != self._epoch:
+                return
+            for (turn, text), embedding in zip(turns, embeddings):
+                self._turn_ids.append(turn)
+                self._turn_texts.append(text)
+                self._append_vector(embedding)
+        self._size_changed()
+        expires_at = session_expiry(timezone.now())
+        try:
+            # Unordered, so one turn another worker already indexed does not stop the rest.
+            self._vector_collection.insert_many([
+                {"session_id": self._session_id, "user_id": self._user_id, "turn": turn, "text": text,
+                 "embedding": embedding, **({"expires_at": expires_at} if expires_at else {})}
+                for (turn, text), embedding in zip(turns, embeddings)
+            ], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            duplicates = [turns[error["index"]][0] for error in errors if error.get("code") == DUPLICATE_KEY]
+            if duplicates:
+                logger.info(f"Turns {duplicates} of session_id: {self._session_id} were already indexed")
+            if len(duplicates) < len(errors):
+                logger.error(f"Failed to store turn vectors for session_id: {self._session_id}: {e}")
+
+    def _relevant_turns(self, query: str) -> list:
+        with self._state_lock:
+            vectors = self._turn_vectors
+            turn_ids = list(self._turn_ids)
+            texts = list(self._turn_texts)
+        if vectors is None or not query:
+            return []
+        # Recent turns are already in the prompt verbatim.
+        recent_start = self._turn_count - self._window_turns
+        candidates = [i for i, turn in enumerate(turn_ids) if turn < recent_start]
+        if not candidates:
+            return []
+        query_vector = np.asarray(_get_embeddings().embed_query(query), dtype=np.float32)
+        query_vector /= (np.linalg.norm(query_vector) or 1.0)
+        scores = vectors[candidates] @ query_vector
+        top = np.argsort(scores)[::-1][:memory_config.RELEVANT_TURNS]
+        # Keep the selected exchanges in chronological order.
+        selected = sorted(candidates[i] for i in top)
+        return [texts[i] for i in selected]
+
+    def approx_size(self) -> int:
+        messages = self._buffer.chat_memory.messages + self._pending
+        size = sys.getsizeof(self._summary) + sum(sys.getsizeof(msg.content) for msg in messages)
+        if self._turn_vectors is not None:
+            size += self._turn_vectors.nbytes + sum(sys.getsizeof(text) for text in self._turn_texts)
+        return size
 
     def load_memory_variables(self, inputs):
+        self._ensure_loaded()
         logger.info(f"Loading memory variables. Current memory: {self._buffer.chat_memory.messages}")
-        return self._buffer.load_memory_variables(inputs)
+        variables = self._buffer.load_memory_variables(inputs)
+        if self._mode == "summary" and self._summary:
+            key = self._buffer.memory_key
+            variables[key] = f"Summary of earlier conversation: {self._summary}\n{variables[key]}"
+        elif self._mode == "relevance":
+            relevant = self._relevant_turns((inputs or {}).get("input", ""))
+            if relevant:
+                key = self._buffer.memory_key
+                earlier = "\n".join(relevant)
+                variables[key] = f"Relevant earlier exchanges:\n{earlier}\n\nRecent conversation:\n{variables[key]}"
+        return variables
 
     def clear(self):
         logger.info(f"Clearing memory for session_id: {self._session_id}, user_id: {self._user_id}")
-        self._collection.delete_one({"_session_id": self._session_id, "_user_id": self._user_id})
+        deleted = self._store.delete(self._session_id, self._user_id)
+        self._vector_collection.delete_many({"session_id": self._session_id, "user_id": self._user_id})
         self._buffer.clear()
+        with self._state_lock:
+            self._epoch += 1
+            self._summary = ""
+            self._summarized_count = 0
+            self._pending = []
+            self._turn_count = 0
+            self._turn_ids = []
+            self._turn_texts = []
+            self._turn_vectors = None
+        # Nothing left to load: the session is empty until the next save_context.
+        self._loaded = True
+        return deleted
+
+    def _trim_window(self):
+        if self._mode not in ("summary", "relevance"):
+            return
+        messages = self._buffer.chat_memory.messages
+        keep = self._window_turns * 2
+        if len(messages) <= keep:
+            return
+        overflow = messages[:-keep]
+        self._buffer.chat_memory.messages = messages[-keep:]
+        if self._mode == "relevance":
+            # Older turns stay reachable through the vector index.
+            return
+        with self._state_lock:
+            self._pending.extend(overflow)
+            if self._summarizing:
+                return
+            self._summarizing = True
+        # Summary calls are billed to the user whose turn pushed messages out of the window.
+        _background_executor.submit(detached_context().run, self._fold_pending)
+
+    def _fold_pending(self):
+        """Fold messages that left the window into the rolling summary, off the request path."""
+        while True:
+            with self._state_lock:
+                batch = self._pending[:memory_config.SUMMARY_BATCH_MESSAGES]
+                summary = self._summary
+                epoch = self._epoch
+                if not batch:
+                    self._summarizing = False
+                    return
+            try:
+                new_summary = _get_summary_llm().invoke(
+                    SUMMARY_PROMPT.format(summary=summary or "(none)", new_lines=get_buffer_string(batch))
+                ).strip()
+            except Exception as e:
+                logger.error(f"Failed to update summary for session_id: {self._session_id}: {e}")
+                with self._state_lock:
+                    self._summarizing = False
+                return
+            with self._state_lock:
+                if epoch != self._epoch:
+                    continue
+                self._summary = new_summary
+                self._summarized_count += len(batch)
+                del self._pending[:len(batch)]
+                summarized_count = self._summarized_count
+            self._store.set_fields(
+                self._session_id, self._user_id,
+                {"summary": new_summary, "summarized_count": summarized_count}
+            )
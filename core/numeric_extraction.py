@@ -0,0 +1,115 @@
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+from .metrics import metrics
+from .structured_output import SeriesLabels, generate_structured
+
+logger = logging.getLogger(__name__)
+
+_NUMBER = r"[-+]?\$?\d[\d,]*(?:\.\d+)?%?"
+# "Revenue: 1,200", "2019 - 45%", "Cost = $3.5"
+KEY_VALUE = re.compile(rf"(?P<label>[A-Za-z0-9][\w ()/&.'-]{{0,60}}?)\s*[:=–-]\s*(?P<value>{_NUMBER})(?![\w.])")
+# Table rows: "North America   1,200   1,350" -> label plus its first number column.
+TABLE_ROW = re.compile(rf"^(?P<label>[A-Za-z][\w ()/&.'-]{{0,60}}?)\s{{2,}}(?P<value>{_NUMBER})(?:\s+{_NUMBER})*\s*$")
+YEAR = re.compile(r"^(1[89]|20)\d{2}$")
+MONTHS = {"jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"}
+
+LABEL_PROMPT = """The following values were extracted from the text below, but their labels are unclear.
+Return ONLY a JSON object {{"labels": [...]}} with {count} short labels (strings), one per value, in the same order.
+
+Values: {values}
+
+Text:
+{text}"""
+
+
+def to_number(values: pd.Series) -> pd.Series:
+    return pd.to_numeric(values.str.replace(r"[,$%+]", "", regex=True), errors="coerce")
+
+
+def extract_series(text: str) -> pd.DataFrame:
+    """Extract a ``Label``/``Value`` frame from ``key: value`` pairs and table rows."""
+    if not text:
+        return pd.DataFrame(columns=["Label", "Value"])
+    lines = pd.Series(text.splitlines()).str.strip()
+    lines = lines[lines != ""]
+
+    pairs = lines.str.extractall(KEY_VALUE)
+    # Lines with key/value pairs are not also read as table rows.
+    rest = lines.drop(pairs.index.get_level_values(0).unique())
+    rows = rest.str.extract(TABLE_ROW).dropna()
+
+    df = pd.concat([pairs.reset_index(drop=True), rows], ignore_index=True)
+    if df.empty:
+        return pd.DataFrame(columns=["Label", "Value"])
+    df = pd.DataFrame({"Label": df["label"].str.strip(), "Value": to_number(df["value"])}).dropna()
+    return df.drop_duplicates(subset="Label", keep="first").reset_index(drop=True)
+
+
+def describe(values) -> dict:
+    array = np.asarray(values, dtype=float)
+    if array.size == 0:
+        return {}
+    return {
+        "mean": round(float(array.mean()), 4),
+        "sum": round(float(array.sum()), 4),
+        "min": float(array.min()),
+        "max": float(array.max()),
+        "median": round(float(np.median(array)), 4),
+        "std": round(float(array.std()), 4),
+        "count": int(array.size),
+    }
+
+
+def suggest_graph(df: pd.DataFrame) -> str:
+    labels = df["Label"].astype(str).str.lower()
+    if labels.str.match(YEAR.pattern).all() or labels.str[:3].isin(MONTHS).all():
+        return "line"
+    values = df["Value"].to_numpy(dtype=float)
+    if len(values) <= 6 and (values > 0).all() and abs(values.sum() - 100) <= 1:
+        return "pie"
+    return "bar"
+
+
+def is_ambiguous(df: pd.DataFrame) -> bool:
+    """Labels that are bare numbers (other than years) or single characters say nothing."""
+    labels = df["Label"].astype(str)
+    numeric = labels.str.fullmatch(r"[\d.,\s]+") & ~labels.str.match(YEAR.pattern)
+    return bool((numeric | (labels.str.len() < 2)).any())
+
+
+def extract_numeric_data(text: str, llm=None) -> dict:
+    """Deterministic replacement for the LLM extraction prompts of the analysis tools.
+
+    Returns the same ``labels``/``values``/``analysis``/``suggested_graph`` shape, or ``{}``
+    when the text holds no numbers. ``llm`` is only called to relabel ambiguous series.
+    """
+    df = extract_series(text)
+    if df.empty:
+        return {}
+    labels = df["Label"].tolist()
+    if llm is not None and is_ambiguous(df):
+        labels = _label_with_llm(llm, text, df) or labels
+    return {
+        "labels": labels,
+        "values": df["Value"].tolist(),
+        "analysis": describe(df["Value"]),
+        "suggested_graph": suggest_graph(df),
+    }
+
+
+def _label_with_llm(llm, text: str, df: pd.DataFrame):
+    metrics.incr("numeric_extraction.llm_labels")
+    try:
+        parsed = generate_structured(
+            llm, LABEL_PROMPT.format(count=len(df), values=df["Value"].tolist(), text=text[:3000]), SeriesLabels
+        )
+    except Exception as e:
+        logger.warning("LLM labelling failed, keeping extracted labels: %s", e)
+        return None
+    if parsed is None or len(parsed.labels) != len(df):
+        return None
+    return parsed.labels
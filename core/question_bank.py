@@ -0,0 +1,235 @@
+import logging
+import math
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from threading import Lock
+from typing import List, Optional, Set, Tuple
+
+from mongoengine import get_db
+from pymongo import ASCENDING, UpdateOne
+
+from .answer_cache import normalize_question
+from .config import document_config
+from .deadline import detached_context
+from .metrics import metrics
+from .structured_output import QuestionSet, generate_structured
+
+logger = logging.getLogger(__name__)
+
+QUESTION_TYPES = {"mcq": "MCQ", "multiple choice": "MCQ", "short answer": "Short Answer", "open ended": "Open Ended"}
+COUNT = re.compile(r"\b(\d+)\s+(?:[a-z-]+\s+){0,2}questions?\b")
+FILLER_WORDS = {"question", "questions", "about", "on", "the", "a", "an", "of", "from", "for", "document",
+                "generate", "give", "me", "create", "make", "some", "and", "or", "with", "type", "types",
+                "main", "key", "concepts", "what", "which", "how", "why", "this", "that", "are", "is"}
+
+BATCH_PROMPT = """Using ONLY the text below, write {count} new questions a reader could answer from it.
+{focus}
+TEXT:
+{text}
+
+Return ONLY a JSON object with a "questions" list; each item has "type" (MCQ, Short Answer or Open Ended),
+"question", and for MCQ "options" (4 strings) and "answer"."""
+
+# Shared by every bank in the process so background generation can't flood Ollama.
+_executor = ThreadPoolExecutor(
+    max_workers=max(1, document_config.QUESTION_BANK_WORKERS), thread_name_prefix="question-bank"
+)
+_inflight = {}
+_inflight_lock = Lock()
+_indexed = False
+
+
+def _forget(key, future):
+    with _inflight_lock:
+        if _inflight.get(key) is future:
+            del _inflight[key]
+
+
+def terms(text: str) -> Set[str]:
+    return {word for word in re.findall(r"[a-z]{3,}", text.lower()) if word not in FILLER_WORDS}
+
+
+def parse_request(query: str, default_count: int) -> Tuple[int, Set[str], Set[str]]:
+    """Split '5 MCQ questions about pricing' into (count, question types, topic terms).
+
+    Only a number right before "questions" (allowing two words between, as in
+    "5 multiple choice questions") is a count; it is capped at ``MAX_QUESTIONS``.
+    """
+    lowered = query.lower()
+    count_match = COUNT.search(lowered)
+    count = int(count_match.group(1)) if count_match else default_count
+    count = max(1, min(count, document_config.MAX_QUESTIONS))
+    types = {qtype for phrase, qtype in QUESTION_TYPES.items() if phrase in lowered}
+    for phrase in QUESTION_TYPES:
+        lowered = lowered.replace(phrase, " ")
+    return count, types, terms(lowered)
+
+
+class QuestionBank:
+    """Persistent, deduplicated questions for one indexed document, stored in Mongo.
+
+    Questions are unique per (doc_id, index_version, normalized text), so regenerated
+    duplicates are dropped on insert and a re-indexed document starts a fresh bank.
+    ``take`` serves the least-served matches first to rotate through the bank;
+    ``fill`` generates only the missing questions, in batches spread over the document.
+    """
+
+    def __init__(self, retriever, llm):
+        self.retriever = retriever
+        self.llm = llm
+        self.doc_id = str(retriever.doc_id)
+        self.version = retriever.index_version()
+        db = get_db(alias='default')
+        self.questions = db[document_config.QUESTION_BANK_COLLECTION]
+        self.state = db[f"{document_config.QUESTION_BANK_COLLECTION}_state"]
+        self._ensure_indexes()
+
+    def _ensure_indexes(self):
+        global _indexed
+        if _indexed:
+            return
+        self.questions.create_index(
+            [("doc_id", ASCENDING), ("index_version", ASCENDING), ("normalized", ASCENDING)],
+            unique=True, name="doc_version_question_unique"
+        )
+        self.questions.create_index(
+            [("doc_id", ASCENDING), ("index_version", ASCENDING), ("served", ASCENDING)], name="doc_version_served"
+        )
+        _indexed = True
+
+    def _filter(self, types: Set[str] = None, topic: Set[str] = None) -> dict:
+        query = {"doc_id": self.doc_id, "index_version": self.version}
+        if types:
+            query["type"] = {"$in": sorted(types)}
+        if topic:
+            query["$or"] = [{"terms": {"$in": sorted(topic)}}, {"topics": {"$in": sorted(topic)}}]
+        return query
+
+    def count(self, types: Set[str] = None, topic: Set[str] = None) -> int:
+        return self.questions.count_documents(self._filter(types, topic))
+
+    def take(self, count: int, types: Set[str] = None, topic: Set[str] = None) -> List[dict]:
+        documents = list(
+            self.questions.find(self._filter(types, topic), {"question": 1, "type": 1, "options": 1, "answer": 1})
+            .sort([("served", ASCENDING), ("_id", ASCENDING)])
+            .limit(count)
+        )
+        if documents:
+            self.questions.update_many({"_id": {"$in": [d["_id"] for d in documents]}}, {"$inc": {"served": 1}})
+        return [{k: v for k, v in d.items() if k != "_id" and v is not None} for d in documents]
+
+    def add(self, questions: List[dict], topic: Set[str] = None, pages: List[int] = None) -> int:
+        now = datetime.now(timezone.utc)
+        operations = []
+        for question in questions:
+            text = (question.get("question") or "").strip()
+            if not text:
+                continue
+            normalized = normalize_question(text)
+            document = {
+                "doc_id": self.doc_id,
+                "index_version": self.version,
+                "normalized": normalized,
+                "question": text,
+                "type": question.get("type"),
+                "options": question.get("options"),
+                "answer": question.get("answer"),
+                "terms": sorted(terms(text)),
+                "pages": pages,
+                "served": 0,
+                "created_at": now,
+            }
+            update = {"$setOnInsert": document}
+            if topic:
+                update["$addToSet"] = {"topics": {"$each": sorted(topic)}}
+            operations.append(UpdateOne(
+                {"doc_id": self.doc_id, "index_version": self.version, "normalized": normalized}, update, upsert=True
+            ))
+        if not operations:
+            return 0
+        result = self.questions.bulk_write(operations, ordered=False)
+        metrics.incr("question_bank.generated", result.upserted_count)
+        metrics.incr("question_bank.duplicates", len(operations) - result.upserted_count)
+        return result.upserted_count
+
+    def seed(self, questions: List[dict]) -> int:
+        """Import a question list (e.g. the enrichment artifacts) once per index version."""
+        marker = {"_id": f"{self.doc_id}:{self.version}"}
+        if not questions or self.state.find_one({**marker, "seeded": True}):
+            return 0
+        added = self.add(questions)
+        self.state.update_one(marker, {"$set": {"seeded": True}}, upsert=True)
+        return added
+
+    def fill(self, shortfall: int, types: Set[str] = None, topic: Set[str] = None):
+        """Generate at least ``shortfall`` new questions in the background; returns a future.
+
+        Concurrent requests for the same document and topic share one future.
+        """
+        key = (self.doc_id, self.version, tuple(sorted(topic or ())), tuple(sorted(types or ())))
+        with _inflight_lock:
+            future = _inflight.get(key)
+            if future is not None and not future.done():
+                metrics.incr("question_bank.coalesced")
+                return future
+            future = _executor.submit(detached_context().run, self._generate, shortfall, types, topic)
+            _inflight[key] = future
+        future.add_done_callback(lambda done: _forget(key, done))
+        return future
+
+    def _generate(self, shortfall: int, types: Set[str], topic: Set[str]) -> int:
+        started = time.monotonic()
+        batches = math.ceil(shortfall / max(1, document_config.QUESTIONS_PER_BATCH))
+        focus = ""
+        if types:
+            focus += f"Only write questions of type: {', '.join(sorted(types))}.\n"
+        if topic:
+            focus += f"Focus on: {', '.join(sorted(topic))}.\n"
+
+        added = 0
+        # Allow a few extra batches because some generated questions will be duplicates.
+        for pages, text in self._batches(batches + 2, topic):
+            if added >= shortfall:
+                break
+            prompt = BATCH_PROMPT.format(count=document_config.QUESTIONS_PER_BATCH, focus=focus, text=text[:4000])
+            try:
+                parsed = generate_structured(self.llm, prompt, QuestionSet)
+            except Exception as e:
+                logger.warning("Question batch failed for doc %s: %s", self.doc_id, e)
+                continue
+            if parsed is not None:
+                added += self.add([q.model_dump() for q in parsed.questions], topic=topic, pages=pages)
+        metrics.observe("question_bank.fill", time.monotonic() - started)
+        logger.info("Added %d questions to the bank of doc %s", added, self.doc_id)
+        return added
+
+    def _batches(self, limit: int, topic: Optional[Set[str]]):
+        """Yield ``(pages, text)`` chunk batches: the closest chunks for a topic, else the next
+        unused stretch of the document, continuing where the previous fill stopped."""
+        size = max(1, document_config.QUESTION_BATCH_CHUNKS)
+        if topic:
+            vectorstore = self.retriever.load_index()
+            chunks = vectorstore.similarity_search(" ".join(sorted(topic)), k=size * limit)
+            for start in range(0, len(chunks), size):
+                yield self._batch(chunks[start:start + size])
+            return
+
+        chunks = self.retriever.get_ordered_chunks()
+        if not chunks:
+            return
+        marker = {"_id": f"{self.doc_id}:{self.version}"}
+        state = self.state.find_one_and_update(
+            marker, {"$inc": {"cursor": size * limit}}, upsert=True, return_document=False
+        ) or {}
+        cursor = state.get("cursor", 0)
+        size = min(size, len(chunks))
+        for i in range(limit):
+            start = cursor + i * size
+            yield self._batch([chunks[(start + j) % len(chunks)] for j in range(size)])
+
+    @staticmethod
+    def _batch(chunks) -> Tuple[List[int], str]:
+        pages = sorted({chunk.metadata.get("page", 0) + 1 for chunk in chunks})
+        return pages, "\n".join(chunk.page_content for chunk in chunks)
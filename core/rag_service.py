@@ -1,12 +1,29 @@
+import contextvars
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from langchain.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import FAISS
 from langchain.embeddings import OllamaEmbeddings
 import pandas as pd
+
+from .answer_cache import answer_cache
+from .config import config
+from .deadline import get_deadline, timed_stage
+from .metrics import metrics
+from .numeric_extraction import extract_series
 FAISS_INDEX_DIR = os.getenv("FAISS_INDEX_DIR", "faiss_indexes")
 
+_prefetch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval-prefetch")
+# (doc_id, question words, k, future) of the speculative search for the current request.
+_prefetched = contextvars.ContextVar("retrieval_prefetch", default=None)
+
+
+def _words(text: str) -> set:
+    return set(re.findall(r"\w{3,}", text.lower()))
+
 class LocalPDFVectorizer:
 
     def __init__(self, doc_id: int):
@@ -29,16 +46,66 @@ class LocalPDFVectorizer:
         vectorstore = FAISS.from_documents(chunks, self.embeddings)
         os.makedirs(FAISS_INDEX_DIR, exist_ok=True)
         vectorstore.save_local(self.index_path)
+        # Answers given against the previous index are stale now.
+        answer_cache.invalidate(self.doc_id)
         return vectorstore
 
+    def index_version(self):
+        """Identify the saved index by its file mtime; changes whenever the doc is re-indexed."""
+        try:
+            return str(os.stat(os.path.join(self.index_path, "index.faiss")).st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
     def load_index(self):
         if not os.path.exists(self.index_path):
             raise FileNotFoundError(f"FAISS index not found for doc {self.doc_id}")
         return FAISS.load_local(self.index_path, self.embeddings, allow_dangerous_deserialization=True)
 
-    def query(self, query_text: str, k: int = 3):
+    @contextmanager
+    def prefetch(self, query_text: str, k: int = None):
+        """Start the vector search for ``query_text`` in the background for the duration of the block.
+
+        ``query`` calls inside the block whose text overlaps enough with it take the
+        prefetched chunks instead of searching again.
+        """
+        k = k or config.PREFETCH_K
+        future = _prefetch_pool.submit(contextvars.copy_context().run, self._search, query_text, k)
+        token = _prefetched.set((self.doc_id, _words(query_text), k, future))
+        metrics.incr("retriever.prefetches")
+        try:
+            yield future
+        finally:
+            _prefetched.reset(token)
+
+    def _search(self, query_text: str, k: int):
         vectorstore = self.load_index()
-        docs = vectorstore.similarity_search(query_text, k=k)
+        return vectorstore.similarity_search(query_text, k=k)
+
+    def _take_prefetched(self, query_text: str, k: int):
+        prefetched = _prefetched.get()
+        if prefetched is None:
+            return None
+        doc_id, words, prefetched_k, future = prefetched
+        asked = _words(query_text)
+        if doc_id != self.doc_id or k > prefetched_k or not asked:
+            return None
+        if len(words & asked) / len(words | asked) < config.PREFETCH_MIN_OVERLAP:
+            metrics.incr("retriever.prefetch_misses")
+            return None
+        deadline = get_deadline()
+        try:
+            docs = future.result(timeout=deadline.remaining() if deadline else None)
+        except Exception:
+            return None
+        metrics.incr("retriever.prefetch_hits")
+        return docs[:k]
+
+    def query(self, query_text: str, k: int = 3):
+        with timed_stage("retrieval"):
+            docs = self._take_prefetched(query_text, k)
+            if docs is None:
+                docs = self._search(query_text, k)
         return "\n".join([doc.page_content for doc in docs])
 
     def get_all_chunks(self, k: int = 1000):  
@@ -46,10 +113,21 @@ class LocalPDFVectorizer:
         docs = vectorstore.similarity_search(" ", k=k)
         return docs
 
-    def extract_data(self, text: str, pattern: str = r"(\w+):\s*(\d+(?:\.\d+)?)"): 
+    def get_ordered_chunks(self):
+        """Return every chunk in document order, read straight from the FAISS docstore."""
+        vectorstore = self.load_index()
+        # index_to_docstore_id follows insertion order, i.e. the splitter's page order.
+        return [
+            vectorstore.docstore.search(vectorstore.index_to_docstore_id[position])
+            for position in sorted(vectorstore.index_to_docstore_id)
+        ]
+
+    def extract_data(self, text: str, pattern: str = None):
+        if pattern is None:
+            return extract_series(text)
         matches = re.findall(pattern, text, re.IGNORECASE | re.MULTILINE)
         if matches:
             df = pd.DataFrame(matches, columns=['Label', 'Value'])
             df['Value'] = pd.to_numeric(df['Value'])
             return df
-        return pd.DataFrame()  
\ No newline at end of file
+        return pd.DataFrame()
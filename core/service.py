@@ -1,25 +1,28 @@
 from langchain.chains import ConversationChain
 from langchain.memory import ConversationBufferMemory
 from langchain.prompts import PromptTemplate
-from langchain_community.llms import ollama
+from collections import OrderedDict
 from threading import Lock
 import logging
 
 import ollama as ollama_client
 from  typing import Dict, List, Tuple
 
+from core.config import memory_config
+from core.generation_cache import cache_route
 from core.mongo_conversational_memory import MongoConversationMemory
+from core.session_registry import session_registry
+from core.usage import MeteredOllama
 logger = logging.getLogger('__name__')
 
 class OllamaChatService:
 
     def __init__(self, user_id:str) -> None:
-        self.llm = ollama.Ollama(model="gemma3:12b",          
+        self.llm = MeteredOllama(model="gemma3:12b",
                                  temperature=0.7,
                                  top_p=0.9,
                                  num_ctx=2048
                                  )
-        self.memory: Dict[str, MongoConversationMemory] = {}
         self.prompt = PromptTemplate(
             input_variables= ["history", "input"],
             template="""You are a helpful, friendly, and knowledgeable AI assistant. 
@@ -35,10 +38,19 @@ class OllamaChatService:
         ) 
         self.user_id = user_id
 
+    @property
+    def memory(self) -> Dict[str, MongoConversationMemory]:
+        return session_registry.sessions_for(self.user_id)
+
+    def _create_memory(self, session_id: str, user_id: str) -> MongoConversationMemory:
+        store = None
+        if memory_config.CHAT_TRANSCRIPT_BACKEND == "orm":
+            from core.transcript_store import OrmTranscriptStore
+            store = OrmTranscriptStore()
+        return MongoConversationMemory(session_id=session_id, user_id=user_id, store=store)
+
     def get_memory(self, session_id:str)-> MongoConversationMemory:
-        if session_id not in self.memory:
-            self.memory[session_id] = MongoConversationMemory(session_id=session_id, user_id=self.user_id)
-        return self.memory[session_id]
+        return session_registry.get(self.user_id, session_id, factory=self._create_memory)
     
     def get_conversation_history(self, session_id: str)-> str:
         memory = self.get_memory(session_id=session_id)
@@ -64,15 +76,19 @@ class OllamaChatService:
         try:
             history, context = self.get_full_conversation_context(session_id, user_input)
             conversation = self.create_conversation_chain(session_id=session_id)
-            response = conversation.predict(input=user_input)
             memory = self.get_memory(session_id=session_id)
-            memory.save_context(inputs={"input":user_input}, outputs={"output": response})
+            memory.last_turn = None
+            # ConversationChain saves the turn through the memory itself.
+            # Identical rendered prompts (e.g. the same opener in a fresh session) may be replayed.
+            with cache_route("chat"):
+                response = conversation.predict(input=user_input)
             return {
                 "success": True,
                 "response": response,
                 "history": history,
                 "context_used": context,
-                "method": "langchain"
+                "method": "langchain",
+                "saved_turn": memory.last_turn
             }
 
         except Exception as e:
@@ -95,7 +111,7 @@ class OllamaChatService:
                 },
             )
             memory = self.get_memory(session_id=session_id)
-            memory.save_context(inputs={"input": prompt}, outputs={"output":response["response"]})
+            memory.save_context(inputs={"input": user_input}, outputs={"output":response["response"]})
 
             return {
                 "success":True,
@@ -103,7 +119,8 @@ class OllamaChatService:
                 "history": history,
                 "context_used": prompt,
                 "method": "ollama_direct",
-                "model_used": response.get('model', 'llama2')                
+                "model_used": response.get('model', 'llama2'),
+                "saved_turn": memory.last_turn
             }
         except Exception as e:
             return {
@@ -114,35 +131,49 @@ class OllamaChatService:
             }
 
     def clear_memory(self, session_id:str):
-        if session_id in self.memory:
-            del self.memory[session_id]
+        """Clear the persisted session; returns the number of transcript messages removed, if known."""
+        deleted = self.get_memory(session_id).clear()
+        session_registry.discard(self.user_id, session_id)
+        return deleted
 
     def clear_all_memories(self) -> dict:
-        count = len(self.memory)
-        self.memory.clear()
+        count = session_registry.discard_user(self.user_id)
         return {"cleared_count": count, "message": "All memories cleared"}
     
     
-    def get_conversation_stats(self, session_id: str) -> dict:
-        memory = self.get_memory(session_id)
-        history = memory.load_memory_variables({})
-        history_text = history.get('history', '')
-        turns = history_text.count('Human:') + history_text.count('AI:')
+    def get_conversation_stats(self, session_id: str, conversation=None) -> dict:
+        # Single-row read of the counters maintained on every write; no history load.
+        # Callers that already hold the Conversation row pass it to skip the read.
+        from chat.models import Conversation
 
+        fields = ("message_count", "turn_count", "total_characters", "total_tokens", "last_activity_at")
+        if conversation is not None:
+            counters = {field: getattr(conversation, field) for field in fields}
+        else:
+            counters = Conversation.objects.filter(session_id=session_id).values(*fields).first() or {}
         return {
             "session_id": session_id,
-            "turns": turns,
-            "memory_size": len(history_text),
+            "turns": counters.get("turn_count", 0),
+            "messages": counters.get("message_count", 0),
+            "memory_size": counters.get("total_characters", 0),
+            "approx_tokens": counters.get("total_tokens", 0),
+            "last_activity": counters.get("last_activity_at"),
             "has_memory": session_id in self.memory
         }
     
 class OllamaChatServiceSingleton:
-    _instances: Dict[str, OllamaChatService] = {}
+    # Services only hold the LLM client and prompt; per-session memory lives in
+    # session_registry, so evicting a service here never drops conversation state.
+    _instances: "OrderedDict[str, OllamaChatService]" = OrderedDict()
     _lock = Lock()
 
     @classmethod
     def get_service(cls, user_id: str) -> "OllamaChatService":
         with cls._lock:
-            if user_id not in cls._instances:
+            if user_id in cls._instances:
+                cls._instances.move_to_end(user_id)
+            else:
                 cls._instances[user_id] = OllamaChatService(user_id=user_id)
+                while len(cls._instances) > memory_config.REGISTRY_MAX_USERS:
+                    cls._instances.popitem(last=False)
             return cls._instances[user_id]
\ No newline at end of file
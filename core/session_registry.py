@@ -0,0 +1,162 @@
+import logging
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Tuple
+
+from .config import memory_config
+from .invalidation import get_invalidation_bus
+from .metrics import metrics
+from .mongo_conversational_memory import MongoConversationMemory
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("memory", "last_access", "size")
+
+    def __init__(self, memory: MongoConversationMemory):
+        self.memory = memory
+        self.last_access = time.monotonic()
+        self.size = memory.approx_size()
+
+
+class SessionRegistry:
+    """Process-wide LRU of loaded conversation memories keyed by (user_id, session_id).
+
+    Entries are dropped when idle for longer than ``idle_ttl`` seconds or when the
+    registry exceeds ``max_sessions`` / ``max_bytes``; sizes are re-measured whenever
+    a memory loads its history or saves a turn. Nothing is lost on eviction:
+    every turn is already in Mongo, so the next ``get`` simply reloads the session.
+    With the invalidation bus enabled, sessions mutated by another worker are dropped
+    too, so any worker can serve any request without sticky sessions.
+    """
+
+    def __init__(self, max_sessions: int, max_bytes: int, idle_ttl: float):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = Lock()
+        self._subscribed = False
+
+    def _subscribe(self):
+        bus = get_invalidation_bus()
+        if bus is not None:
+            bus.subscribe(self._on_invalidation)
+
+    def _on_invalidation(self, user_id: str, session_id: str, kind: str):
+        # Another worker changed this session; the next get reloads it from the store.
+        with self._lock:
+            if self._remove((str(user_id), session_id)) is not None:
+                metrics.incr("session_registry.invalidations")
+
+    def get(self, user_id: str, session_id: str, factory=None) -> MongoConversationMemory:
+        if not self._subscribed:
+            self._subscribed = True
+            self._subscribe()
+        key = (str(user_id), session_id)
+        with self._lock:
+            self._expire_idle()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.last_access = time.monotonic()
+                self._resize(entry)
+                metrics.incr("session_registry.hits")
+                return entry.memory
+
+        # Build outside the lock and let a racing creator win; history itself loads lazily.
+        memory = (factory or MongoConversationMemory)(session_id=session_id, user_id=user_id)
+        metrics.incr("session_registry.loads")
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _Entry(memory)
+                self._entries[key] = entry
+                self._total_bytes += entry.size
+                # History loads lazily, so the size measured here is only the empty shell.
+                memory.watch_size(lambda: self._on_resize(key, memory))
+            self._entries.move_to_end(key)
+            self._enforce_limits()
+            return entry.memory
+
+    def _on_resize(self, key, memory: MongoConversationMemory):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.memory is not memory:
+                return
+            self._resize(entry)
+            self._enforce_limits()
+
+    def discard(self, user_id: str, session_id: str) -> bool:
+        with self._lock:
+            return self._remove((str(user_id), session_id)) is not None
+
+    def discard_user(self, user_id: str) -> int:
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == str(user_id)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def sessions_for(self, user_id: str) -> Dict[str, MongoConversationMemory]:
+        with self._lock:
+            return {
+                session_id: entry.memory
+                for (owner, session_id), entry in self._entries.items()
+                if owner == str(user_id)
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire_idle()
+            return {
+                "live_users": len({user_id for user_id, _ in self._entries}),
+                "live_sessions": len(self._entries),
+                "approx_bytes": self._total_bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "idle_ttl": self.idle_ttl,
+            }
+
+    def _resize(self, entry: _Entry):
+        size = entry.memory.approx_size()
+        self._total_bytes += size - entry.size
+        entry.size = size
+
+    def _remove(self, key, reason: str = None):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry.size
+            if reason:
+                metrics.incr("session_registry.evictions")
+                metrics.incr(f"session_registry.evictions.{reason}")
+                logger.info("Evicted session %s for user %s (%s)", key[1], key[0], reason)
+        return entry
+
+    def _expire_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        # Entries are kept in access order, so the idle ones are all at the front.
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.last_access > cutoff:
+                break
+            self._remove(key, reason="idle")
+
+    def _enforce_limits(self):
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_sessions or self._total_bytes > self.max_bytes
+        ):
+            key = next(iter(self._entries))
+            self._remove(key, reason="capacity")
+        metrics.set_gauge("session_registry.live_sessions", len(self._entries))
+        metrics.set_gauge("session_registry.approx_bytes", self._total_bytes)
+
+
+session_registry = SessionRegistry(
+    max_sessions=memory_config.REGISTRY_MAX_SESSIONS,
+    max_bytes=memory_config.REGISTRY_MAX_BYTES,
+    idle_ttl=memory_config.REGISTRY_IDLE_TTL,
+)
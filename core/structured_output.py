@@ -0,0 +1,228 @@
+import ast
+import json
+import logging
+import re
+from typing import List, Literal, Optional, Type, TypeVar
+
+import ollama as ollama_client
+from langchain_core.callbacks import CallbackManager
+from langchain_core.load import dumpd
+from langchain_core.outputs import Generation, LLMResult
+from langchain_core.runnables.config import ensure_config
+from pydantic import BaseModel, ValidationError, model_validator
+
+from .deadline import DeadlineExceeded, check_deadline, get_deadline
+from .fair_scheduler import fair_scheduler
+from .generation_cache import generation_cache
+from .metrics import metrics
+from .usage import bill, current_user
+
+logger = logging.getLogger(__name__)
+
+Schema = TypeVar("Schema", bound=BaseModel)
+
+
+class NumericData(BaseModel):
+    labels: List[str]
+    values: List[float]
+    analysis: Optional[dict] = None
+    suggested_graph: Optional[Literal["bar", "line", "pie", "histogram"]] = None
+
+    @model_validator(mode="after")
+    def _same_length(self):
+        if len(self.labels) != len(self.values):
+            raise ValueError("Arrays 'labels' and 'values' must have the same length")
+        return self
+
+
+class SeriesLabels(BaseModel):
+    labels: List[str]
+
+
+class Question(BaseModel):
+    type: str
+    question: str
+    options: Optional[List[str]] = None
+    answer: Optional[str] = None
+
+
+class QuestionSet(BaseModel):
+    questions: List[Question]
+
+
+class WeatherAnalysis(BaseModel):
+    summary: str
+    activities: List[str]
+    health_tips: List[str]
+
+
+_clients = {}
+
+
+def _client(llm):
+    """Ollama client for ``llm``'s host, timing out with ``llm`` or the current deadline, if sooner.
+
+    Clients with the llm's own timeout are shared; a call under a deadline gets one
+    bounded by what is left of it.
+    """
+    kwargs = {"host": llm.base_url} if getattr(llm, "base_url", None) else {}
+    timeout = getattr(llm, "timeout", None)
+    deadline = get_deadline()
+    if deadline is not None:
+        return ollama_client.Client(timeout=max(1, deadline.timeout(timeout)), **kwargs)
+    key = (kwargs.get("host"), timeout)
+    if key not in _clients:
+        _clients[key] = ollama_client.Client(timeout=timeout, **kwargs)
+    return _clients[key]
+
+
+def _generate_params(llm) -> dict:
+    """What the LangChain ``Ollama`` would send besides the prompt: options, system, template, keep_alive."""
+    defaults = getattr(llm, "_default_params", None) or {}
+    options = {key: value for key, value in (defaults.get("options") or {}).items() if value is not None}
+    options.setdefault("temperature", 0)
+    params = {"options": options}
+    for key in ("system", "template", "keep_alive", "raw"):
+        if defaults.get(key) is not None:
+            params[key] = defaults[key]
+    return params
+
+
+def _llm_run(llm, prompt: str, params: dict):
+    """Start a LangChain LLM run for a direct client call.
+
+    The caller's callbacks (the deadline handler, tracing) and the llm's own callbacks
+    and ``verbose`` flag then see it like any other call of ``llm``.
+    """
+    run_config = ensure_config()
+    manager = CallbackManager.configure(
+        run_config.get("callbacks"), llm.callbacks, llm.verbose,
+        run_config.get("tags"), llm.tags, run_config.get("metadata"), llm.metadata,
+    )
+    return manager.on_llm_start(dumpd(llm), [prompt], invocation_params=params)[0]
+
+
+def complete_with_schema(llm, prompt: str, schema: Type[BaseModel]) -> str:
+    """Generate with Ollama's ``format`` set to ``schema``'s JSON schema and return the raw text.
+
+    ``llm`` is the LangChain ``Ollama`` the caller already uses; its model, host and
+    generation parameters are reused and its callbacks see the call. Falls back to a
+    plain ``llm(prompt)`` call if the server rejects the schema, so callers still
+    parse the result.
+    """
+    check_deadline("llm")
+    params = _generate_params(llm)
+    cache_key = None
+    if generation_cache.applies(params["options"]["temperature"]):
+        cache_key = generation_cache.key(llm.model, {**params, "format": schema.model_json_schema()}, prompt)
+        cached = generation_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    try:
+        # Raises DeadlineExceeded from the deadline callback if the budget ran out meanwhile.
+        run_manager = _llm_run(llm, prompt, params)
+        user_id = current_user()
+        try:
+            with fair_scheduler.slot(user_id) as ticket:
+                response = _client(llm).generate(
+                    model=llm.model,
+                    prompt=prompt,
+                    format=schema.model_json_schema(),
+                    **params,
+                )
+                ticket.cost = bill(
+                    user_id, dict(response), fallback_tokens=(len(prompt) + len(response["response"])) // 4
+                )
+        except Exception as e:
+            run_manager.on_llm_error(e)
+            raise
+        run_manager.on_llm_end(LLMResult(
+            generations=[[Generation(text=response["response"], generation_info=dict(response))]]
+        ))
+        metrics.incr("structured_output.schema_calls")
+        # Only output that parses is worth replaying.
+        if cache_key is not None and tolerant_json_loads(response["response"]) is not None:
+            generation_cache.put(cache_key, response["response"])
+        check_deadline("llm")
+        return response["response"]
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.warning("Schema-constrained generation failed, falling back to free text: %s", e)
+        metrics.incr("structured_output.schema_errors")
+        check_deadline("llm")
+        return llm(prompt)
+
+
+def generate_structured(llm, prompt: str, schema: Type[Schema]) -> Optional[Schema]:
+    """``complete_with_schema`` plus validation; None when nothing valid came back. Never repairs."""
+    return parse_structured(complete_with_schema(llm, prompt, schema), schema)
+
+
+def parse_structured(text, schema: Type[Schema]) -> Optional[Schema]:
+    """Validate model output (text, or data already parsed from it) against ``schema``."""
+    data = tolerant_json_loads(text)
+    if data is None:
+        metrics.incr("structured_output.parse_failures")
+        return None
+    try:
+        return schema.model_validate(data)
+    except ValidationError as e:
+        logger.warning("Structured output failed %s validation: %s", schema.__name__, e)
+        metrics.incr("structured_output.validation_failures")
+        return None
+
+
+def tolerant_json_loads(text: str):
+    """Parse model output that is almost JSON, without asking the model to fix it.
+
+    Handles code fences, prose around the object, trailing commas, smart quotes and
+    Python-style literals/single quotes. Returns None if nothing parseable is found.
+    """
+    if not isinstance(text, str):
+        return text if isinstance(text, (dict, list)) else None
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+
+    block = _first_block(text)
+    if block is None:
+        return None
+    block = block.replace("“", '"').replace("”", '"').replace("‘", "'").replace("’", "'")
+    block = re.sub(r",\s*([}\]])", r"\1", block)
+    try:
+        data = json.loads(block)
+    except ValueError:
+        try:
+            data = ast.literal_eval(re.sub(r"\btrue\b", "True", re.sub(r"\bfalse\b", "False",
+                                                                        re.sub(r"\bnull\b", "None", block))))
+        except (ValueError, SyntaxError):
+            return None
+    metrics.incr("structured_output.local_recoveries")
+    return data
+
+
+def _first_block(text: str) -> Optional[str]:
+    """Return the first balanced ``{...}`` or ``[...]`` block, skipping brackets inside strings."""
+    start, stack, quote, escaped = None, [], None, False
+    for i, ch in enumerate(text):
+        if quote:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == quote:
+                quote = None
+            continue
+        if ch in "\"'" and start is not None:
+            quote = ch
+        elif ch in "{[":
+            if start is None:
+                start = i
+            stack.append("}" if ch == "{" else "]")
+        elif stack and ch == stack[-1]:
+            stack.pop()
+            if not stack:
+                return text[start:i + 1]
+    return None
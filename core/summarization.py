@@ -0,0 +1,147 @@
+import contextvars
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from django.core.cache import cache
+
+from .config import document_config
+from .deadline import get_deadline
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MAP_PROMPT = """Summarize the following section of a document concisely. Keep key facts, figures and names.
+
+{text}
+
+Summary:"""
+
+REDUCE_PROMPT = """The following are summaries of consecutive sections of one document.
+Combine them into a single concise summary of the whole, in document order, without repeating yourself.
+
+{text}
+
+Summary:"""
+
+# Shared by every summarizer in the process so concurrency against Ollama stays bounded.
+_executor = ThreadPoolExecutor(
+    max_workers=max(1, document_config.SUMMARY_CONCURRENCY), thread_name_prefix="doc-summary"
+)
+
+
+class MapReduceSummarizer:
+    """Hierarchical summarizer for documents that don't fit in one prompt.
+
+    Chunks are grouped into page-aligned sections of at most ``section_chars``
+    characters, each section is summarized in parallel (map), and the section
+    summaries are combined level by level until one summary remains (reduce).
+    Every intermediate summary is cached under (doc_id, hash of its input), so a
+    later full or page-range summary only calls the LLM for sections it hasn't seen.
+    """
+
+    def __init__(self, llm, doc_id, section_chars: int = None):
+        self.llm = llm
+        self.doc_id = doc_id
+        self.section_chars = section_chars or document_config.SUMMARY_SECTION_CHARS
+
+    def summarize(self, chunks, pages: Optional[Tuple[int, int]] = None) -> str:
+        """Summarize ordered ``chunks``, optionally only those on ``pages`` (1-based, inclusive)."""
+        started = time.monotonic()
+        section_summaries = self.section_summaries(chunks, pages)
+        if not section_summaries:
+            return ""
+        summary = self.reduce([summary for _, summary in section_summaries])
+        metrics.observe("summarizer.map_reduce", time.monotonic() - started)
+        logger.info("Summarized doc %s from %d sections", self.doc_id, len(section_summaries))
+        return summary
+
+    def section_summaries(self, chunks, pages: Optional[Tuple[int, int]] = None) -> List[Tuple[Tuple[int, int], str]]:
+        """Map step only: ``((first_page, last_page), summary)`` for each section."""
+        sections = self.sections(chunks)
+        if pages is not None:
+            first, last = pages
+            sections = [(span, text) for span, text in sections if span[0] <= last and span[1] >= first]
+        summaries = self._summarize_all(MAP_PROMPT, [text for _, text in sections])
+        return [(span, summary) for (span, _), summary in zip(sections, summaries)]
+
+    def sections(self, chunks) -> List[Tuple[Tuple[int, int], str]]:
+        """Group ordered chunks into ``((first_page, last_page), text)`` sections.
+
+        Boundaries only depend on the document, so the same section hashes come back
+        for full and partial summaries alike.
+        """
+        sections, texts, size, span = [], [], 0, None
+        for chunk in chunks:
+            page = chunk.metadata.get("page", 0) + 1
+            content = chunk.page_content
+            if texts and size + len(content) > self.section_chars:
+                sections.append((span, "\n".join(texts)))
+                texts, size, span = [], 0, None
+            texts.append(content)
+            size += len(content)
+            span = (span[0] if span else page, page)
+        if texts:
+            sections.append((span, "\n".join(texts)))
+        return sections
+
+    def reduce(self, summaries: List[str]) -> str:
+        """Reduce step: combine ordered summaries level by level into one."""
+        while len(summaries) > 1:
+            groups = self._group(summaries)
+            if len(groups) == len(summaries):
+                # Every summary fills a group by itself; combine pairs to keep converging.
+                groups = ["\n\n".join(summaries[i:i + 2]) for i in range(0, len(summaries), 2)]
+            summaries = self._summarize_all(REDUCE_PROMPT, groups)
+        return summaries[0]
+
+    def _group(self, texts: List[str]) -> List[str]:
+        groups, current, size = [], [], 0
+        for text in texts:
+            if current and size + len(text) > self.section_chars:
+                groups.append("\n\n".join(current))
+                current, size = [], 0
+            current.append(text)
+            size += len(text)
+        if current:
+            groups.append("\n\n".join(current))
+        return groups
+
+    def _summarize_all(self, template: str, texts: List[str]) -> List[str]:
+        # Pool threads don't inherit the request's context: hand the deadline over and run
+        # each call in a copy of the context so its LLM usage is billed to the request's user.
+        deadline = get_deadline()
+        futures = [
+            _executor.submit(contextvars.copy_context().run, self._summarize, template, text, deadline)
+            for text in texts
+        ]
+        return [future.result() for future in futures]
+
+    def _summarize(self, template: str, text: str, deadline=None) -> str:
+        key = self._cache_key(template, text)
+        try:
+            cached = cache.get(key)
+        except Exception as e:
+            logger.warning("Summary cache read failed for doc %s: %s", self.doc_id, e)
+            cached = None
+        if cached is not None:
+            metrics.incr("summarizer.cache_hits")
+            return cached
+
+        metrics.incr("summarizer.cache_misses")
+        if deadline is not None:
+            deadline.check("summarize")
+        started = time.monotonic()
+        summary = self.llm(template.format(text=text)).strip()
+        metrics.observe("summarizer.llm_call", time.monotonic() - started)
+        try:
+            cache.set(key, summary, timeout=document_config.SUMMARY_CACHE_TTL)
+        except Exception as e:
+            logger.warning("Summary cache write failed for doc %s: %s", self.doc_id, e)
+        return summary
+
+    def _cache_key(self, template: str, text: str) -> str:
+        digest = hashlib.sha256(f"{template}\0{text}".encode("utf-8")).hexdigest()
+        return f"doc_summary:{self.doc_id}:{digest}"
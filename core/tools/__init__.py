@@ -3,6 +3,7 @@ from .summarizer_tool import SummarizerTool
 from .question_tool import QuestionTool
 from .analysis_tool import AnalysisTool
 from .graph_tool import GraphTool
+from .binding import BoundRetriever, bind_retriever
 from langchain.agents import Tool
 
 class ToolFactory:
@@ -23,4 +24,9 @@ class ToolFactory:
                 description=tool.description,
                 return_direct=False
             ) for tool in [retriever_tool, summarizer_tool, analyzer_tool, graph_tool, question_tool]
-        ]
\ No newline at end of file
+        ]
+
+    @staticmethod
+    def create_shared_tools(llm):
+        """Create tools once per process; they use whichever retriever ``bind_retriever`` bound for the request."""
+        return ToolFactory.create_tools(BoundRetriever(), llm)
\ No newline at end of file
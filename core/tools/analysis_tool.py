@@ -1,10 +1,10 @@
 from .base_tool import BaseTool
 import logging
 import pandas as pd
-import matplotlib.pyplot as plt
-import uuid
-import os
-from ..config import config
+import time
+from ..chart_renderer import chart_renderer
+from ..numeric_extraction import describe, extract_numeric_data, suggest_graph
+from ..metrics import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -23,12 +23,22 @@ class AnalysisTool(BaseTool):
             query = "full document"
         logger.info("Analyzing data with query: %s", query)
         
+        started, path = time.monotonic(), "error"
         try:
+            precomputed = self._precomputed_table(query)
+            if precomputed:
+                path = "artifacts"
+                metrics.incr("document_artifacts.hits.numeric_tables")
+                return self._process_analysis_data(precomputed)
+
             text = self.retriever.query(query) if query else self.retriever.get_all_chunks()[0].page_content            
-            analysis_prompt = self._build_analysis_prompt()
-            llm_response = self.llm(analysis_prompt.format(text=text)).strip()
-            
-            data = self._safe_json_parse(llm_response, context_hint="Ensure valid JSON with equal-length labels and values.")
+            path = "regex"
+            data = extract_numeric_data(text, llm=self.llm)
+            if not data:
+                # Numbers only in running prose; let the LLM try to pull them out.
+                path = "llm"
+                analysis_prompt = self._build_analysis_prompt()
+                data = self._generate_json(analysis_prompt.format(text=text), context_hint="Ensure valid JSON with equal-length labels and values.")
             
             if not data or "labels" not in data or "values" not in data:
                 logger.info("No numerical data found in the document.")
@@ -45,6 +55,8 @@ class AnalysisTool(BaseTool):
                 "action": "Final Answer",
                 "action_input": f"Error analyzing data: {str(e)}"
             }
+        finally:
+            self._observe_latency("analysis_tool.execute", path, started)
     
     def _build_analysis_prompt(self) -> str:
         return """
@@ -91,41 +103,22 @@ class AnalysisTool(BaseTool):
                 "action_input": "No valid numerical values found."
             }
         
-        graph_type = data.get("suggested_graph", "bar")
+        graph_type = data.get("suggested_graph") or suggest_graph(df)
         file_url = self._create_visualization(df, graph_type)
+        # Statistics are always computed here; LLM arithmetic is not trusted.
+        analysis = describe(df["Value"])
         
         logger.info("Data analysis complete, graph saved as %s", file_url)
         return {
             "action": "Final Answer",
             "action_input": {
                 "description": f"Extracted {len(df)} data points. Suggested graph: {graph_type}.",
-                "analysis": data.get("analysis", {}),
+                "analysis": analysis,
                 "image_url": file_url
             }
         }
     
     def _create_visualization(self, df: pd.DataFrame, graph_type: str) -> str:
-        fig, ax = plt.subplots(figsize=config.GRAPH_FIGSIZE)
-        
-        if graph_type == "line":
-            ax.plot(df["Label"], df["Value"], marker="o", color=config.GRAPH_COLOR)
-        elif graph_type == "pie":
-            ax.pie(df["Value"], labels=df["Label"], autopct="%1.1f%%", startangle=90)
-        elif graph_type == "histogram":
-            ax.hist(df["Value"], bins=10, color=config.GRAPH_COLOR, edgecolor="black")
-        else: 
-            ax.bar(df["Label"], df["Value"], color=config.GRAPH_COLOR)
-        
-        ax.set_title(f"{graph_type.capitalize()} graph")
-        if graph_type != "pie":
-            ax.set_xlabel("Category")
-            ax.set_ylabel("Value")
-            plt.xticks(rotation=45, ha="right")
-        
-        plt.tight_layout()
-        filename = f"analysis_graph_{uuid.uuid4().hex}.png"
-        file_path = os.path.join(config.MEDIA_ROOT, filename)
-        plt.savefig(file_path, format="png", dpi=config.GRAPH_DPI)
-        plt.close(fig)
-        
-        return os.path.join(config.MEDIA_URL, filename)
\ No newline at end of file
+        return chart_renderer.render(
+            graph_type, df["Label"].tolist(), df["Value"].tolist(), title=f"{graph_type.capitalize()} graph"
+        )
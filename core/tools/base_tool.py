@@ -1,10 +1,19 @@
 from abc import ABC, abstractmethod
 import logging
-import json
+import re
+import time
 from typing import Any
 
+from ..document_artifacts import load_artifacts
+from ..metrics import metrics
+from ..structured_output import (
+    NumericData, complete_with_schema, generate_structured, parse_structured, tolerant_json_loads
+)
+
 logger = logging.getLogger(__name__)
 
+GENERIC_DATA_QUERIES = {"", "full document", "numerical data", "data", "numbers", "all data"}
+
 class BaseTool(ABC):    
     def __init__(self, name, description):
         self.name = name
@@ -13,32 +22,69 @@ class BaseTool(ABC):
     @abstractmethod
     def execute(self, query: str, **kwargs) -> Any:
         pass
+
+    def _artifacts(self) -> dict:
+        """Precomputed document artifacts from the enrichment task, or ``{}``."""
+        retriever = getattr(self, "retriever", None)
+        if retriever is None or getattr(retriever, "doc_id", None) is None:
+            return {}
+        try:
+            return load_artifacts(retriever)
+        except Exception as e:
+            logger.warning("Could not load document artifacts: %s", e)
+            return {}
     
-    def _safe_json_parse(self, llm_output: str, context_hint: str = "") -> dict:
+    def _observe_latency(self, metric: str, path: str, started: float):
+        """Record request latency overall and per extraction path (artifacts, regex, llm, error)."""
+        elapsed = time.monotonic() - started
+        metrics.observe(metric, elapsed)
+        metrics.observe(f"{metric}.{path}", elapsed)
+        logger.info("%s finished in %.1f ms via %s", self.name, elapsed * 1000, path)
+
+    def _precomputed_table(self, query: str) -> dict:
+        """Largest precomputed label/value table matching ``query`` as ``{"labels", "values"}``, or ``{}``."""
+        tables = self._artifacts().get("numeric_tables") or []
+        normalized = (query or "").strip().lower()
+        if normalized not in GENERIC_DATA_QUERIES:
+            terms = set(re.findall(r"[a-z]{3,}", normalized))
+            tables = [
+                t for t in tables
+                if terms & set(re.findall(r"[a-z]{3,}", " ".join(map(str, t["labels"])).lower()))
+            ]
+        if not tables:
+            return {}
+        best = max(tables, key=lambda t: len(t["labels"]))
+        return {"labels": best["labels"], "values": best["values"]}
+
+    def _generate_json(self, prompt: str, schema=NumericData, context_hint: str = "") -> dict:
+        """Ask Ollama for ``schema``-constrained JSON; only repairs if that still fails validation."""
+        return self._safe_json_parse(complete_with_schema(self.llm, prompt, schema), context_hint, schema)
+
+    def _safe_json_parse(self, llm_output: str, context_hint: str = "", schema=NumericData) -> dict:
         logger.info("Attempting safe JSON parse. Context: %s", context_hint)
-        max_retries = 1
-        current_output = llm_output
-
-        for attempt in range(max_retries):
-            try:
-                data = json.loads(current_output)
-                if "labels" in data and "values" in data:
-                    labels, values = data["labels"], data["values"]
-                    if isinstance(labels, list) and isinstance(values, list) and len(labels) != len(values):
-                        raise ValueError("Arrays 'labels' and 'values' must have the same length")
-                logger.info("JSON parsed successfully on attempt %d.", attempt + 1)
-                return data
-            except Exception as e:
-                logger.warning("JSON parse error on attempt %d: %s", attempt + 1, str(e))
-                repair_prompt = f"""
-                The following JSON was invalid or inconsistent.
-                Error: {str(e)}
-                Context: {context_hint}
-                Fix it and return valid JSON only. Do not add explanations.
-
-                JSON to fix:
-                {current_output}
-                """
-                current_output = self.llm(repair_prompt).strip()
-        logger.error("Failed to safely parse JSON after %d attempts.", max_retries)
-        return {}
\ No newline at end of file
+        data = tolerant_json_loads(llm_output)
+        if data == {}:
+            # The prompts ask for {} when the text holds no data; nothing to repair.
+            return {}
+        parsed = parse_structured(data, schema)
+        if parsed is not None:
+            return parsed.model_dump(exclude_none=True)
+        return self._repair_json(llm_output, schema, context_hint)
+
+    def _repair_json(self, llm_output: str, schema, context_hint: str) -> dict:
+        logger.warning("Local JSON parsing failed, asking the model to repair it. Context: %s", context_hint)
+        metrics.incr("structured_output.repairs")
+        metrics.incr(f"structured_output.repairs.{self.name}")
+        repair_prompt = f"""
+        The following output was invalid or inconsistent JSON.
+        Context: {context_hint}
+        Fix it and return valid JSON only. Do not add explanations.
+
+        JSON to fix:
+        {llm_output}
+        """
+        repaired = generate_structured(self.llm, repair_prompt, schema)
+        if repaired is None:
+            logger.error("Failed to safely parse JSON after repair.")
+            return {}
+        return repaired.model_dump(exclude_none=True)
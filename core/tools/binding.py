@@ -0,0 +1,32 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current_retriever = ContextVar("tool_retriever", default=None)
+
+
+class BoundRetriever:
+    """Stand-in retriever for process-wide tools; forwards to the retriever bound to the current request."""
+
+    @property
+    def bound(self):
+        retriever = _current_retriever.get()
+        if retriever is None:
+            raise RuntimeError("No retriever is bound to the current request")
+        return retriever
+
+    def __getattr__(self, name):
+        return getattr(self.bound, name)
+
+
+@contextmanager
+def bind_retriever(retriever):
+    token = _current_retriever.set(retriever)
+    try:
+        yield retriever
+    finally:
+        _current_retriever.reset(token)
+
+
+def unwrap(retriever):
+    """The concrete retriever, for handing to threads that don't share the request context."""
+    return retriever.bound if isinstance(retriever, BoundRetriever) else retriever
@@ -1,11 +1,11 @@
 from .base_tool import BaseTool
 import logging
 import pandas as pd
-import matplotlib.pyplot as plt
-import uuid
-import os
 import json
-from ..config import config
+import time
+from ..chart_renderer import chart_renderer
+from ..numeric_extraction import extract_numeric_data
+from ..metrics import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -24,16 +24,26 @@ class GraphTool(BaseTool):
             query = "full document"
         logger.info("Making graph with query: %s", query)
         
+        started, path = time.monotonic(), "error"
         try:
             parts = query.lower().strip().split(maxsplit=1)
             graph_type = parts[0] if parts and parts[0] in ["bar", "line"] else "bar"
             data_query = parts[1] if len(parts) > 1 else "numerical data"
             
+            precomputed = self._precomputed_table(data_query)
+            if precomputed:
+                path = "artifacts"
+                metrics.incr("document_artifacts.hits.numeric_tables")
+                return self._create_graph(precomputed, graph_type, data_query)
+
             text = self.retriever.query(data_query, k=5)
-            extraction_prompt = self._build_extraction_prompt()
-            llm_response = self.llm(extraction_prompt.format(text=text)).strip()
-            
-            data = self._safe_json_parse(llm_response, context_hint="Ensure valid JSON with equal-length labels and values.")
+            path = "regex"
+            data = extract_numeric_data(text, llm=self.llm)
+            if not data:
+                # Numbers only in running prose; let the LLM try to pull them out.
+                path = "llm"
+                extraction_prompt = self._build_extraction_prompt()
+                data = self._generate_json(extraction_prompt.format(text=text), context_hint="Ensure valid JSON with equal-length labels and values.")
             
             if not data or "labels" not in data or "values" not in data:
                 logger.info("No numerical data found for graph creation.")
@@ -50,6 +60,8 @@ class GraphTool(BaseTool):
                 "action": "Final Answer",
                 "action_input": f"Graph creation error: {str(e)}"
             })
+        finally:
+            self._observe_latency("graph_tool.execute", path, started)
     
     def _build_extraction_prompt(self) -> str:
         return """
@@ -90,32 +102,16 @@ class GraphTool(BaseTool):
                 "action_input": "No valid numerical values found."
             })
         
-        fig, ax = plt.subplots(figsize=config.GRAPH_FIGSIZE)
-        
-        if graph_type == "line":
-            ax.plot(df["Label"], df["Value"], marker="o", color=config.GRAPH_COLOR)
-        else:
-            ax.bar(df["Label"], df["Value"], color=config.GRAPH_COLOR)
-        
-        ax.set_title(f"{graph_type.capitalize()} graph of {data_query}")
-        ax.set_xlabel("Category")
-        ax.set_ylabel("Value")
-        plt.xticks(rotation=45, ha="right")
-        plt.tight_layout()
-        
-        filename = f"graph_{uuid.uuid4().hex}.png"
-        file_path = os.path.join(config.MEDIA_ROOT, filename)
-        plt.savefig(file_path, format="png", dpi=config.GRAPH_DPI)
-        plt.close(fig)
-        
-        file_url = os.path.join(config.MEDIA_URL, filename)
+        file_url = chart_renderer.render(
+            graph_type, df["Label"].tolist(), df["Value"].tolist(), title=f"{graph_type.capitalize()} graph of {data_query}"
+        )
         description = (
             f"Generated a {graph_type} graph with {len(df)} points. "
             f"X-axis: {', '.join(df['Label'].tolist()[:5])}{'...' if len(df) > 5 else ''}. "
             f"Y-axis from {df['Value'].min():.2f} to {df['Value'].max():.2f}."
         )
         
-        logger.info("Graph created successfully: %s", filename)
+        logger.info("Graph created successfully: %s", file_url)
         return json.dumps({
             "action": "Final Answer",
             "action_input": {
@@ -1,4 +1,10 @@
 from .base_tool import BaseTool
+from .binding import unwrap
+from ..config import document_config
+from ..deadline import check_deadline, get_deadline
+from ..metrics import metrics
+from ..question_bank import QuestionBank, parse_request
+from ..structured_output import QuestionSet, complete_with_schema, parse_structured
 import logging
 from typing import Optional, List, Dict, Any
 
@@ -26,6 +32,10 @@ class QuestionTool(BaseTool):
         logger.info("QuestionTool executed with query: %s", query)
         try:
             clean_query = self._clean_input_query(query)
+            banked = self._from_question_bank(clean_query)
+            if banked:
+                return {"type": "final_answer", "output": {"actions": "Final Answer", "action_input": banked}}
+
             document_text = self._get_document_content(clean_query)
             if not document_text:
                 questions_data = self._create_basic_fallback_questions(clean_query, "")
@@ -42,6 +52,36 @@ class QuestionTool(BaseTool):
             fallback = self._create_basic_fallback_questions(query, "")
             return {"type": "final_answer", "output": fallback}
 
+    def _from_question_bank(self, query: str) -> Optional[List[Dict[str, Any]]]:
+        """Serve the request from the document's question bank, generating only the shortfall."""
+        if getattr(self.retriever, "doc_id", None) is None:
+            return None
+        count, types, topic = parse_request(query, self.min_questions)
+        try:
+            # Fills run on pool threads, outside the request that bound the retriever.
+            bank = QuestionBank(unwrap(self.retriever), self.llm)
+            if bank.version is None:
+                return None
+            bank.seed(self._artifacts().get("question_bank") or [])
+            available = bank.count(types, topic)
+            if available >= count:
+                metrics.incr("question_bank.hits")
+            else:
+                metrics.incr("question_bank.shortfalls")
+                try:
+                    deadline = get_deadline()
+                    wait = deadline.timeout(document_config.QUESTION_BANK_WAIT) if deadline else document_config.QUESTION_BANK_WAIT
+                    bank.fill(count - available, types, topic).result(timeout=wait)
+                except Exception as e:
+                    # Answer with live generation; the unfinished fill still lands in the bank.
+                    logger.warning("Question bank fill did not complete in time, generating live: %s", e)
+                    metrics.incr("question_bank.fill_timeouts")
+                    return None
+            return bank.take(count, types, topic) or None
+        except Exception as e:
+            logger.warning("Question bank unavailable, generating live: %s", e)
+            return None
+
     def _clean_input_query(self, raw_input: str) -> str:
         if not raw_input or len(raw_input.strip()) < 3:
             return "main concepts"
@@ -97,6 +137,8 @@ class QuestionTool(BaseTool):
 
     def _call_llm(self, prompt: str, stop: Optional[List[str]] = None) -> str:
         for attempt in range(self.max_retries):
+            # Retries stop once the request is out of time.
+            check_deadline("question_llm")
             try:
                 resp = self.llm(prompt)
                 if isinstance(resp, str):
@@ -112,10 +154,14 @@ class QuestionTool(BaseTool):
 
     def _try_json_generation(self, document_text: str, user_query: str) -> Optional[Any]:
         prompt = self._build_json_prompt(document_text, user_query)
-        raw = self._call_llm(prompt)
+        raw = complete_with_schema(self.llm, prompt, QuestionSet)
         if not raw or not raw.strip():
             return None
 
+        parsed = parse_structured(raw, QuestionSet)
+        if parsed is not None and parsed.questions:
+            return [question.model_dump(exclude_none=True) for question in parsed.questions]
+
         json_block = self._extract_first_json_block(raw)
         if json_block:
             return json_block 
@@ -1,14 +1,22 @@
 from .base_tool import BaseTool
+from ..metrics import metrics
+from ..summarization import MapReduceSummarizer
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
+PAGE_RANGE = re.compile(r"^pages?\s+(\d+)(?:\s*(?:-|to)\s*(\d+))?$")
+
 class SummarizerTool(BaseTool):
     
     def __init__(self, retriever, llm):
         super().__init__(
             name="Summarizer",
-            description="Summarize the full document or a specific query. Use 'full' for entire doc."
+            description=(
+                "Summarize the full document or a specific query. Use 'full' for entire doc, "
+                "or 'pages 3-5' for a page range."
+            )
         )
         self.retriever = retriever
         self.llm = llm
@@ -16,12 +24,24 @@ class SummarizerTool(BaseTool):
     def execute(self, query: str, **kwargs):
         logger.info("Summarizing with query: %s", query)
         try:
-            if query.lower() == "full":
-                chunks = self.retriever.get_all_chunks()
-                text = "\n".join([doc.page_content for doc in chunks])
-            else:
-                text = self.retriever.query(query)
-            
+            normalized = query.strip().lower()
+            pages = PAGE_RANGE.match(normalized)
+            if normalized == "full":
+                precomputed = self._artifacts().get("summary")
+                if precomputed:
+                    metrics.incr("document_artifacts.hits.summary")
+                    return precomputed
+            if normalized == "full" or pages:
+                page_range = None
+                if pages:
+                    first = int(pages.group(1))
+                    page_range = (first, int(pages.group(2) or first))
+                summarizer = MapReduceSummarizer(self.llm, self.retriever.doc_id)
+                summary = summarizer.summarize(self.retriever.get_ordered_chunks(), pages=page_range)
+                logger.info("Summary generated successfully.")
+                return summary
+
+            text = self.retriever.query(query)
             prompt = f"Summarize the following document content concisely:\n\n{text}"
             summary = self.llm(prompt)
             logger.info("Summary generated successfully.")
@@ -0,0 +1,114 @@
+import logging
+import time
+
+from django.db import transaction
+from django.db.models import Q
+
+from chat.models import Conversation, Message
+
+from .config import memory_config
+from .conversation_store import MongoConversationStore
+from .invalidation import get_invalidation_bus
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# A turn's two rows can share a timestamp; the AI reply sorts after (so newest-first,
+# before) the user message, and id only makes the order total for keyset paging.
+NEWEST_FIRST = ("-timestamp", "is_user", "-id")
+
+
+class OrmTranscriptStore:
+    """Chat transcript store with Postgres ``Message`` rows as the single source of truth.
+
+    It exposes the same interface as ``MongoConversationStore`` so it can back a
+    ``MongoConversationMemory``. Each turn is one transaction with one multi-row
+    INSERT, replacing the two ORM inserts from the view plus the Mongo pushes from
+    the memory. Mongo only keeps derived per-session state (rolling summary, turn
+    vectors), which can be rebuilt from these rows.
+    """
+
+    def __init__(self, collection_name: str = "conversations"):
+        self.name = f"orm:{collection_name}"
+        self._derived = MongoConversationStore(collection_name, write_behind=False)
+        self._bus = get_invalidation_bus()
+        self._conversation_ids = {}
+
+    def _messages(self, session_id: str, user_id: str):
+        return Message.objects.filter(conversation__session_id=session_id, conversation__user_id=user_id)
+
+    def _conversation_id(self, session_id: str, user_id: str):
+        key = (session_id, str(user_id))
+        if key not in self._conversation_ids:
+            conversation, _ = Conversation.objects.get_or_create(session_id=session_id, user_id=user_id)
+            self._conversation_ids[key] = conversation.id
+        return self._conversation_ids[key]
+
+    @staticmethod
+    def _as_dict(message) -> dict:
+        return {"role": "user" if message.is_user else "ai", "content": message.content}
+
+    def load(self, session_id: str, user_id: str, limit: int = None, since_field: str = None) -> dict:
+        header = self._derived.headers.find_one(
+            {"session_id": session_id, "user_id": user_id}, {"_id": 0, "messages": 0}
+        ) or {}
+        messages = self._messages(session_id, user_id)
+        message_count = messages.count()
+        if since_field:
+            remaining = max(0, message_count - header.get(since_field, 0))
+            limit = remaining if limit is None else min(limit, remaining)
+        rows = messages.order_by(*NEWEST_FIRST).only("content", "is_user")
+        if limit is not None:
+            rows = rows[:limit]
+        header["messages"] = [self._as_dict(message) for message in reversed(list(rows))]
+        header["message_count"] = message_count
+        return header
+
+    def iter_history(self, session_id: str, user_id: str):
+        """Yield history newest page first, using keyset pagination on ``NEWEST_FIRST``."""
+        before = None
+        while True:
+            rows = self._messages(session_id, user_id).order_by(*NEWEST_FIRST)
+            if before is not None:
+                # Rows sharing a timestamp continue after the last one served, so a page
+                # boundary between them neither skips nor repeats a row.
+                timestamp, is_user, pk = before
+                rows = rows.filter(
+                    Q(timestamp__lt=timestamp)
+                    | Q(timestamp=timestamp, is_user__gt=is_user)
+                    | Q(timestamp=timestamp, is_user=is_user, id__lt=pk)
+                )
+            page = list(rows.only("content", "is_user", "timestamp")[:memory_config.BUCKET_SIZE])
+            if not page:
+                return
+            yield [self._as_dict(message) for message in reversed(page)]
+            before = page[-1].timestamp, page[-1].is_user, page[-1].id
+
+    def append_turn(self, session_id: str, user_id: str, user_content: str, ai_content: str):
+        started = time.monotonic()
+        conversation_id = self._conversation_id(session_id, user_id)
+        with transaction.atomic():
+            turn = Message.objects.bulk_create([
+                Message(conversation_id=conversation_id, user_id=user_id, content=user_content, is_user=True),
+                Message(conversation_id=conversation_id, user_id=user_id, content=ai_content, is_user=False),
+            ])
+            # Counters and updated_at (which orders the conversation list) move with the rows.
+            Conversation.record_turn(conversation_id, user_content, ai_content)
+        metrics.observe("transcript_store.append_turn", time.monotonic() - started)
+        metrics.incr("transcript_store.write_statements")
+        if self._bus is not None:
+            self._bus.publish(user_id, session_id, "append")
+        return turn
+
+    def set_fields(self, session_id: str, user_id: str, fields: dict):
+        self._derived.set_fields(session_id, user_id, fields)
+
+    def delete(self, session_id: str, user_id: str) -> int:
+        with transaction.atomic():
+            deleted, _ = self._messages(session_id, user_id).delete()
+            if Conversation.objects.filter(session_id=session_id, user_id=user_id).exists():
+                Conversation.reset_counters(session_id)
+        # Also announces the clear on the invalidation bus.
+        self._derived.delete(session_id, user_id)
+        self._conversation_ids.pop((session_id, str(user_id)), None)
+        return deleted
@@ -0,0 +1,216 @@
+import logging
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from django_redis import get_redis_connection
+from langchain_community.llms import Ollama
+from langchain_core.outputs import Generation, LLMResult
+from rest_framework.throttling import BaseThrottle
+
+from .config import config
+from .deadline import get_deadline
+from .fair_scheduler import fair_scheduler
+from .generation_cache import generation_cache
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Each window is kept as this many buckets, so usage ages out in 1/BUCKETS steps.
+BUCKETS = 60
+
+_current_user: ContextVar[Optional[str]] = ContextVar("llm_user", default=None)
+
+
+@contextmanager
+def use_user(user_id):
+    """Bill the LLM calls made inside the block (and in threads that copy the context) to ``user_id``."""
+    token = _current_user.set(str(user_id))
+    try:
+        yield
+    finally:
+        _current_user.reset(token)
+
+
+def current_user() -> Optional[str]:
+    return _current_user.get()
+
+
+class UsageLedger:
+    """Per-user LLM consumption over rolling windows, kept in Redis.
+
+    Each window is split into ``BUCKETS`` hashes of ``tokens``, ``ms`` and ``calls``
+    that expire on their own, so a window's usage is the sum of its live buckets.
+    Failing to record is logged and ignored; failing to read counts as no usage, so a
+    Redis outage never blocks requests.
+    """
+
+    def __init__(self, windows: dict, token_quotas: dict, second_quotas: dict, alias: str = "default"):
+        self.windows = windows
+        self.token_quotas = token_quotas
+        self.second_quotas = second_quotas
+        self.alias = alias
+
+    @property
+    def _client(self):
+        return get_redis_connection(self.alias)
+
+    def _bucket(self, window: str, now: float):
+        size = self.windows[window] / BUCKETS
+        return size, int(now // size)
+
+    def record(self, user_id, tokens: int, seconds: float):
+        now = time.time()
+        try:
+            pipe = self._client.pipeline()
+            for window, length in self.windows.items():
+                size, index = self._bucket(window, now)
+                key = f"llm_usage:{user_id}:{window}:{index}"
+                pipe.hincrby(key, "tokens", tokens)
+                pipe.hincrby(key, "ms", int(seconds * 1000))
+                pipe.hincrby(key, "calls", 1)
+                pipe.expire(key, int(length + size) + 1)
+            pipe.execute()
+        except Exception as e:
+            logger.warning("Could not record LLM usage for user %s: %s", user_id, e)
+            metrics.incr("usage.errors")
+
+    def _buckets(self, user_id, window: str, now: float):
+        """``[(bucket index, {tokens, ms, calls})]`` of the window, oldest first."""
+        size, index = self._bucket(window, now)
+        indexes = range(index - BUCKETS + 1, index + 1)
+        pipe = self._client.pipeline()
+        for i in indexes:
+            pipe.hgetall(f"llm_usage:{user_id}:{window}:{i}")
+        return [
+            (i, {key.decode(): int(value) for key, value in raw.items()})
+            for i, raw in zip(indexes, pipe.execute())
+            if raw
+        ]
+
+    def usage(self, user_id) -> dict:
+        now = time.time()
+        report = {}
+        for window, length in self.windows.items():
+            try:
+                buckets = self._buckets(user_id, window, now)
+            except Exception as e:
+                logger.warning("Could not read LLM usage for user %s: %s", user_id, e)
+                metrics.incr("usage.errors")
+                buckets = []
+            tokens = sum(bucket.get("tokens", 0) for _, bucket in buckets)
+            seconds = sum(bucket.get("ms", 0) for _, bucket in buckets) / 1000
+            report[window] = {
+                "window_seconds": length,
+                "tokens": tokens,
+                "compute_seconds": round(seconds, 1),
+                "calls": sum(bucket.get("calls", 0) for _, bucket in buckets),
+                "token_quota": self.token_quotas.get(window) or None,
+                "compute_seconds_quota": self.second_quotas.get(window) or None,
+                "retry_after": self._retry_after(window, buckets, now),
+            }
+        return report
+
+    def retry_after(self, user_id) -> Optional[int]:
+        """Seconds until the user is back under every quota, or None if they are now."""
+        if not any(self.token_quotas.values()) and not any(self.second_quotas.values()):
+            return None
+        waits = [window["retry_after"] for window in self.usage(user_id).values()]
+        waits = [wait for wait in waits if wait is not None]
+        return max(waits) if waits else None
+
+    def _retry_after(self, window: str, buckets: list, now: float) -> Optional[int]:
+        size, index = self._bucket(window, now)
+        wait = None
+        limits = {
+            "tokens": self.token_quotas.get(window) or 0,
+            "ms": (self.second_quotas.get(window) or 0) * 1000,
+        }
+        for field, quota in limits.items():
+            if not quota:
+                continue
+            excess = sum(bucket.get(field, 0) for _, bucket in buckets) - quota
+            # Oldest buckets leave the window first; find the one that brings us under.
+            for i, bucket in buckets:
+                if excess < 0:
+                    break
+                excess -= bucket.get(field, 0)
+                leaves_at = (i + BUCKETS) * size
+                wait = max(wait or 1, math.ceil(leaves_at - now))
+        return wait
+
+
+usage_ledger = UsageLedger(
+    windows=config.QUOTA_WINDOWS,
+    token_quotas=config.QUOTA_TOKENS,
+    second_quotas=config.QUOTA_SECONDS,
+)
+
+
+def bill(user_id, info: dict, fallback_tokens: int = 0) -> int:
+    """Record one Ollama response for ``user_id`` from its eval counts; returns the tokens billed."""
+    info = info or {}
+    tokens = (info.get("prompt_eval_count") or 0) + (info.get("eval_count") or 0)
+    if not tokens:
+        metrics.incr("usage.estimated")
+        tokens = fallback_tokens
+    seconds = (info.get("total_duration") or 0) / 1e9
+    metrics.incr("usage.tokens", tokens)
+    if user_id is not None:
+        usage_ledger.record(user_id, tokens, seconds)
+    return tokens
+
+
+class MeteredOllama(Ollama):
+    """``Ollama`` whose calls wait for a fair-share slot and are billed to the current user.
+
+    Cacheable single-prompt calls are served from the generation cache first; a hit
+    neither waits for a slot nor is billed. One instance is shared by every request,
+    so ``timeout`` is only a ceiling: each call's HTTP timeout is what is left of the
+    current request's deadline.
+    """
+
+    def _for_call(self) -> "MeteredOllama":
+        deadline = get_deadline()
+        if deadline is None:
+            return self
+        return self.model_copy(update={"timeout": max(1, deadline.timeout(self.timeout))})
+
+    def _generate(self, prompts, stop=None, *args, **kwargs):
+        cache_key = None
+        if len(prompts) == 1 and generation_cache.applies(self.temperature):
+            cache_key = generation_cache.key(self.model, {**self._default_params, "stop": stop}, prompts[0])
+            cached = generation_cache.get(cache_key)
+            if cached is not None:
+                return LLMResult(generations=[[Generation(text=cached, generation_info={"cached": True})]])
+        user_id = current_user()
+        with fair_scheduler.slot(user_id) as ticket:
+            result = Ollama._generate(self._for_call(), prompts, stop, *args, **kwargs)
+            for prompt, generations in zip(prompts, result.generations):
+                for generation in generations:
+                    ticket.cost += bill(
+                        user_id, generation.generation_info,
+                        fallback_tokens=(len(prompt) + len(generation.text)) // 4,
+                    )
+        if cache_key is not None and result.generations[0][0].text:
+            generation_cache.put(cache_key, result.generations[0][0].text)
+        return result
+
+
+class LLMQuotaThrottle(BaseThrottle):
+    """Rejects LLM-backed requests with 429 while the user is over a usage quota."""
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        if not request.user or not request.user.is_authenticated:
+            return True
+        self.wait_seconds = usage_ledger.retry_after(request.user.id)
+        if self.wait_seconds is not None:
+            metrics.incr("usage.throttled")
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_seconds
@@ -3,12 +3,20 @@ import requests
 import json
 from typing import Dict, Any, Union, List
 
-from langchain_community.llms import Ollama
-from langchain.agents import initialize_agent, AgentType, Tool
+from langchain.agents import AgentType, Tool
 from langchain.memory import ConversationBufferMemory
 from langchain.schema import SystemMessage
 
+from core.agent_execution import AgentScaffold, cached_scaffold
+from core.config import config
+from core.deadline import (
+    Deadline, DeadlineCallbackHandler, DeadlineExceeded, check_deadline, get_deadline, use_deadline
+)
+from core.generation_cache import cache_route
+from core.metrics import metrics
 from core.mongo_conversational_memory import MongoConversationMemory
+from core.structured_output import WeatherAnalysis, complete_with_schema, generate_structured, parse_structured
+from core.usage import MeteredOllama
 
 WEATHER_API_URL_FORMAT = "https://wttr.in/{city}?format=j1"
 WEATHER_API_TIMEOUT = 10  
@@ -16,41 +24,13 @@ WEATHER_API_TIMEOUT = 10
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class WeatherAgent:
-    def __init__(self, user_id: str, session_id: str = "default", llm_model: str = "gemma3:12b"):
-        logger.info(f"Initializing WeatherAgent for user: {user_id}, session: {session_id} with model: {llm_model}")
-        self.user_id = user_id
-        self.session_id = session_id
-        self.llm = Ollama(model=llm_model, temperature=0.2) 
-        
-        self.memory =  MongoConversationMemory(
-            session_id=session_id,
-            user_id=user_id
-        )
+class WeatherTools:
+    """The weather agent's tools. Holds no per-request state, so one instance serves every request."""
 
-        tools = self._setup_tools()
-
-        self.agent_executor = initialize_agent(
-            tools=tools,
-            llm=self.llm,
-            agent=AgentType.OPENAI_FUNCTIONS, 
-            verbose=True,
-            handle_parsing_errors=True,
-            max_iterations=7, 
-            early_stopping_method="generate",
-            memory=self.memory, 
-            agent_kwargs={
-                "system_message": SystemMessage(
-                    content="You are a helpful and friendly weather assistant. "
-                            "Use the Weather Retriever tool to get weather, then the Weather Analyzer "
-                            "to provide a summary, activity suggestions, and health tips. "
-                            "Always aim to provide a comprehensive and user-friendly response."
-                )
-            }
-        )
-        logger.info("WeatherAgent initialized successfully.")
+    def __init__(self, llm):
+        self.llm = llm
 
-    def _setup_tools(self) -> List[Tool]:
+    def as_tools(self) -> List[Tool]:
         weather_retriever_tool = Tool(
             name="WeatherRetriever", 
             func=self._get_weather,
@@ -71,7 +51,10 @@ class WeatherAgent:
             logger.warning("WeatherRetriever received an empty city name.")
             return "Error: City name is required to fetch weather."
         url = WEATHER_API_URL_FORMAT.format(city=city.lower())
-        resp = requests.get(url, timeout=WEATHER_API_TIMEOUT)
+        check_deadline("weather_api")
+        deadline = get_deadline()
+        timeout = deadline.timeout(WEATHER_API_TIMEOUT) if deadline else WEATHER_API_TIMEOUT
+        resp = requests.get(url, timeout=max(1, timeout))
         try:
             
             logger.info(f"Attempting to fetch weather from: {url}")
@@ -150,7 +133,9 @@ class WeatherAgent:
         """
         try:
             logger.info("Sending weather data to LLM for analysis.")
-            llm_raw_output = self.llm.invoke(prompt).strip() 
+            # The same weather payload always gets the same analysis.
+            with cache_route("weather_analysis"):
+                llm_raw_output = complete_with_schema(self.llm, prompt, WeatherAnalysis).strip()
             parsed_data = self._safe_json_parse(llm_raw_output, context_hint="weather analysis JSON")
             
             if isinstance(parsed_data, dict):
@@ -164,44 +149,98 @@ class WeatherAgent:
             return f"An error occurred during weather analysis: {str(e)}"
 
     def _safe_json_parse(self, llm_output: str, context_hint: str = "") -> Union[Dict[str, Any], str]:
+        parsed = parse_structured(llm_output, WeatherAnalysis)
+        if parsed is not None:
+            return parsed.model_dump()
+
+        logger.warning(f"Local JSON parsing failed for {context_hint}. Attempting repair.")
+        metrics.incr("structured_output.repairs")
+        metrics.incr("structured_output.repairs.WeatherAnalyzer")
+        repair_prompt = f"""
+        The following text was intended to be a STRICTLY VALID JSON object but failed to parse.
+        Context for generation: {context_hint}.
+        Please correct the JSON and return only the valid JSON object.
+        Ensure it includes the keys: "summary", "activities" (as a list), and "health_tips" (as a list).
+
+        Invalid output to fix:
+        ```json
+        {llm_output}
+        ```
+        Return ONLY the corrected JSON object.
+        """
         try:
-            return json.loads(llm_output)
-        except json.JSONDecodeError:
-            logger.warning(f"Initial JSON parsing failed for {context_hint}. Attempting repair.")
-            repair_prompt = f"""
-            The following text was intended to be a STRICTLY VALID JSON object but failed to parse.
-            Context for generation: {context_hint}.
-            Please correct the JSON and return only the valid JSON object.
-            Ensure it includes the keys: "summary", "activities" (as a list), and "health_tips" (as a list).
-
-            Invalid output to fix:
-            ```json
-            {llm_output}
-            ```
-            Return ONLY the corrected JSON object.
-            """
-            try:
-                fixed_json_str = self.llm.invoke(repair_prompt).strip()
-                logger.info(f"Attempted JSON repair. Fixed output: {fixed_json_str}")
-                return json.loads(fixed_json_str)
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse JSON even after repair attempt for {context_hint}. Error: {e}")
-                return f"Failed to parse JSON after repair attempt. Original output: {llm_output[:200]}..."
-            except Exception as e:
-                logger.error(f"An unexpected error occurred during JSON repair for {context_hint}: {e}", exc_info=True)
-                return f"An unexpected error occurred during JSON repair: {str(e)}"
+            repaired = generate_structured(self.llm, repair_prompt, WeatherAnalysis)
         except Exception as e:
-            logger.error(f"An unexpected error occurred during safe JSON parse for {context_hint}: {e}", exc_info=True)
-            return f"An unexpected error occurred during JSON parsing: {str(e)}"
+            logger.error(f"An unexpected error occurred during JSON repair for {context_hint}: {e}", exc_info=True)
+            return f"An unexpected error occurred during JSON repair: {str(e)}"
+        if repaired is None:
+            logger.error(f"Failed to parse JSON even after repair attempt for {context_hint}.")
+            return f"Failed to parse JSON after repair attempt. Original output: {llm_output[:200]}..."
+        return repaired.model_dump()
+
+
+def build_weather_scaffold(llm_model: str) -> AgentScaffold:
+    # Shared by every request; MeteredOllama lowers the timeout to each request's Deadline.
+    llm = MeteredOllama(model=llm_model, temperature=0.2, timeout=int(config.REQUEST_BUDGET_MAX))
+    return AgentScaffold(
+        llm,
+        WeatherTools(llm).as_tools(),
+        AgentType.OPENAI_FUNCTIONS,
+        agent_kwargs={
+            "system_message": SystemMessage(
+                content="You are a helpful and friendly weather assistant. "
+                        "Use the Weather Retriever tool to get weather, then the Weather Analyzer "
+                        "to provide a summary, activity suggestions, and health tips. "
+                        "Always aim to provide a comprehensive and user-friendly response."
+            )
+        },
+        verbose=True,
+        handle_parsing_errors=True,
+        max_iterations=7,
+        early_stopping_method="generate",
+    )
+
 
-    def run(self, query: str) -> Any:
+class WeatherAgent:
+    def __init__(self, user_id: str, session_id: str = "default", llm_model: str = "gemma3:12b"):
+        logger.info(f"Initializing WeatherAgent for user: {user_id}, session: {session_id} with model: {llm_model}")
+        self.user_id = user_id
+        self.session_id = session_id
+        # LLM, tools and the planner prompt are built once per model and shared.
+        scaffold = cached_scaffold(("weather_agent", llm_model), lambda: build_weather_scaffold(llm_model))
+        self.llm = scaffold.llm
+        
+        self.memory =  MongoConversationMemory(
+            session_id=session_id,
+            user_id=user_id
+        )
+
+        self.agent_executor = scaffold.executor(self.memory)
+        logger.info("WeatherAgent initialized successfully.")
+
+    def run(self, query: str, deadline: Deadline = None) -> Any:
         """Run the agent with a user query"""
+        return self.run_with_deadline(query, deadline)["output"]
+
+    def run_with_deadline(self, query: str, deadline: Deadline = None) -> Dict[str, Any]:
+        """Run the agent within ``deadline`` and report whether the answer is partial, with stage timings."""
         logger.info(f"Running agent for user '{self.user_id}' with query: '{query}'")
-        try:
-            response = self.agent_executor.invoke({"input": query})
-            final_output = response.get("output", "No response generated.")
-            logger.info(f"Agent finished. Final response: {final_output}")
-            return final_output
-        except Exception as e:
-            logger.error(f"Error running agent for query '{query}': {e}", exc_info=True)
-            return f"I encountered an error while processing your request: {str(e)}. Please try again."
\ No newline at end of file
+        deadline = deadline or Deadline(config.REQUEST_BUDGET)
+        handler = DeadlineCallbackHandler(deadline)
+        self.agent_executor.max_execution_time = max(1.0, deadline.remaining())
+        partial = False
+        with use_deadline(deadline):
+            try:
+                with deadline.stage("agent"):
+                    response = self.agent_executor.invoke({"input": query}, config={"callbacks": [handler]})
+                final_output = response.get("output", "No response generated.")
+                partial = deadline.expired
+                logger.info(f"Agent finished. Final response: {final_output}")
+            except DeadlineExceeded as e:
+                logger.warning(f"WeatherAgent ran out of time during {e.stage} for query: '{query}'")
+                partial = True
+                final_output = handler.last_observation or "The request ran out of time before an answer was ready."
+            except Exception as e:
+                logger.error(f"Error running agent for query '{query}': {e}", exc_info=True)
+                final_output = f"I encountered an error while processing your request: {str(e)}. Please try again."
+        return {"output": final_output, "partial": partial, "timings": deadline.summary()}
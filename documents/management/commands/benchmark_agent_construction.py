@@ -0,0 +1,57 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from langchain.agents import initialize_agent
+
+from core.config import config
+from core.document_agent import DocumentAgent, SYSTEM_MESSAGE, build_llm
+from core.mongo_conversational_memory import MongoConversationMemory
+from core.rag_service import LocalPDFVectorizer
+from core.tools import ToolFactory
+
+
+class Command(BaseCommand):
+    help = "Time DocumentAgent construction, rebuilding everything per request versus the shared scaffold."
+
+    def add_arguments(self, parser):
+        parser.add_argument("doc_id", type=int, help="Document whose index the agents are built against.")
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument("--user-id", default="benchmark")
+
+    def handle(self, *args, **options):
+        doc_id, iterations, user_id = options["doc_id"], options["iterations"], options["user_id"]
+
+        def legacy():
+            # What every request did before: new LLM client, tools and formatted planner prompt.
+            llm = build_llm()
+            memory = MongoConversationMemory(session_id="benchmark", user_id=user_id)
+            tools = ToolFactory.create_tools(LocalPDFVectorizer(doc_id), llm)
+            initialize_agent(
+                tools=tools,
+                llm=llm,
+                agent=config.AGENT_TYPE,
+                memory=memory,
+                agent_kwargs={"system_message": SYSTEM_MESSAGE, "return_intermediate_steps": False},
+                verbose=True,
+                handle_parsing_errors=True,
+                max_iterations=config.MAX_ITERATIONS,
+                early_stopping_method=config.EARLY_STOPPING_METHOD,
+            )
+
+        def cached():
+            DocumentAgent(user_id=user_id, session_id="benchmark", doc_id=doc_id)
+
+        # Warm up both paths so the one-off scaffold build and imports are not counted.
+        legacy()
+        cached()
+        for name, construct in (("per-request", legacy), ("scaffold", cached)):
+            samples = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                construct()
+                samples.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(
+                f"{name:>12}: mean {statistics.mean(samples):.2f} ms, "
+                f"p50 {statistics.median(samples):.2f} ms over {iterations} constructions"
+            )
@@ -0,0 +1,71 @@
+import re
+
+from django.core.management.base import BaseCommand
+from django_celery_results.models import TaskResult
+from mongoengine import get_db
+
+from chat.models import Message
+from core.chart_renderer import collect_garbage
+from core.config import config, document_config
+
+IMAGE_NAME = r"(?:chart|graph)_[0-9a-f]{32}\.png"
+
+
+class Command(BaseCommand):
+    help = "Delete rendered chart images that no stored conversation message or task result references."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--collection", default="conversations", help="Mongo conversation collection name.")
+        parser.add_argument("--min-age-hours", type=float, default=24,
+                            help="Keep images younger than this, they may belong to an answer still in flight.")
+        parser.add_argument("--include-legacy", action="store_true",
+                            help="Also sweep uuid-named graph PNGs written directly into MEDIA_ROOT.")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        referenced = self._referenced(options["collection"])
+        self.stdout.write(f"{len(referenced)} images are referenced by stored messages and task results")
+        min_age = options["min_age_hours"] * 60 * 60
+        if min_age < self.cache_retention():
+            # Answers cached in Redis can still hand out a chart URL until they expire.
+            min_age = self.cache_retention()
+            self.stdout.write(f"Keeping images younger than {min_age / 3600:g} hours, the longest cache TTL")
+        removed = collect_garbage(
+            referenced,
+            min_age=min_age,
+            include_legacy=options["include_legacy"],
+            dry_run=options["dry_run"],
+        )
+        verb = "Would remove" if options["dry_run"] else "Removed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(removed)} unreferenced images"))
+
+    @staticmethod
+    def cache_retention() -> float:
+        """Longest time a Redis-held response (idempotent replay, generation or answer cache) can be served."""
+        return max(
+            config.IDEMPOTENCY_TTL,
+            config.GENERATION_RESULT_TTL,
+            config.GENERATION_CACHE_TTL,
+            document_config.ANSWER_CACHE_TTL,
+        )
+
+    def _referenced(self, collection: str) -> set:
+        pattern = re.compile(IMAGE_NAME)
+        names = set()
+        contents = Message.objects.filter(content__regex=IMAGE_NAME).values_list("content", flat=True)
+        for content in contents.iterator():
+            names.update(pattern.findall(content))
+
+        db = get_db(alias="default")
+        # Bucketed messages plus headers that still embed messages (not yet migrated).
+        for name in (f"{collection}_buckets", collection):
+            cursor = db[name].find({"messages.content": {"$regex": IMAGE_NAME}}, {"messages.content": 1})
+            for document in cursor:
+                for message in document.get("messages", []):
+                    names.update(pattern.findall(str(message.get("content", ""))))
+
+        # Queued generations keep their response body in the django-db result backend.
+        results = TaskResult.objects.filter(result__regex=IMAGE_NAME).values_list("result", flat=True)
+        for result in results.iterator():
+            names.update(pattern.findall(result or ""))
+        return names
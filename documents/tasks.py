@@ -0,0 +1,56 @@
+import logging
+from contextlib import nullcontext
+
+from celery import shared_task
+
+from core.config import config
+from core.document_agent import DocumentAgent
+from core.document_artifacts import build_artifacts, save_artifacts
+from core.generation_queue import run_generation
+from core.rag_service import LocalPDFVectorizer
+from core.usage import MeteredOllama, use_user
+
+from .models import UploadedDocument
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, max_retries=2, default_retry_delay=60)
+def enrich_document(self, doc_id: int):
+    """Precompute a document's artifacts after it has been indexed."""
+    retriever = LocalPDFVectorizer(doc_id)
+    llm = MeteredOllama(model=config.LLM_MODEL, temperature=0)
+    # Enrichment is billed to the document's owner like their own questions are.
+    owner_id = UploadedDocument.objects.filter(pk=doc_id).values_list("user_id", flat=True).first()
+    try:
+        with use_user(owner_id) if owner_id is not None else nullcontext():
+            artifacts = build_artifacts(retriever, llm)
+    except FileNotFoundError:
+        logger.warning("Skipping enrichment for doc %s: no index", doc_id)
+        return None
+    except Exception as e:
+        logger.error("Enrichment failed for doc %s: %s", doc_id, e)
+        raise self.retry(exc=e)
+    if artifacts["index_version"] != retriever.index_version():
+        # Re-indexed while we were working; the newer upload schedules its own run.
+        logger.info("Discarding artifacts for doc %s: index changed during enrichment", doc_id)
+        return None
+    save_artifacts(retriever, artifacts)
+    return {"doc_id": doc_id, "sections": len(artifacts["outline"]), "questions": len(artifacts["question_bank"])}
+
+
+def answer_question(user_id, session_id: str, doc_id, question: str, deadline=None):
+    """Answer one document question; returns the ``DocumentAgentQueryView`` body and status code."""
+    with use_user(user_id):
+        agent = DocumentAgent(user_id=str(user_id), session_id=session_id, doc_id=doc_id)
+        return agent.ask(question, deadline=deadline), 200
+
+
+@shared_task(bind=True, name="documents.answer_question")
+def answer_question_task(self, user_id, session_id: str, doc_id, question: str, budget: float, enqueued_at: float,
+                         cache_bypass: bool = False):
+    return run_generation(
+        self.request.id, "documents", user_id, session_id, budget, enqueued_at,
+        lambda deadline: answer_question(user_id, session_id, doc_id, question, deadline),
+        cache_bypass=cache_bypass,
+    )
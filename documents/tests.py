@@ -1,3 +1,141 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from langchain_community.llms import Ollama
+from langchain_core.outputs import Generation, LLMResult
+
+from core.answer_cache import is_self_contained
+from core.config import document_config
+from core.deadline import Deadline, use_deadline
+from core.numeric_extraction import extract_numeric_data, extract_series, is_ambiguous, suggest_graph
+from core.question_bank import parse_request
+from core.structured_output import NumericData, _client, parse_structured, tolerant_json_loads
+from core.usage import MeteredOllama
+
+
+class QuestionRequestParsingTests(SimpleTestCase):
+    def test_count_comes_from_the_number_before_questions(self):
+        self.assertEqual(parse_request("5 MCQ questions about pricing", 3), (5, {"MCQ"}, {"pricing"}))
+        self.assertEqual(parse_request("give me 4 multiple choice questions", 3)[0], 4)
+        self.assertEqual(parse_request("one question", 3)[0], 3)
+
+    def test_other_numbers_are_not_a_count(self):
+        count, _, topic = parse_request("questions about 2023 revenue", 3)
+
+        self.assertEqual(count, 3)
+        self.assertEqual(topic, {"revenue"})
+
+    @mock.patch.object(document_config, "MAX_QUESTIONS", 20)
+    def test_count_is_capped(self):
+        self.assertEqual(parse_request("2023 questions", 3)[0], 20)
+        self.assertEqual(parse_request("0 questions", 3)[0], 1)
+
+
+class SharedLlmTimeoutTests(SimpleTestCase):
+    def _timeout_of_call(self, llm):
+        seen = []
+
+        def generate(self, prompts, stop=None, *args, **kwargs):
+            seen.append(self.timeout)
+            return LLMResult(generations=[[Generation(text="ok")]])
+
+        with mock.patch.object(Ollama, "_generate", generate):
+            llm.invoke("hello")
+        return seen[0]
+
+    def test_each_call_is_bounded_by_its_requests_deadline(self):
+        llm = MeteredOllama(model="test", timeout=300)
+
+        with use_deadline(Deadline(10)):
+            self.assertLessEqual(self._timeout_of_call(llm), 10)
+        self.assertEqual(self._timeout_of_call(llm), 300)
+        self.assertEqual(llm.timeout, 300)
+
+
+class NumericExtractionTests(SimpleTestCase):
+    def test_key_value_pairs_and_number_formats(self):
+        df = extract_series("Revenue: $1,200.50\nGrowth = +12%\nLoss - -3.5\nHeadcount: 42 people")
+
+        self.assertEqual(df["Label"].tolist(), ["Revenue", "Growth", "Loss", "Headcount"])
+        self.assertEqual(df["Value"].tolist(), [1200.5, 12.0, -3.5, 42.0])
+
+    def test_table_rows_need_a_wide_gap_and_key_value_lines_win(self):
+        text = "Region  Units  Target\nNorth  120  140\nSouth  80\nWest: 10\nEast 99"
+        df = extract_series(text)
+
+        self.assertEqual(df["Label"].tolist(), ["West", "North", "South"])
+        self.assertEqual(df["Value"].tolist(), [10.0, 120.0, 80.0])
+
+    def test_numbers_inside_words_and_versions_are_ignored(self):
+        self.assertTrue(extract_series("Model: v2.1.3\nCode: A12B").empty)
+        self.assertEqual(extract_numeric_data("No figures in here at all."), {})
+
+    def test_duplicate_labels_keep_the_first_value(self):
+        df = extract_series("Sales: 10\nSales: 20")
+        self.assertEqual(df["Value"].tolist(), [10.0])
+
+    def test_graph_suggestion(self):
+        years = extract_series("2021: 5\n2022: 7\n2023: 9")
+        shares = extract_series("Rent: 50%\nFood: 30%\nOther: 20%")
+        counts = extract_series("Apples: 3\nPears: 9")
+
+        self.assertEqual(suggest_graph(years), "line")
+        self.assertEqual(suggest_graph(shares), "pie")
+        self.assertEqual(suggest_graph(counts), "bar")
+
+    def test_bare_number_labels_are_ambiguous_but_years_are_not(self):
+        self.assertTrue(is_ambiguous(extract_series("1: 10\n2: 20")))
+        self.assertFalse(is_ambiguous(extract_series("2021: 10\n2022: 20")))
+
+    def test_result_matches_the_numeric_data_schema(self):
+        data = extract_numeric_data("Q1: 10\nQ2: 20\nQ3: 30")
+
+        self.assertEqual(data["analysis"]["sum"], 60.0)
+        self.assertIsNotNone(NumericData.model_validate(data))
+
+
+class TolerantJsonTests(SimpleTestCase):
+    def test_plain_json(self):
+        self.assertEqual(tolerant_json_loads('{"a": 1}'), {"a": 1})
+
+    def test_code_fence_and_surrounding_prose(self):
+        text = 'Here you go:\n```json\n{"labels": ["a"], "values": [1]}\n```\nHope that helps.'
+        self.assertEqual(tolerant_json_loads(text), {"labels": ["a"], "values": [1]})
+
+    def test_trailing_commas_and_smart_quotes(self):
+        self.assertEqual(tolerant_json_loads("{“a”: [1, 2,],}"), {"a": [1, 2]})
+
+    def test_python_literals_and_single_quotes(self):
+        self.assertEqual(tolerant_json_loads("{'a': True, 'b': None, 'c': false}"), {"a": True, "b": None, "c": False})
+
+    def test_brackets_inside_strings_do_not_end_the_block(self):
+        self.assertEqual(tolerant_json_loads('Result: {"text": "a } b", "n": 1} trailing'), {"text": "a } b", "n": 1})
+
+    def test_already_parsed_data_and_garbage(self):
+        self.assertEqual(tolerant_json_loads([1, 2]), [1, 2])
+        self.assertIsNone(tolerant_json_loads("no json here"))
+        self.assertIsNone(tolerant_json_loads("{broken: [}"))
+        self.assertIsNone(tolerant_json_loads(None))
+
+    def test_parse_structured_validates_against_the_schema(self):
+        parsed = parse_structured('```{"labels": ["a", "b"], "values": [1, 2],}```', NumericData)
+        self.assertEqual(parsed.values, [1.0, 2.0])
+        self.assertIsNone(parse_structured('{"labels": ["a"], "values": [1, 2]}', NumericData))
+
+
+class SchemaClientTests(SimpleTestCase):
+    def test_schema_calls_time_out_with_the_request(self):
+        llm = MeteredOllama(model="test", timeout=300)
+        with mock.patch("core.structured_output.ollama_client.Client") as client:
+            with use_deadline(Deadline(10)):
+                _client(llm)
+            self.assertLessEqual(client.call_args.kwargs["timeout"], 10)
+
+
+class AnswerCacheEligibilityTests(SimpleTestCase):
+    def test_follow_ups_are_not_cached(self):
+        for question in ("tell me more", "Why?", "What does it say about pricing?", "summarize that again"):
+            self.assertFalse(is_self_contained(question), question)
+
+    def test_standalone_questions_are(self):
+        self.assertTrue(is_self_contained("What is the refund policy for annual plans?"))
@@ -4,11 +4,17 @@ from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 import os
 
-from core.document_agent import DocumentAgent
+from core.deadline import Deadline
+from core.idempotency import idempotent_response
+from core.generation_cache import bypass_requested, use_bypass
+from core.generation_queue import enqueue, is_async
+from core.usage import LLMQuotaThrottle
 
 from .models import UploadedDocument
 from .serializers import UploadedDocumentSerializer
 from core.rag_service import LocalPDFVectorizer
+from core.config import document_config
+from .tasks import answer_question, answer_question_task, enrich_document
 
 class DocumentUploadView(APIView):
     permission_classes = [IsAuthenticated]
@@ -22,16 +28,20 @@ class DocumentUploadView(APIView):
             vectorizer = LocalPDFVectorizer(doc_id=doc.id)
             chunks = vectorizer.load_and_split_pdf(file_path)
             vectorizer.create_faiss_index(chunks)
+            if document_config.ENRICH_ON_UPLOAD:
+                enrich_document.delay(doc.id)
 
             return Response({
                 "message": "File uploaded and vectorized",
-                "doc_id": doc.id
+                "doc_id": doc.id,
+                "enrichment_scheduled": document_config.ENRICH_ON_UPLOAD
             })
         return Response(serializer.errors, status=400)
 
 
 class DocumentAgentQueryView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [LLMQuotaThrottle]
 
     def post(self, request,session_id, *args, **kwargs):
         question = request.data.get("question")
@@ -40,10 +50,20 @@ class DocumentAgentQueryView(APIView):
         if not question:
             return Response({"error": "Question is required"}, status=400)
 
-        agent = DocumentAgent(
-            user_id=str(request.user.id),
-            session_id=session_id,
-            doc_id=doc_id,
+        deadline = Deadline.from_request(request)
+
+        if is_async():
+            def answer():
+                return enqueue(
+                    request, answer_question_task, "documents", deadline,
+                    user_id=request.user.id, session_id=session_id, doc_id=doc_id, question=question,
+                )
+        else:
+            def answer():
+                with use_bypass(bypass_requested(request)):
+                    return Response(*answer_question(request.user.id, session_id, doc_id, question, deadline))
+
+        return idempotent_response(
+            request, "documents", session_id, {"question": question, "doc_id": doc_id}, answer, deadline,
+            lock_session=not is_async()
         )
-        result = agent.ask(question)
-        return Response(result)
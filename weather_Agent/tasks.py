@@ -0,0 +1,39 @@
+import logging
+
+from celery import shared_task
+from rest_framework import status
+
+from core.generation_queue import run_generation
+from core.usage import use_user
+from core.weather_agent import WeatherAgent
+
+logger = logging.getLogger(__name__)
+
+
+def answer_question(user_id, session_id: str, question: str, deadline=None, details: bool = False):
+    """Answer one weather question; returns the ``WeatherAgentQueryView`` body and status code.
+
+    The body is the answer itself, as it always was; with ``details`` it is
+    ``{"output", "partial", "timings"}`` instead.
+    """
+    try:
+        agent = WeatherAgent(
+            user_id=str(user_id),
+            session_id=session_id,
+        )
+        with use_user(user_id):
+            result = agent.run_with_deadline(question, deadline=deadline)
+        return (result if details else result["output"]), status.HTTP_200_OK
+    except Exception as e:
+        logger.error("Error answering weather question: %s", str(e))
+        return {"error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+@shared_task(bind=True, name="weather_Agent.answer_question")
+def answer_question_task(self, user_id, session_id: str, question: str, budget: float, enqueued_at: float,
+                         cache_bypass: bool = False, details: bool = False):
+    return run_generation(
+        self.request.id, "weather", user_id, session_id, budget, enqueued_at,
+        lambda deadline: answer_question(user_id, session_id, question, deadline, details),
+        cache_bypass=cache_bypass,
+    )
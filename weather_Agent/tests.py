@@ -1,3 +1,35 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from core.structured_output import WeatherAnalysis, parse_structured
+
+from .tasks import answer_question
+
+
+class WeatherAnalysisParsingTests(SimpleTestCase):
+    def test_analysis_wrapped_in_prose_is_parsed(self):
+        text = (
+            "Sure! Here is the analysis:\n"
+            "{'summary': 'Sunny, 24°C', 'activities': ['hiking', 'cycling',], 'health_tips': ['wear sunscreen']}"
+        )
+        analysis = parse_structured(text, WeatherAnalysis)
+
+        self.assertEqual(analysis.summary, "Sunny, 24°C")
+        self.assertEqual(analysis.activities, ["hiking", "cycling"])
+
+    def test_missing_fields_are_rejected(self):
+        self.assertIsNone(parse_structured('{"summary": "Rain"}', WeatherAnalysis))
+
+
+@mock.patch("weather_Agent.tasks.WeatherAgent")
+class AnswerQuestionTests(SimpleTestCase):
+    result = {"output": "Sunny all day.", "partial": False, "timings": {"stages": []}}
+
+    def test_body_is_the_bare_answer_by_default(self, agent):
+        agent.return_value.run_with_deadline.return_value = self.result
+        self.assertEqual(answer_question(1, "s1", "Weather in Paris?"), ("Sunny all day.", 200))
+
+    def test_details_are_opt_in(self, agent):
+        agent.return_value.run_with_deadline.return_value = self.result
+        self.assertEqual(answer_question(1, "s1", "Weather in Paris?", details=True), (self.result, 200))
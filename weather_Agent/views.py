@@ -4,12 +4,19 @@ from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 
 
-from core.weather_agent import WeatherAgent
+from core.deadline import Deadline
+from core.idempotency import idempotent_response
+from core.generation_cache import bypass_requested, use_bypass
+from core.generation_queue import enqueue, is_async
+from core.usage import LLMQuotaThrottle
+
+from .tasks import answer_question, answer_question_task
 import logging
 logger = logging.getLogger(__name__)
 
 class WeatherAgentQueryView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [LLMQuotaThrottle]
 
     def post(self, request, session_id, *args, **kwargs):
         question = request.data.get("question")
@@ -17,13 +24,22 @@ class WeatherAgentQueryView(APIView):
         if not question:
             return Response({"error": "Question is required"}, status=400)
 
-        try:
-            agent = WeatherAgent(
-                user_id=str(request.user.id),
-                session_id=session_id,
-            )
-            result = agent.run(question)
-            return Response(result, status=status.HTTP_200_OK)
-        except Exception as e:
-            logger.error("Error in WeatherAgentQueryView: %s", str(e))
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+        deadline = Deadline.from_request(request)
+        # Opt-in: existing clients keep receiving the bare answer.
+        details = str(request.data.get("details", "")).lower() in ("1", "true")
+
+        if is_async():
+            def answer():
+                return enqueue(
+                    request, answer_question_task, "weather", deadline,
+                    user_id=request.user.id, session_id=session_id, question=question, details=details,
+                )
+        else:
+            def answer():
+                with use_bypass(bypass_requested(request)):
+                    return Response(*answer_question(request.user.id, session_id, question, deadline, details))
+
+        return idempotent_response(
+            request, "weather", session_id, {"question": question, "details": details}, answer, deadline,
+            lock_session=not is_async()
+        )
\ No newline at end of file